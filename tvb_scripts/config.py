@@ -150,16 +150,61 @@ class CalculusConfig(object):
     # If True a plot will be generated to choose the number of eigenvalues to keep
     INTERACTIVE_ELBOW_POINT = False
 
+    # Memory budget (in bytes) of a single data slab for out-of-core (i.e., chunked) computations
+    MAX_SLAB_BYTES = 2 ** 27
+
+    # Maximum number of samples per signal kept for the computation of (approximate, if exceeded) percentiles
+    STATISTICS_RESERVOIR_SIZE = 10000
+
     MIN_SINGLE_VALUE = numpy.finfo("single").min
     MAX_SINGLE_VALUE = numpy.finfo("single").max
     MAX_INT_VALUE = numpy.iinfo(numpy.int64).max
     MIN_INT_VALUE = numpy.iinfo(numpy.int64).max
 
 
+class H5Config(object):
+    # Storage policy of the datasets written by H5Writer, which can be overridden per writer or per call.
+    # By default, datasets are contiguous and uncompressed, so that they can be memory mapped.
+
+    # "auto" for chunks tuned to time-major access, a chunk shape tuple, or None for contiguous datasets
+    CHUNKS = None
+    # Target size (in bytes) of a single automatically computed chunk
+    CHUNK_BYTES = 2 ** 20
+    # Datasets smaller than this (in bytes) are always written contiguous and uncompressed
+    MIN_CHUNKED_BYTES = 2 ** 16
+
+    # "gzip", "lzf", or None for no compression, and the gzip level.
+    # Compression applies only to chunked datasets
+    COMPRESSION = None
+    COMPRESSION_OPTS = 4
+    # Byte shuffle filter, which improves the compression of numeric data
+    SHUFFLE = True
+
+    # If True, float64 datasets are downcast to float32, except for those in FLOAT64_DATASETS
+    FLOAT32 = False
+    FLOAT64_DATASETS = ("time", "start_time", "sample_period")
+
+    # Flush policy of TimeSeries streams: flush to disk after so many appended time points or seconds,
+    # whichever comes first (None to disable either criterion)
+    STREAM_FLUSH_SAMPLES = 10000
+    STREAM_FLUSH_SECONDS = 10.0
+
+    # Maximum number of open files kept by the process-wide pool of H5 file handles,
+    # and whether read-only and writable files are kept open (instead of being closed) when no longer in use.
+    # Files kept open cannot be written by other processes, or by other libraries, until the pool closes them.
+    FILE_POOL_SIZE = 32
+    FILE_POOL_KEEP_READABLE = False
+    FILE_POOL_KEEP_WRITABLE = False
+
+    # Numeric datasets of at least this size (in bytes) are deduplicated, if the H5Writer uses an H5BlobStore
+    DEDUP_MIN_BYTES = 2 ** 20
+
+
 class Config(object):
     generic = GenericConfig()
     figures = FiguresConfig()
     calcul = CalculusConfig()
+    h5 = H5Config()
 
     def __init__(self, head_folder=None, raw_data_folder=None, output_base=None, separate_by_run=False):
         self.input = InputConfig(head_folder, raw_data_folder)
@@ -1,10 +1,10 @@
 # coding=utf-8
+import h5py
 import numpy as np
 from tvb_scripts.utils.log_error_utils import warning
 from tvb_scripts.utils.data_structures_utils import labels_to_inds
 
 from tvb.basic.neotraits.api import HasTraits
-from tvb.basic.readers import H5Reader
 
 
 class BaseModel(HasTraits):
@@ -37,18 +37,24 @@ class BaseModel(HasTraits):
         return cls()._copy_from_instance(instance, **kwargs)
 
     @classmethod
-    def from_h5_file(cls, source_file, **kwargs):
+    def from_h5_file(cls, source_file, fields=None, **kwargs):
+        """
+        Set the attributes of a new instance from the homonymous root datasets of an H5 file.
+        :param source_file: the H5 file path
+        :param fields: the names of the datasets to be read, default: all those that are attributes of the class
+        """
         result = cls()
-        reader = H5Reader(source_file)
-        for attr in dir(result):
-            try:
-                val = reader.read_field(attr)
-            except:
-                continue
-            if isinstance(val, np.ndarray) and val.dtype == "O":
-                setattr(result, attr, np.array([np.str(v) for v in val]))
-            else:
-                setattr(result, attr, val)
+        attributes = set(dir(result))
+        with h5py.File(source_file, 'r', libver='latest') as h5_file:
+            for attr, dataset in h5_file.items():
+                if attr not in attributes or not isinstance(dataset, h5py.Dataset) or \
+                        (fields is not None and attr not in fields) or attr in kwargs:
+                    continue
+                val = dataset[()]
+                if isinstance(val, np.ndarray) and val.dtype == "O":
+                    setattr(result, attr, np.array([np.str(v) for v in val]))
+                else:
+                    setattr(result, attr, val)
         for attr, value in kwargs.items():
             setattr(result, attr, value)
         return result
@@ -9,7 +9,8 @@ from tvb_scripts.datatypes.base import BaseModel
 from tvb_scripts.datatypes.connectivity import Connectivity
 from tvb_scripts.datatypes.local_connectivity import LocalConnectivity
 from tvb_scripts.datatypes.surface import Surface, CorticalSurface, SubcorticalSurface
-from tvb_scripts.datatypes.region_mapping import CorticalRegionMapping, SubcorticalRegionMapping, RegionVolumeMapping
+from tvb_scripts.datatypes.region_mapping import RegionMapping, CorticalRegionMapping, SubcorticalRegionMapping, \
+    RegionVolumeMapping
 from tvb_scripts.datatypes.structural import T1, T2, Flair, B0
 from tvb_scripts.datatypes.sensors import SensorsEEG, SensorsSEEG, SensorsMEG
 from tvb_scripts.datatypes.projections import ProjectionSurfaceEEG, ProjectionSurfaceSEEG, ProjectionSurfaceMEG
@@ -293,6 +294,27 @@ class Head(HasTraits):
     def surface(self):
         return self.cortical_surface
 
+    def get_region_mapping(self, subcortical=False):
+        """
+        Return the cortical (or subcortical) region mapping as a tvb-scripts RegionMapping,
+        converting (and replacing) a TVB one, so that its mapping operators can be cached.
+        """
+        name = "subcortical_region_mapping" if subcortical else "cortical_region_mapping"
+        region_mapping = getattr(self, name)
+        if not isinstance(region_mapping, TVBRegionMapping):
+            raise_value_error("There is no %s in head!" % name)
+        if not isinstance(region_mapping, RegionMapping):
+            datatype = SubcorticalRegionMapping if subcortical else CorticalRegionMapping
+            region_mapping = datatype.from_tvb_instance(region_mapping)
+            setattr(self, name, region_mapping)
+        return region_mapping
+
+    def get_region_averaging_operator(self, area_weighted=False, subcortical=False):
+        return self.get_region_mapping(subcortical).get_region_averaging_operator(area_weighted)
+
+    def get_vertex_broadcasting_operator(self, subcortical=False):
+        return self.get_region_mapping(subcortical).get_vertex_broadcasting_operator()
+
     @property
     def number_of_regions(self):
         return self.connectivity.number_of_regions
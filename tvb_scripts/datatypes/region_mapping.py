@@ -1,12 +1,93 @@
 # coding=utf-8
 
+import numpy as np
+
 from tvb_scripts.datatypes.base import BaseModel
+from tvb_scripts.datatypes.surface import compute_vertex_metrics
 from tvb.datatypes.region_mapping import RegionMapping as TVBRegionMapping
 from tvb.datatypes.region_mapping import RegionVolumeMapping as TVBRegionVolumeMapping
 
 
+def compute_region_averaging_operator(array_data, n_regions=None, vertex_weights=None):
+    """
+    Build the sparse (regions x vertices) operator averaging vertices' values to their regions,
+    optionally weighted by vertex_weights (e.g., the vertices' areas).
+    Regions without vertices have all zero rows.
+    """
+    from scipy.sparse import csr_matrix
+    array_data = np.asarray(array_data, dtype=np.int64)
+    if n_regions is None:
+        n_regions = int(array_data.max()) + 1
+    n_vertices = array_data.shape[0]
+    if vertex_weights is None:
+        vertex_weights = np.ones((n_vertices,))
+    regions_weights = np.bincount(array_data, weights=vertex_weights, minlength=n_regions)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(regions_weights[array_data] > 0.0, vertex_weights / regions_weights[array_data], 0.0)
+    return csr_matrix((weights, (array_data, np.arange(n_vertices))), shape=(n_regions, n_vertices))
+
+
+def compute_vertex_broadcasting_operator(array_data, n_regions=None):
+    """
+    Build the sparse (vertices x regions) operator assigning to each vertex the value of its region.
+    """
+    from scipy.sparse import csr_matrix
+    array_data = np.asarray(array_data, dtype=np.int64)
+    if n_regions is None:
+        n_regions = int(array_data.max()) + 1
+    n_vertices = array_data.shape[0]
+    return csr_matrix((np.ones((n_vertices,)), (np.arange(n_vertices), array_data)), shape=(n_vertices, n_regions))
+
+
 class RegionMapping(TVBRegionMapping, BaseModel):
 
+    # Cache of the sparse mapping operators, which is invalidated whenever array_data, connectivity or surface are set:
+    _operators = None
+
+    def __setattr__(self, key, value):
+        if key in ["array_data", "connectivity", "surface"]:
+            super(RegionMapping, self).__setattr__("_operators", None)
+        super(RegionMapping, self).__setattr__(key, value)
+
+    @property
+    def operators(self):
+        if self._operators is None:
+            self._operators = {}
+        return self._operators
+
+    @property
+    def number_of_regions(self):
+        connectivity = getattr(self, "connectivity", None)
+        if connectivity is not None and getattr(connectivity, "region_labels", None) is not None:
+            return len(connectivity.region_labels)
+        return int(self.array_data.max()) + 1
+
+    def _get_vertex_areas(self):
+        if hasattr(self.surface, "get_vertex_areas"):
+            return self.surface.get_vertex_areas()
+        return compute_vertex_metrics(self.surface.vertices, self.surface.triangles)["vertex_areas"]
+
+    def get_region_averaging_operator(self, area_weighted=False):
+        """
+        Return the cached sparse (regions x vertices) operator averaging surface data to the regions,
+        with weights proportional to the vertices' areas, if area_weighted is True.
+        """
+        key = "area_weighted_averaging" if area_weighted else "averaging"
+        if key not in self.operators:
+            self.operators[key] = \
+                compute_region_averaging_operator(self.array_data, self.number_of_regions,
+                                                  self._get_vertex_areas() if area_weighted else None)
+        return self.operators[key]
+
+    def get_vertex_broadcasting_operator(self):
+        """
+        Return the cached sparse (vertices x regions) operator broadcasting region data back to the vertices.
+        """
+        if "broadcasting" not in self.operators:
+            self.operators["broadcasting"] = \
+                compute_vertex_broadcasting_operator(self.array_data, self.number_of_regions)
+        return self.operators["broadcasting"]
+
     def to_tvb_instance(self, datatype=TVBRegionMapping, **kwargs):
         return super(RegionMapping, self).to_tvb_instance(datatype, **kwargs)
 
@@ -22,4 +103,4 @@ class SubcorticalRegionMapping(RegionMapping):
 class RegionVolumeMapping(TVBRegionVolumeMapping, BaseModel):
 
     def to_tvb_instance(self, **kwargs):
-        return super(RegionVolumeMapping, self).to_tvb_instance(TVBRegionVolumeMapping, **kwargs)
\ No newline at end of file
+        return super(RegionVolumeMapping, self).to_tvb_instance(TVBRegionVolumeMapping, **kwargs)
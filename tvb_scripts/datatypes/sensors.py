@@ -5,7 +5,7 @@ import numpy as np
 
 from tvb_scripts.utils.log_error_utils import warning
 from tvb_scripts.utils.data_structures_utils import ensure_list, \
-    labels_to_inds, monopolar_to_bipolar, split_string_text_numbers
+    labels_to_inds, split_string_text_numbers, parse_sensors_labels, bipolar_montage, LabelsIndex
 from tvb_scripts.datatypes.base import BaseModel
 
 from tvb.basic.neotraits.api import Attr, NArray
@@ -31,6 +31,21 @@ class Sensors(TVBSensors, BaseModel):
         default='', required=False,
         doc="Sensors' name")
 
+    # Caches of quantities derived from the labels, which are invalidated whenever labels are set:
+    _parsed_labels = None
+    _labels_index = None
+    _bipolar_montage = None
+
+    def __setattr__(self, key, value):
+        if key == "labels":
+            self._clear_labels_caches()
+        super(Sensors, self).__setattr__(key, value)
+
+    def _clear_labels_caches(self):
+        self._parsed_labels = None
+        self._labels_index = None
+        self._bipolar_montage = None
+
     def configure(self, remove_leading_zeros_from_labels=False):
         if len(self.labels) > 0:
                 if remove_leading_zeros_from_labels:
@@ -40,14 +55,20 @@ class Sensors(TVBSensors, BaseModel):
     def sensor_label_to_index(self, labels):
         return self.labels2inds(self.labels, labels)
 
+    @property
+    def labels_index(self):
+        if self._labels_index is None:
+            self._labels_index = LabelsIndex(self.labels, ngram=0)
+        return self._labels_index
+
     def get_sensors_inds_by_sensors_labels(self, lbls):
         # Make sure that the labels are not bipolar:
         lbls = [label.split("-")[0] for label in ensure_list(lbls)]
-        return labels_to_inds(self._tvb.labels, lbls)
+        return labels_to_inds(self.labels_index, lbls)
 
     def remove_leading_zeros_from_labels(self):
         labels = []
-        for label in self._tvb.labels:
+        for label in self.labels:
             splitLabel = split_string_text_numbers(label)[0]
             n_lbls = len(splitLabel)
             if n_lbls > 0:
@@ -59,12 +80,29 @@ class Sensors(TVBSensors, BaseModel):
                     labels.append(elec_name)
             else:
                 labels.append(label)
-        self._tvb.labels = np.array(labels)
+        self.labels = np.array(labels)
+
+    @property
+    def parsed_labels(self):
+        # The labels' electrodes' names and contacts' numbers, parsed once:
+        if self._parsed_labels is None:
+            self._parsed_labels = parse_sensors_labels(self.labels)
+        return self._parsed_labels
+
+    def get_bipolar_montage(self, sensors_inds=None):
+        """
+        Return the bipolar labels, the pairs' indices and the sparse (bipolar sensors x sensors) difference operator,
+        which is cached for the montage of all sensors.
+        """
+        if sensors_inds is not None:
+            return bipolar_montage(self.labels, sensors_inds, self.parsed_labels)
+        if self._bipolar_montage is None:
+            self._bipolar_montage = bipolar_montage(self.labels, parsed_labels=self.parsed_labels)
+        return self._bipolar_montage
 
     def get_bipolar_sensors(self, sensors_inds=None):
-        if sensors_inds is None:
-            sensors_inds = range(self.number_of_sensors)
-        return monopolar_to_bipolar(self.labels, sensors_inds)
+        bipolar_lbls, bipolar_inds = self.get_bipolar_montage(sensors_inds)[:2]
+        return bipolar_lbls, bipolar_inds
 
     def to_tvb_instance(self, datatype=TVBSensors, **kwargs):
         return super(Sensors, self).to_tvb_instance(datatype, **kwargs)
@@ -89,9 +127,18 @@ class SensorsInternal(Sensors, TVBSensorsInternal):
         doc="""Labels of electrodes.""")
 
     elec_inds = NArray(
-        dtype=np.int,
+        dtype=object,
         label="Electrodes' indices", default=None, required=False,
-        doc="""Indices of electrodes.""")
+        doc="""Indices of electrodes, i.e., the array of the sensors' indices of each electrode.""")
+
+    sensors_elec_inds = NArray(
+        dtype=np.int,
+        label="Sensors' electrodes' indices", default=None, required=False,
+        doc="""Indices of the electrodes of the sensors.""")
+
+    # Cache of the electrodes' labels, the sensors' electrodes' indices,
+    # the electrodes' sensors' indices and the electrodes' labels index, which is invalidated whenever labels are set:
+    _electrodes_index = None
 
     @property
     def number_of_electrodes(self):
@@ -108,38 +155,62 @@ class SensorsInternal(Sensors, TVBSensorsInternal):
     def channel_inds(self):
         return self.elec_inds
 
+    @property
+    def has_electrodes(self):
+        return self.sensors_type in [SensorTypes.TYPE_SEEG.value, SensorTypes.TYPE_INTERNAL.value]
+
+    def _clear_labels_caches(self):
+        super(SensorsInternal, self)._clear_labels_caches()
+        self._electrodes_index = None
+
+    def _compute_electrodes_index(self, electrodes):
+        elec_labels, sensors_elec_inds = np.unique(electrodes, return_inverse=True)
+        # Group the sensors by electrode via a stable sort of their electrodes' indices:
+        sensors_inds = np.argsort(sensors_elec_inds, kind="stable")
+        elecs_sensors_inds = np.split(sensors_inds,
+                                      np.cumsum(np.bincount(sensors_elec_inds, minlength=len(elec_labels)))[:-1])
+        return elec_labels, sensors_elec_inds, elecs_sensors_inds, LabelsIndex(elec_labels, ngram=0)
+
+    @property
+    def electrodes_index(self):
+        if self._electrodes_index is None:
+            self._electrodes_index = self._compute_electrodes_index(self.parsed_labels[0])
+        return self._electrodes_index
+
     def configure(self):
         super(SensorsInternal, self).configure()
-        if self.number_of_sensors > 0:
-            self.elec_labels, self.elec_inds = self.group_sensors_to_electrodes()
+        if self.number_of_sensors > 0 and self.has_electrodes:
+            self.elec_labels, self.sensors_elec_inds, elecs_sensors_inds = self.electrodes_index[:3]
+            self.elec_inds = np.empty((len(elecs_sensors_inds),), dtype=object)
+            self.elec_inds[:] = elecs_sensors_inds
         else:
             self.elec_labels = None
             self.elec_inds = None
+            self.sensors_elec_inds = None
 
     def get_elecs_inds_by_elecs_labels(self, lbls):
-        if self.elec_labels is not None:
-            return labels_to_inds(self.elec_labels, lbls)
+        if self.has_electrodes and self.number_of_sensors > 0:
+            return labels_to_inds(self.electrodes_index[3], lbls)
         else:
             return None
 
     def get_sensors_inds_by_elec_labels(self, lbls):
         elec_inds = self.get_elecs_inds_by_elecs_labels(lbls)
         if elec_inds is not None:
-            sensors_inds = []
-            for ind in elec_inds:
-                sensors_inds += self.elec_inds[ind]
-            return np.unique(sensors_inds)
+            elecs_sensors_inds = self.electrodes_index[2]
+            return np.unique(np.concatenate([elecs_sensors_inds[ind] for ind in ensure_list(elec_inds)]))
 
     def group_sensors_to_electrodes(self, labels=None):
-        if self.sensors_type == SensorTypes.TYPE_SEEG:
+        """
+        Return the electrodes' labels and the list of the sensors' indices of each electrode.
+        """
+        if self.has_electrodes:
             if labels is None:
-                labels = self.labels
-            sensor_names = np.array(split_string_text_numbers(labels))
-            elec_labels = np.unique(sensor_names[:, 0])
-            elec_inds = []
-            for chlbl in elec_labels:
-                elec_inds.append(np.where(sensor_names[:, 0] == chlbl)[0])
-            return np.array(elec_labels), np.array(elec_inds)
+                elec_labels, _, elecs_sensors_inds = self.electrodes_index[:3]
+            else:
+                elec_labels, _, elecs_sensors_inds = \
+                    self._compute_electrodes_index(parse_sensors_labels(labels)[0])[:3]
+            return np.array(elec_labels), elecs_sensors_inds
         else:
             warning("No multisensor electrodes for %s sensors!" % self.sensors_type)
             return self.elec_labels, self.elec_inds
@@ -148,10 +219,11 @@ class SensorsInternal(Sensors, TVBSensorsInternal):
         try:
             bipolar_sensors_lbls = []
             bipolar_sensors_inds = []
-            if self.elecs_inds is None:
+            if self.elec_inds is None:
                 return None
+            elecs_sensors_inds = self.electrodes_index[2]
             for elec_ind in elecs:
-                curr_inds, curr_lbls = self.get_bipolar_sensors(sensors_inds=self.elec_inds[elec_ind])
+                curr_lbls, curr_inds = self.get_bipolar_sensors(sensors_inds=elecs_sensors_inds[elec_ind])
                 bipolar_sensors_inds.append(curr_inds)
                 bipolar_sensors_lbls.append(curr_lbls)
         except:
@@ -2,6 +2,7 @@
 
 import numpy as np
 
+from tvb_scripts.utils.log_error_utils import warning
 from tvb_scripts.datatypes.base import BaseModel
 from tvb.basic.neotraits.api import NArray, Attr
 from tvb.datatypes.surfaces import Surface as TVBSurface
@@ -14,6 +15,57 @@ from tvb.datatypes.surfaces import EEGCap as TVBEEGCap
 from tvb.datatypes.surfaces import FaceSurface as TVBFaceSurface
 
 
+def compute_triangle_metrics(vertices, triangles):
+    """
+    Compute the areas, the normals and the inner angles (at each one of their vertices) of all triangles of a mesh.
+    """
+    triangles_vertices = vertices[triangles]
+    cross = np.cross(triangles_vertices[:, 1] - triangles_vertices[:, 0],
+                     triangles_vertices[:, 2] - triangles_vertices[:, 0])
+    norms = np.sqrt(np.sum(cross ** 2, axis=1))
+    metrics = {"triangle_areas": norms / 2.0}
+    # Degenerate triangles keep their zero cross product as normal:
+    nonzero = norms > 0.0
+    cross[nonzero] /= norms[nonzero, np.newaxis]
+    metrics["triangle_normals"] = cross
+    edges1 = np.roll(triangles_vertices, -1, axis=1) - triangles_vertices
+    edges2 = np.roll(triangles_vertices, -2, axis=1) - triangles_vertices
+    metrics["triangle_angles"] = np.arctan2(np.sqrt(np.sum(np.cross(edges1, edges2) ** 2, axis=2)),
+                                            np.sum(edges1 * edges2, axis=2))
+    return metrics
+
+
+def compute_vertex_metrics(vertices, triangles, triangle_areas=None, triangle_normals=None, triangle_angles=None):
+    """
+    Compute the areas (a third of the areas of their triangles) and the normals of all vertices of a mesh,
+    accumulating the triangles' metrics via np.bincount over the flattened triangles.
+    """
+    if triangle_areas is None or triangle_normals is None or triangle_angles is None:
+        triangle_metrics = compute_triangle_metrics(vertices, triangles)
+        triangle_areas = triangle_metrics["triangle_areas"]
+        triangle_normals = triangle_metrics["triangle_normals"]
+        triangle_angles = triangle_metrics["triangle_angles"]
+    n_vertices = vertices.shape[0]
+    triangles = triangles.ravel()
+    metrics = {"vertex_areas": np.bincount(triangles, weights=np.repeat(triangle_areas / 3.0, 3),
+                                           minlength=n_vertices)}
+    # Vertex normals are the sums of the normals of their triangles, weighted by the angles they subtend:
+    weighted_normals = np.repeat(triangle_normals, 3, axis=0) * triangle_angles.reshape((-1, 1))
+    vertex_normals = np.stack([np.bincount(triangles, weights=weighted_normals[:, i], minlength=n_vertices)
+                               for i in range(3)], axis=1)
+    norms = np.sqrt(np.sum(vertex_normals ** 2, axis=1))
+    good = norms > 0.0
+    vertex_normals[good] /= norms[good, np.newaxis]
+    if not np.all(good):
+        # If normals are bad, default to position vector, as TVB does:
+        bad_vertices = vertices[~good]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vertex_normals[~good] = bad_vertices / np.sqrt(np.sum(bad_vertices ** 2, axis=1))[:, np.newaxis]
+        warning("%d vertices have bad normals!" % np.sum(~good))
+    metrics["vertex_normals"] = vertex_normals
+    return metrics
+
+
 class Surface(TVBSurface, BaseModel):
 
     vox2ras = NArray(
@@ -21,37 +73,140 @@ class Surface(TVBSurface, BaseModel):
         label="vox2ras", default=np.array([]), required=False,
         doc="""Voxel to RAS coordinates transformation array.""")
 
-    def get_vertex_normals(self):
+    # Caches of the mesh metrics (i.e., triangles' and vertices' areas and normals) and of the levels of detail,
+    # which are invalidated, together with TVB's mesh caches, whenever vertices or triangles are set:
+    _metrics = None
+    _lods = None
+    _mesh_caches = ["_metrics", "_lods", "_vertex_neighbours", "_vertex_triangles", "_triangle_centres", "_triangle_angles",
+                    "_triangle_areas", "_edges", "_number_of_edges", "_edge_lengths", "_edge_triangles"]
+
+    def __setattr__(self, key, value):
+        if key in ["vertices", "triangles"]:
+            for cache in self._mesh_caches:
+                super(Surface, self).__setattr__(cache, None)
+        super(Surface, self).__setattr__(key, value)
+
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            self._metrics = {}
+        return self._metrics
+
+    def _get_metric(self, name):
+        if name not in self.metrics:
+            if name.startswith("triangle"):
+                self._compute_triangle_metrics()
+            else:
+                self._compute_vertex_metrics()
+        return self.metrics[name]
+
+    def _compute_triangle_metrics(self):
+        self.metrics.update(compute_triangle_metrics(self.vertices, self.triangles))
+
+    def _compute_vertex_metrics(self):
+        self.metrics.update(compute_vertex_metrics(self.vertices, self.triangles,
+                                                   self._get_metric("triangle_areas"),
+                                                   self._get_metric("triangle_normals"),
+                                                   self._get_metric("triangle_angles")))
+
+    def compute_triangle_normals(self):
+        """Calculates triangle normals, via the cached mesh metrics."""
+        self.triangle_normals = self._get_metric("triangle_normals")
+        return self.triangle_normals
+
+    def compute_vertex_normals(self):
+        """Calculates vertex normals as the angle weighted averages of their triangles' normals,
+        via the cached mesh metrics."""
+        self.vertex_normals = self._get_metric("vertex_normals")
+        return self.vertex_normals
+
+    def _has_mesh(self):
         # If there is at least 3 vertices and 1 triangle...
-        if self.number_of_vertices > 2 and self.number_of_triangles > 0:
-            if self.vertex_normals.shape[0] != self.number_of_vertices:
-                self.vertex_normals = self.compute_vertex_normals()
+        return self.vertices is not None and self.triangles is not None and \
+               self.vertices.shape[0] > 2 and self.triangles.shape[0] > 0
+
+    def get_vertex_normals(self):
+        if self._has_mesh():
+            if self.vertex_normals is None or self.vertex_normals.shape[0] != self.vertices.shape[0]:
+                self.compute_vertex_normals()
         return self.vertex_normals
 
     def get_triangle_normals(self):
-        # If there is at least 3 vertices and 1 triangle...
-        if self.number_of_vertices > 2 and self.number_of_triangles > 0:
-            if self.triangle_normals.shape[0] != self.number_of_triangles:
-                self.triangle_normals = self.compute_triangle_normals()
+        if self._has_mesh():
+            if self.triangle_normals is None or self.triangle_normals.shape[0] != self.triangles.shape[0]:
+                self.compute_triangle_normals()
         return self.triangle_normals
 
+    def get_triangle_areas(self):
+        return self._get_metric("triangle_areas")
+
     def get_vertex_areas(self):
-        triangle_areas = self._find_triangle_areas()
-        vertex_areas = np.zeros((self.number_of_vertices,))
-        for triang, vertices in enumerate(self.triangles):
-            for i in range(3):
-                vertex_areas[vertices[i]] += 1. / 3. * triangle_areas[triang]
-        return vertex_areas
+        return self._get_metric("vertex_areas")
 
     def add_vertices_and_triangles(self, new_vertices, new_triangles,
                                    new_vertex_normals=np.array([]),  new_triangle_normals=np.array([])):
-        self.triangles = np.array(self.triangles.tolist() +
-                                       (new_triangles + self.number_of_vertices).tolist())
-        self.vertices = np.array(self.vertices.tolist() + new_vertices.tolist())
-        self.vertex_normals = np.array(self.vertex_normals.tolist() + new_vertex_normals.tolist())
-        self.triangle_normals = np.array(self.triangle_normals.tolist() + new_triangle_normals.tolist())
-        self.get_vertex_normals()
-        self.get_triangle_normals()
+        """
+        Append a mesh to this surface, computing any missing normals only for the appended mesh.
+        In order to append many meshes, use a MeshBuilder, which batches the additions.
+        """
+        MeshBuilder(self).append(new_vertices, new_triangles, new_vertex_normals, new_triangle_normals).build()
+
+    def decimate(self, n_vertices=None, cell_size=None):
+        """
+        Compute a coarser level of detail of the surface by vertex clustering:
+        the vertices are clustered to the cells of a regular grid, each cluster is replaced by
+        the area weighted average of its vertices, and only the triangles connecting three different clusters are kept.
+        The results are cached per cell size.
+        :param n_vertices: the approximate number of vertices of the coarse surface, default: a tenth of the vertices
+        :param cell_size: the size of the grid's cells, which, if given, overrides n_vertices
+        :return: the coarse surface,
+                 the sparse (coarse x fine vertices) operator averaging fine vertices' values to the coarse ones,
+                 and the sparse (fine x coarse vertices) operator broadcasting coarse vertices' values back
+                 to the fine vertices,
+                 e.g., to project TimeSeriesSurface data with time_series_utils.apply_linear_operator
+        """
+        from scipy.sparse import csr_matrix
+        if cell_size is None:
+            if n_vertices is None:
+                n_vertices = self.vertices.shape[0] // 10
+            # The number of occupied cells is approximately the surface's area over the cells' face area:
+            cell_size = np.sqrt(self.compute_surface_area() / max(4, n_vertices))
+        cell_size = float(cell_size)
+        if self._lods is None:
+            self._lods = {}
+        if cell_size in self._lods:
+            return self._lods[cell_size]
+        cells = np.floor((self.vertices - self.vertices.min(axis=0)) / cell_size).astype(np.int64)
+        cells = np.ravel_multi_index(cells.T, tuple(cells.max(axis=0) + 1))
+        _, clusters = np.unique(cells, return_inverse=True)
+        n_fine = self.vertices.shape[0]
+        n_coarse = clusters.max() + 1
+        # Area weights, falling back to equal weights for isolated vertices:
+        weights = self.get_vertex_areas().copy()
+        weights[weights <= 0.0] = np.min(weights[weights > 0.0]) if np.any(weights > 0.0) else 1.0
+        clusters_weights = np.bincount(clusters, weights=weights, minlength=n_coarse)
+        fine_to_coarse = csr_matrix((weights / clusters_weights[clusters], (clusters, np.arange(n_fine))),
+                                    shape=(n_coarse, n_fine))
+        coarse_to_fine = csr_matrix((np.ones((n_fine,)), (np.arange(n_fine), clusters)), shape=(n_fine, n_coarse))
+        # Keep the non degenerate triangles, once, with the orientation of their first occurrence:
+        triangles = clusters[self.triangles]
+        fine_triangles_inds = np.where(np.logical_and(np.logical_and(triangles[:, 0] != triangles[:, 1],
+                                                                     triangles[:, 1] != triangles[:, 2]),
+                                                      triangles[:, 0] != triangles[:, 2]))[0]
+        fine_triangles_inds = fine_triangles_inds[
+            np.sort(np.unique(np.sort(triangles[fine_triangles_inds], axis=1), axis=0, return_index=True)[1])]
+        triangles = triangles[fine_triangles_inds]
+        vertices = fine_to_coarse.dot(self.vertices)
+        # Flip the coarse triangles that fold against the fine triangles they originate from:
+        flip = np.sum(compute_triangle_metrics(vertices, triangles)["triangle_normals"] *
+                      self._get_metric("triangle_normals")[fine_triangles_inds], axis=1) < 0.0
+        triangles[flip] = triangles[flip][:, ::-1]
+        coarse_surface = self.__class__(vertices=vertices, triangles=triangles,
+                                        vertex_normals=np.array([]), triangle_normals=np.array([]),
+                                        zero_based_triangles=True, vox2ras=self.vox2ras)
+        coarse_surface.configure()
+        self._lods[cell_size] = (coarse_surface, fine_to_coarse, coarse_to_fine)
+        return self._lods[cell_size]
 
     def compute_surface_area(self):
         """
@@ -59,7 +214,7 @@ class Surface(TVBSurface, BaseModel):
             :param: surface: input surface object
             :return: (sub)surface area, float
             """
-        return np.sum(self._find_triangle_areas())
+        return np.sum(self.get_triangle_areas())
 
     def configure(self):
         try:
@@ -72,6 +227,83 @@ class Surface(TVBSurface, BaseModel):
         return super(Surface, self).to_tvb_instance(datatype, **kwargs)
 
 
+class MeshBuilder(object):
+    """
+    Incremental builder of a mesh (e.g., a cortex merged with subcortical structures),
+    which appends the vertices, triangles and normals of many meshes to buffers of amortized growth
+    (i.e., of doubling capacity), and writes the merged mesh to a Surface once, when build() is called.
+    Normals, which are not given, are computed only for the appended mesh.
+    """
+
+    def __init__(self, surface=None, capacity=1024):
+        self.surface = surface
+        self.n_vertices = 0
+        self.n_triangles = 0
+        capacity = int(max(1, capacity))
+        self._vertices = np.empty((capacity, 3))
+        self._vertex_normals = np.empty((capacity, 3))
+        self._triangles = np.empty((capacity, 3), dtype=np.int64)
+        self._triangle_normals = np.empty((capacity, 3))
+        if surface is not None and getattr(surface, "vertices", None) is not None and surface.vertices.size > 0:
+            self.append(surface.vertices, surface.triangles, surface.vertex_normals, surface.triangle_normals)
+
+    @staticmethod
+    def _grow(buffer, min_capacity):
+        capacity = buffer.shape[0]
+        while capacity < min_capacity:
+            capacity *= 2
+        new_buffer = np.empty((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+        new_buffer[:buffer.shape[0]] = buffer
+        return new_buffer
+
+    def append(self, vertices, triangles, vertex_normals=None, triangle_normals=None):
+        """
+        Append a mesh, the triangles of which index its own vertices (i.e., starting from 0).
+        """
+        vertices = np.asarray(vertices, dtype=np.float64).reshape((-1, 3))
+        triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+        n_vertices = vertices.shape[0]
+        n_triangles = triangles.shape[0]
+        if vertex_normals is None or np.size(vertex_normals) != 3 * n_vertices or \
+                triangle_normals is None or np.size(triangle_normals) != 3 * n_triangles:
+            triangle_metrics = compute_triangle_metrics(vertices, triangles)
+            if triangle_normals is None or np.size(triangle_normals) != 3 * n_triangles:
+                triangle_normals = triangle_metrics["triangle_normals"]
+            if vertex_normals is None or np.size(vertex_normals) != 3 * n_vertices:
+                vertex_normals = compute_vertex_metrics(vertices, triangles, **triangle_metrics)["vertex_normals"]
+        new_n_vertices = self.n_vertices + n_vertices
+        new_n_triangles = self.n_triangles + n_triangles
+        if new_n_vertices > self._vertices.shape[0]:
+            self._vertices = self._grow(self._vertices, new_n_vertices)
+            self._vertex_normals = self._grow(self._vertex_normals, new_n_vertices)
+        if new_n_triangles > self._triangles.shape[0]:
+            self._triangles = self._grow(self._triangles, new_n_triangles)
+            self._triangle_normals = self._grow(self._triangle_normals, new_n_triangles)
+        self._vertices[self.n_vertices:new_n_vertices] = vertices
+        self._vertex_normals[self.n_vertices:new_n_vertices] = np.reshape(vertex_normals, (-1, 3))
+        self._triangles[self.n_triangles:new_n_triangles] = triangles + self.n_vertices
+        self._triangle_normals[self.n_triangles:new_n_triangles] = np.reshape(triangle_normals, (-1, 3))
+        self.n_vertices = new_n_vertices
+        self.n_triangles = new_n_triangles
+        return self
+
+    def build(self, surface=None):
+        """
+        Write the merged mesh to surface, default: the surface of the builder, or a new Surface.
+        """
+        if surface is None:
+            surface = self.surface
+        if surface is None:
+            surface = Surface(zero_based_triangles=True)
+        surface.vertices = self._vertices[:self.n_vertices].copy()
+        surface.triangles = self._triangles[:self.n_triangles].copy()
+        surface.vertex_normals = self._vertex_normals[:self.n_vertices].copy()
+        surface.triangle_normals = self._triangle_normals[:self.n_triangles].copy()
+        surface.number_of_vertices = self.n_vertices
+        surface.number_of_triangles = self.n_triangles
+        return surface
+
+
 class WhiteMatterSurface(Surface, TVBWhiteMatterSurface):
 
     def to_tvb_instance(self, **kwargs):
@@ -7,7 +7,8 @@ from copy import deepcopy
 import numpy
 
 from tvb_scripts.utils.log_error_utils import initialize_logger, warning
-from tvb_scripts.utils.data_structures_utils import ensure_list, is_integer, monopolar_to_bipolar
+from tvb_scripts.utils.data_structures_utils import ensure_list, is_integer, bipolar_montage
+from tvb_scripts.utils.time_series_utils import apply_linear_operator
 from tvb_scripts.datatypes.base import BaseModel
 
 from tvb.basic.neotraits.api import List, Attr
@@ -113,7 +114,11 @@ class TimeSeries(TimeSeriesTVB, BaseModel):
                               **kwargs)
 
     def duplicate(self, **kwargs):
-        duplicate = deepcopy(self)
+        # Avoid deep copying the data, if they are going to be replaced anyway:
+        memo = {}
+        if kwargs.get("data", None) is not None:
+            memo[id(self.data)] = self.data
+        duplicate = deepcopy(self, memo)
         for attr, value in kwargs.items():
             setattr(duplicate, attr, value)
         duplicate.data = prepare_4d(duplicate.data, self.logger)
@@ -562,9 +567,19 @@ class TimeSeriesSensors(TimeSeries):
     def sensor_labels(self):
         return self.space_labels
 
-    def get_bipolar(self, **kwargs):
-        bipolar_labels, bipolar_inds = monopolar_to_bipolar(self.space_labels)
-        data = self.data[:, :, bipolar_inds[0]] - self.data[:, :, bipolar_inds[1]]
+    def get_bipolar(self, time_block=None, **kwargs):
+        """
+        Return the bipolar TimeSeries, computed by applying the sparse bipolar montage operator to all signals at once,
+        in blocks of time_block time points, if given.
+        The montage is the one cached by the sensors, if they have the same labels as the TimeSeries.
+        """
+        space_labels = self.space_labels
+        if hasattr(self.sensors, "get_bipolar_montage") and \
+                numpy.array_equal(numpy.array(self.sensors.labels), space_labels):
+            bipolar_labels, bipolar_inds, operator = self.sensors.get_bipolar_montage()
+        else:
+            bipolar_labels, bipolar_inds, operator = bipolar_montage(space_labels)
+        data = apply_linear_operator(operator, self.data, 2, time_block)
         bipolar_labels_dimensions = deepcopy(self.labels_dimensions)
         bipolar_labels_dimensions[self.labels_ordering[2]] = list(bipolar_labels)
         return self.duplicate(data=data, labels_dimensions=bipolar_labels_dimensions, **kwargs)
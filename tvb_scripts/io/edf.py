@@ -1,83 +1,410 @@
 # coding=utf-8
 
+import os
+
 import numpy as np
 
-from tvb_scripts.utils.log_error_utils import initialize_logger
-from tvb_scripts.utils.data_structures_utils import ensure_string
+from tvb_scripts.config import CalculusConfig
+from tvb_scripts.utils.log_error_utils import initialize_logger, raise_value_error, raise_not_implemented_error, \
+    warning
+from tvb_scripts.utils.data_structures_utils import ensure_string, ensure_list
 from tvb_scripts.datatypes.time_series import TimeSeries, TimeSeriesDimensions
 
 
-def read_edf_with_mne(path, exclude_channels):
-    from mne.io import read_raw_edf
-    raw_data = read_raw_edf(path, preload=True, exclude=exclude_channels)
-    channel_names = raw_data.ch_names
-    data, times = raw_data[:, :]
-    return data, times, channel_names
+# The scales from the physical dimensions of EDF signals to SI units, i.e., Volts for voltage signals.
+# Signals of any other dimension are returned in their physical dimension, as in MNE.
+EDF_UNITS_SCALES = {"V": 1.0, "mV": 1e-3, "uV": 1e-6, u"\u00b5V": 1e-6, u"\u03bcV": 1e-6, "nV": 1e-9}
 
 
-def read_edf_with_pyedflib(path, exclude_channels):
-    import pyedflib
-    f = pyedflib.EdfReader(path)
-    channel_names = np.delete(f.getSignalLabels(), exclude_channels, axis=0)
-    n = f.signals_in_file
-    data = np.zeros((n, f.getNSamples()[0]))
-    for i in np.arange(n):
-        data[i, :] = f.readSignal(i)
-    data = np.delete(data, exclude_channels, axis=0).T
-    # Assuming uniform sample frequency:
-    fs = np.mean(f.getSampleFrequencies())
-    times = np.arange(data.shape[0])/fs
-    return data, times, channel_names
+def edf_units_scales(physical_dimensions):
+    """
+    :return: the scales from the EDF signals' physical dimensions (e.g., "uV") to Volts, or 1.0 for other dimensions
+    """
+    return np.array([EDF_UNITS_SCALES.get(ensure_string(dimension).strip(), 1.0)
+                     for dimension in physical_dimensions])
 
 
-def read_edf(path, sensors, rois_selection=None, label_strip_fun=None, time_units="ms", exclude_channels=[]):
+class EDFEngine(object):
+    """
+    Base class of the EDF reading engines, which open an EDF file, expose its header,
+    i.e., channel_names, sample_frequencies and n_samples per channel,
+    and read selected channels within a range of samples, block by block, into a given output array,
+    so that neither excluded channels, nor samples out of the range, are ever read.
+    All engines return voltage signals in Volts (see EDF_UNITS_SCALES), whatever their physical dimension in the file.
+    """
     logger = initialize_logger(__name__)
 
-    logger.info("Reading empirical dataset from edf file...")
+    max_block_bytes = CalculusConfig.MAX_SLAB_BYTES
+
+    channel_names = []
+    sample_frequencies = np.array([])
+    n_samples = np.array([], dtype="i")
+
+    def __init__(self, path):
+        self.path = path
+
+    def block_size(self, n_channels):
+        # The number of samples per block, so that a block of float64 samples fits the memory budget
+        return int(max(1, self.max_block_bytes // (8 * max(n_channels, 1))))
+
+    def read(self, channels, start, stop, out):
+        """
+        :param channels: the indices of the channels to read
+        :param start: the first sample to read
+        :param stop: the sample to stop reading at (exclusive)
+        :param out: an array (e.g., a numpy.memmap) of shape (stop - start, len(channels)) to write the signals to
+        :return: out
+        """
+        raise_not_implemented_error("read method of %s is not implemented!" % self.__class__.__name__, self.logger)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class EDFNumpyEngine(EDFEngine):
+    """
+    EDF(+) reading engine without any dependency, which parses the EDF header
+    and maps the data records to a read-only numpy.memmap of 16-bit integers.
+    Only the blocks of data records that contain the requested samples are read,
+    and only the selected channels are converted to physical units, and then to Volts.
+    BDF (24-bit) files are not supported, for which the MNE or pyEDFlib engines are to be used.
+    """
+
+    HEADER_BYTES = 256
+    SIGNAL_HEADER_FIELDS = (("labels", 16), ("transducers", 80), ("physical_dimensions", 8),
+                            ("physical_min", 8), ("physical_max", 8), ("digital_min", 8), ("digital_max", 8),
+                            ("prefilterings", 80), ("samples_per_record", 8), ("reserved", 32))
+
+    def __init__(self, path):
+        super(EDFNumpyEngine, self).__init__(path)
+        self.header = self.read_header(path)
+        self.channel_names = self.header["labels"]
+        record_duration = self.header["record_duration"]
+        samples_per_record = self.header["samples_per_record"]
+        self.sample_frequencies = samples_per_record / record_duration
+        self.n_samples = samples_per_record * self.header["n_records"]
+        # The offsets of the channels' samples within a data record:
+        self._offsets = np.cumsum(np.concatenate([[0], samples_per_record[:-1]])).astype("i")
+        self._gains = (self.header["physical_max"] - self.header["physical_min"]) / \
+                      (self.header["digital_max"] - self.header["digital_min"])
+        self._units_scales = edf_units_scales(self.header["physical_dimensions"])
+        self._records = np.memmap(path, dtype="<i2", mode="r", offset=self.header["header_bytes"],
+                                  shape=(self.header["n_records"], int(np.sum(samples_per_record))))
+
+    @classmethod
+    def read_header(cls, path):
+        with open(path, "rb") as edf_file:
+            header = edf_file.read(cls.HEADER_BYTES)
+            if len(header) < cls.HEADER_BYTES or header[:1] != b"0":
+                raise_value_error("File %s is not an EDF file!" % path, cls.logger)
+            n_signals = int(header[252:256])
+            header_bytes = int(header[184:192])
+            signal_header = edf_file.read(cls.HEADER_BYTES * n_signals).decode("latin-1")
+        result = {"header_bytes": header_bytes,
+                  "n_records": int(header[236:244]),
+                  "record_duration": float(header[244:252]),
+                  "n_signals": n_signals}
+        position = 0
+        for field, width in cls.SIGNAL_HEADER_FIELDS:
+            values = [signal_header[position + i * width: position + (i + 1) * width].strip()
+                      for i in range(n_signals)]
+            position += n_signals * width
+            if field in ("labels", "transducers", "physical_dimensions", "prefilterings", "reserved"):
+                result[field] = values
+            else:
+                result[field] = np.array(values, dtype="f8")
+        result["samples_per_record"] = result["samples_per_record"].astype("i")
+        record_samples = int(np.sum(result["samples_per_record"]))
+        if result["n_records"] < 0:
+            # The number of records is unknown (-1) if the recording has not been finalized:
+            result["n_records"] = (os.path.getsize(path) - header_bytes) // (2 * record_samples)
+        return result
+
+    def read(self, channels, start, stop, out):
+        channels = np.array(channels, dtype="i")
+        if len(channels) == 0 or stop <= start:
+            return out
+        samples_per_record = int(self.header["samples_per_record"][channels[0]])
+        if np.any(self.header["samples_per_record"][channels] != samples_per_record):
+            raise_value_error("Selected channels of EDF file %s have different sample frequencies!" % self.path,
+                              self.logger)
+        # The indices of the selected channels' samples within a data record, of shape (channels, samples):
+        indices = self._offsets[channels][:, None] + np.arange(samples_per_record)[None, :]
+        gains = self._gains[channels]
+        offsets = (self.header["physical_min"][channels] - gains * self.header["digital_min"][channels]) * \
+                  self._units_scales[channels]
+        gains = gains * self._units_scales[channels]
+        block_records = max(1, self.block_size(len(channels)) // samples_per_record)
+        first_record = start // samples_per_record
+        last_record = (stop - 1) // samples_per_record + 1
+        for block_start in range(first_record, last_record, block_records):
+            block_stop = min(block_start + block_records, last_record)
+            block = self._records[block_start:block_stop][:, indices]
+            block = np.transpose(block, (0, 2, 1)).reshape((-1, len(channels))) * gains + offsets
+            # Trim the samples out of the range, which belong to the first and last records:
+            block_first_sample = block_start * samples_per_record
+            i0 = max(start - block_first_sample, 0)
+            i1 = min(stop - block_first_sample, block.shape[0])
+            out[block_first_sample + i0 - start:block_first_sample + i1 - start] = block[i0:i1]
+        return out
+
+    def close(self):
+        self._records = None
+
+
+class EDFMNEEngine(EDFEngine):
+    """
+    EDF reading engine based on MNE, which opens the file without preloading it,
+    and reads only the selected channels within the range of samples, block by block.
+    MNE already scales voltage signals to Volts.
+    """
+
+    def __init__(self, path):
+        super(EDFMNEEngine, self).__init__(path)
+        from mne.io import read_raw_edf
+        self.raw = read_raw_edf(path, preload=False, verbose=False)
+        self.channel_names = list(self.raw.ch_names)
+        self.sample_frequencies = self.raw.info["sfreq"] * np.ones((len(self.channel_names),))
+        self.n_samples = self.raw.n_times * np.ones((len(self.channel_names),), dtype="i")
+
+    def read(self, channels, start, stop, out):
+        channels = np.array(channels, dtype="i")
+        if len(channels) == 0 or stop <= start:
+            return out
+        block_size = self.block_size(len(channels))
+        for block_start in range(start, stop, block_size):
+            block_stop = min(block_start + block_size, stop)
+            out[block_start - start:block_stop - start] = \
+                self.raw.get_data(picks=channels, start=block_start, stop=block_stop).T
+        return out
+
+    def close(self):
+        self.raw.close()
+
+
+class EDFPyEDFLibEngine(EDFEngine):
+    """
+    EDF reading engine based on pyEDFlib, which reads only the selected channels within the range of samples,
+    channel by channel.
+    """
+
+    def __init__(self, path):
+        super(EDFPyEDFLibEngine, self).__init__(path)
+        import pyedflib
+        self.reader = pyedflib.EdfReader(path)
+        self.channel_names = list(self.reader.getSignalLabels())
+        self.sample_frequencies = np.array(self.reader.getSampleFrequencies(), dtype="f8")
+        self.n_samples = np.array(self.reader.getNSamples(), dtype="i")
+        self._units_scales = edf_units_scales([self.reader.getPhysicalDimension(channel)
+                                               for channel in range(len(self.channel_names))])
+
+    def read(self, channels, start, stop, out):
+        for i_out, channel in enumerate(channels):
+            out[:, i_out] = self._units_scales[channel] * \
+                            self.reader.readSignal(int(channel), start=start, n=stop - start)
+        return out
+
+    def close(self):
+        self.reader.close()
+
+
+# The engines tried in turn, until the EDF file is opened successfully:
+EDF_ENGINES = (EDFNumpyEngine, EDFMNEEngine, EDFPyEDFLibEngine)
+
+
+def _open_edf_engine(engine, path, logger):
     try:
-        data, times, channel_names = read_edf_with_mne(path, exclude_channels)
-    except:
-        logger.warn("Reading edf file with mne failed! Trying with pyEDFlib...")
-        try:
-            data, times, channel_names = read_edf_with_pyedflib(path, exclude_channels)
-        except:
-            logger.error("Failed to read edf file both with MNE and pyEDFlib!")
+        return engine(path)
+    except Exception as e:
+        logger.warning("Opening edf file with %s failed: %s" % (engine.__name__, str(e)))
+        return None
+
+
+def open_edf(path, engines=EDF_ENGINES):
+    logger = initialize_logger(__name__)
+    for engine in engines:
+        edf_engine = _open_edf_engine(engine, path, logger)
+        if edf_engine is not None:
+            return edf_engine
+    raise_value_error("Failed to open edf file %s with any of the engines %s!"
+                      % (path, str([engine.__name__ for engine in engines])), logger)
+
 
+def _read_all_edf_channels(engine, exclude_channels=[]):
+    # Read all channels but the excluded ones (indices or names) to an array of shape (time, channels)
+    excluded = [channel for channel in ensure_list(exclude_channels) if not isinstance(channel, str)]
+    excluded_names = [channel for channel in ensure_list(exclude_channels) if isinstance(channel, str)]
+    channels = [ind for ind, name in enumerate(engine.channel_names)
+                if ind not in excluded and name not in excluded_names]
+    n_samples = int(np.min(engine.n_samples[channels])) if len(channels) > 0 else 0
+    data = engine.read(channels, 0, n_samples, np.empty((n_samples, len(channels))))
+    # Assuming uniform sample frequency:
+    fs = np.mean(engine.sample_frequencies[channels]) if len(channels) > 0 else 1.0
+    times = np.arange(n_samples) / fs
+    return data, times, channels
+
+
+def read_edf_with_mne(path, exclude_channels):
+    """
+    Read all but the excluded channels of an EDF file with MNE.
+    :return: data of shape (channels, time) in Volts, times in sec, and channel names
+    """
+    with EDFMNEEngine(path) as engine:
+        data, times, channels = _read_all_edf_channels(engine, exclude_channels)
+        channel_names = [engine.channel_names[channel] for channel in channels]
+    return data.T, times, channel_names
+
+
+def read_edf_with_pyedflib(path, exclude_channels):
+    """
+    Read all but the excluded channels of an EDF file with pyEDFlib.
+    :return: data of shape (time, channels) in the physical units of the file, times in sec, and channel names
+    """
+    with EDFPyEDFLibEngine(path) as engine:
+        data, times, channels = _read_all_edf_channels(engine, exclude_channels)
+        # Undo the scaling to Volts of the engine:
+        data /= engine._units_scales[channels]
+        channel_names = np.array([engine.channel_names[channel] for channel in channels])
+    return data, times, channel_names
+
+
+def select_edf_channels(channel_names, sensors, rois_selection=None, label_strip_fun=None, exclude_channels=[]):
+    """
+    Match sensors' labels, within rois_selection, to the channels of an EDF file.
+    :param channel_names: the EDF file's channel names
+    :param sensors: the Sensors, whose labels are matched to channel names
+    :param rois_selection: the sensors' labels to select, default: all sensors' labels
+    :param label_strip_fun: a function applied to the channel names before matching
+    :param exclude_channels: channels never to be selected, either as indices or names
+    :return: rois: the indices of the selected channels in the EDF file,
+             rois_inds: the respective indices of the sensors,
+             rois_lbls: the respective labels of the sensors
+    """
     if not callable(label_strip_fun):
         label_strip_fun = lambda label: label
 
     channel_names = [label_strip_fun(s) for s in channel_names]
 
+    excluded = []
+    for channel in ensure_list(exclude_channels):
+        if isinstance(channel, str):
+            excluded += [ind for ind, name in enumerate(channel_names) if name == label_strip_fun(channel)]
+        else:
+            excluded.append(int(channel))
+    # Map every channel name to its first not excluded index:
+    channels_inds = {}
+    for channel_ind, channel_name in enumerate(channel_names):
+        if channel_ind not in excluded:
+            channels_inds.setdefault(channel_name, channel_ind)
+
+    if rois_selection is None or len(rois_selection) == 0:
+        rois_selection = sensors.labels
+    rois_selection = set(ensure_list(rois_selection))
+
     rois = []
     rois_inds = []
     rois_lbls = []
-    if len(rois_selection) == 0:
-        rois_selection = sensors.labels
-
-    logger.info("Selecting target signals from dataset...")
     for sensor_ind, sensor_label in enumerate(sensors.labels):
-        if sensor_label in rois_selection and sensor_label in channel_names:
-            rois.append(channel_names.index(sensor_label))
+        if sensor_label in rois_selection and sensor_label in channels_inds:
+            rois.append(channels_inds[sensor_label])
             rois_inds.append(sensor_ind)
             rois_lbls.append(sensor_label)
 
-    data = data[rois].T
+    return np.array(rois, dtype="i"), np.array(rois_inds, dtype="i"), np.array(rois_lbls)
+
+
+def read_edf(path, sensors, rois_selection=None, label_strip_fun=None, time_units="ms", exclude_channels=[],
+             start_time=None, end_time=None, memmap_path=None, dtype="f8", engines=EDF_ENGINES):
+    """
+    Read the signals of the sensors selected by rois_selection from an EDF file.
+    The selection is resolved on the file's header, before reading,
+    and only the selected channels, within the time window [start_time, end_time), are read.
+    :param time_units: the units of the output times, and of start_time and end_time ("ms" or "sec")
+    :param start_time: the start of the time window, default: the start of the recording
+    :param end_time: the end of the time window, default: the end of the recording
+    :param memmap_path: if given, the data are written to a numpy.memmap in this file, instead of memory
+    :param dtype: the dtype of the output data
+    :param engines: the EDF engines to try in turn, until one opens the file,
+                    with the same sample frequency for all selected channels
+                    (e.g., MNE resamples all channels to a common sample frequency)
+    :return: data of shape (time, selected channels), with voltage signals in Volts, times, rois, rois_inds, rois_lbls
+    """
+    logger = initialize_logger(__name__)
+
+    logger.info("Reading empirical dataset from edf file...")
+    engine = None
+    for engine_class in engines:
+        engine = _open_edf_engine(engine_class, path, logger)
+        if engine is None:
+            continue
+        logger.info("Selecting target signals from dataset...")
+        rois, rois_inds, rois_lbls = select_edf_channels(engine.channel_names, sensors, rois_selection,
+                                                         label_strip_fun, exclude_channels)
+        fs = engine.sample_frequencies[rois]
+        if len(rois) > 0 and np.any(fs != fs[0]):
+            logger.warning("Selected channels of edf file %s have different sample frequencies %s for %s! "
+                           "Trying the next engine..." % (path, str(np.unique(fs)), engine_class.__name__))
+            engine.close()
+            engine = None
+            continue
+        break
+    if engine is None:
+        raise_value_error("Failed to read edf file %s with any of the engines %s!"
+                          % (path, str([engine_class.__name__ for engine_class in engines])), logger)
+
+    with engine:
+        if len(rois) == 0:
+            warning("None of the selected sensors' labels matches a channel of edf file %s!" % path, logger)
+            fs = np.max(engine.sample_frequencies)
+            n_samples = int(np.max(engine.n_samples))
+        else:
+            fs = fs[0]
+            n_samples = int(np.min(engine.n_samples[rois]))
+
+        # Assuming that edf file time units is "sec"
+        if ensure_string(time_units).find("ms") == 0:
+            time_scale = 1000.0
+        else:
+            time_scale = 1.0
+        start = 0
+        if start_time is not None:
+            start = int(np.clip(np.round(start_time / time_scale * fs), 0, n_samples))
+        stop = n_samples
+        if end_time is not None:
+            stop = int(np.clip(np.round(end_time / time_scale * fs), start, n_samples))
+
+        shape = (stop - start, len(rois))
+        if memmap_path is not None:
+            data = np.memmap(memmap_path, dtype=dtype, mode="w+", shape=shape)
+        else:
+            data = np.empty(shape, dtype=dtype)
+        engine.read(rois, start, stop, data)
+        if isinstance(data, np.memmap):
+            data.flush()
 
-    # Assuming that edf file time units is "sec"
-    if ensure_string(time_units).find("ms") == 0:
-        times = 1000 * times
-    # sort_inds = np.argsort(rois_lbls)
-    rois = np.array(rois) # [sort_inds]
-    rois_inds = np.array(rois_inds) # [sort_inds]
-    rois_lbls = np.array(rois_lbls) # [sort_inds]
-    # data = data[:, sort_inds]
+    times = time_scale * (start + np.arange(stop - start)) / fs
 
     return data, times, rois, rois_inds, rois_lbls
 
 
-def read_edf_to_Timeseries(path, sensors, rois_selection=None, label_strip_fun=None, time_unit="ms", **kwargs):
+def read_edf_to_Timeseries(path, sensors, rois_selection=None, label_strip_fun=None, time_unit="ms",
+                           start_time=None, end_time=None, memmap_path=None, exclude_channels=[], **kwargs):
+    """
+    Read the selected sensors' signals within the time window [start_time, end_time) of an EDF file to a TimeSeries,
+    whose data are backed by a numpy.memmap in memmap_path, if given.
+    Voltage signals are in Volts.
+    """
     data, times, rois, rois_inds, rois_lbls = \
-        read_edf(path, sensors, rois_selection, label_strip_fun, time_unit)
+        read_edf(path, sensors, rois_selection, label_strip_fun, time_unit, exclude_channels,
+                 start_time, end_time, memmap_path)
 
-    return TimeSeries(data, time=times, labels_dimensions={TimeSeriesDimensions.SPACE.value: rois_lbls},
+    # Channels go to the space dimension, i.e., data are of shape (time, 1 variable, channels):
+    return TimeSeries(data[:, np.newaxis, :], time=times,
+                      labels_dimensions={TimeSeriesDimensions.SPACE.value: rois_lbls},
                       sample_period=np.mean(np.diff(times)), sample_period_unit=time_unit, **kwargs)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import os
+import uuid
+import hashlib
+import threading
+
+import h5py
+import numpy
+
+from tvb_scripts.config import CONFIGURED
+from tvb_scripts.utils.log_error_utils import initialize_logger, raise_value_error
+
+
+class H5BlobStore(object):
+    """
+    A content addressed store of large arrays, shared by many H5 files, e.g., the outputs of many subjects,
+    which would otherwise hold their own copies of identical arrays (template connectivity, surfaces, gain matrices).
+    Each unique array is stored once, in the "data" dataset of an H5 file of the store's folder named by its hash,
+    and the referencing files hold HDF5 external links to it, which h5py follows transparently when reading.
+    Blobs are written to temporary files and renamed, so that several processes can share a store.
+    Note that blobs are shared: datasets opened via external links should not be modified.
+    """
+    logger = initialize_logger(__name__)
+
+    DATASET_NAME = "data"
+
+    def __init__(self, folder, min_bytes=CONFIGURED.h5.DEDUP_MIN_BYTES):
+        """
+        :param folder: the folder of the store, created if it does not exist
+        :param min_bytes: arrays smaller than this (in bytes) are not deduplicated
+        """
+        self.folder = os.path.abspath(folder)
+        self.min_bytes = min_bytes
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def __getstate__(self):
+        # e.g., to hash arrays in worker processes
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_written = 0
+        self.bytes_saved = 0
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "bytes_written": self.bytes_written, "bytes_saved": self.bytes_saved}
+
+    def is_deduplicated(self, array):
+        return isinstance(array, numpy.ndarray) and array.dtype.kind in "biufc" and array.nbytes >= self.min_bytes
+
+    @staticmethod
+    def hash_array(array, attrs=None):
+        """
+        :return: the hexadecimal hash of the array's dtype, shape and contents, and of its attributes, if any,
+                 so that identical arrays with different dataset attributes are stored separately
+        """
+        array = numpy.ascontiguousarray(array)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(("%s%s" % (array.dtype.str, str(array.shape))).encode())
+        digest.update(memoryview(array.reshape(-1)).cast("B"))
+        if attrs:
+            digest.update(repr(sorted([(key, repr(value)) for key, value in attrs.items()])).encode())
+        return digest.hexdigest()
+
+    def blob_path(self, digest):
+        return os.path.join(self.folder, digest[:2], digest + ".h5")
+
+    def put(self, array, digest=None, attrs=None, **kwargs):
+        """
+        Store an array, unless an identical one is already stored.
+        :param array: the numpy array
+        :param digest: the array's hash, if already computed via hash_array
+        :param attrs: attributes of the blob's dataset, written only when the blob is created
+        :param kwargs: create_dataset keyword arguments (e.g., chunks, compression), used only when creating the blob
+        :return: the path of the blob's file
+        """
+        if digest is None:
+            digest = self.hash_array(array, attrs)
+        path = self.blob_path(digest)
+        if os.path.isfile(path):
+            with h5py.File(path, "r", libver='latest') as h5_file:
+                dataset = h5_file[self.DATASET_NAME]
+                if dataset.shape != array.shape or dataset.dtype != array.dtype:
+                    raise_value_error("Blob %s does not match the shape and dtype of the array %s %s!"
+                                      % (path, str(array.shape), str(array.dtype)), self.logger)
+            with self._lock:
+                self.hits += 1
+                self.bytes_saved += array.nbytes
+            return path
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with h5py.File(temp_path, "w", libver='latest') as h5_file:
+            dataset = h5_file.create_dataset(self.DATASET_NAME, data=array, **kwargs)
+            for key, value in (attrs or {}).items():
+                dataset.attrs[key] = value
+        os.replace(temp_path, path)
+        with self._lock:
+            self.misses += 1
+            self.bytes_written += array.nbytes
+        return path
+
+    def external_link(self, array, referencing_path, digest=None, attrs=None, **kwargs):
+        """
+        Store an array and return the external link to it, to be assigned to a group of the referencing file.
+        The link's file path is relative to the referencing file's folder, if possible,
+        so that the store can be moved together with the referencing files.
+        """
+        path = self.put(array, digest, attrs, **kwargs)
+        try:
+            path = os.path.relpath(path, os.path.dirname(os.path.abspath(referencing_path)))
+        except ValueError:
+            # e.g., different drives
+            pass
+        return h5py.ExternalLink(path, "/" + self.DATASET_NAME)
+
+    def _copy_deduplicated(self, source_group, target_group, referencing_path):
+        for key, value in source_group.attrs.items():
+            target_group.attrs[key] = value
+        for key in source_group.keys():
+            link = source_group.get(key, getlink=True)
+            if not isinstance(link, h5py.HardLink):
+                target_group[key] = link
+                continue
+            item = source_group[key]
+            if isinstance(item, h5py.Group):
+                self._copy_deduplicated(item, target_group.create_group(key), referencing_path)
+            elif item.dtype.kind in "biufc" and item.size * item.dtype.itemsize >= self.min_bytes:
+                kwargs = {}
+                if item.chunks is not None:
+                    kwargs = {"chunks": item.chunks, "compression": item.compression,
+                              "compression_opts": item.compression_opts, "shuffle": item.shuffle}
+                target_group[key] = self.external_link(item[()], referencing_path,
+                                                       attrs=dict(item.attrs.items()), **kwargs)
+            else:
+                source_group.copy(key, target_group)
+
+    def deduplicate_file(self, path):
+        """
+        Rewrite an existing H5 file (e.g., one written by TVB's h5.store),
+        with its large datasets moved to the store and replaced by external links.
+        :return: the path of the file
+        """
+        temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with h5py.File(path, "r", libver='latest') as source, h5py.File(temp_path, "w", libver='latest') as target:
+            self._copy_deduplicated(source, target, path)
+        os.replace(temp_path, path)
+        return path
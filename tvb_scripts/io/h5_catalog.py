@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import threading
+
+import h5py
+import numpy
+
+from tvb_scripts.io.h5_writer import H5Writer
+from tvb_scripts.utils.log_error_utils import initialize_logger, warning
+
+
+def _to_python(value):
+    # Convert an H5 attribute value to a str, int or float, or None if it is not a scalar or a short vector
+    if isinstance(value, bytes):
+        return value.decode(errors="replace")
+    if isinstance(value, numpy.ndarray):
+        if value.size > 16:
+            return None
+        return str([_to_python(v) for v in value.flatten()])
+    if isinstance(value, (numpy.bool_, bool)):
+        return int(value)
+    if isinstance(value, numpy.integer):
+        return int(value)
+    if isinstance(value, numpy.floating):
+        return float(value)
+    if isinstance(value, (str, int, float)):
+        return value
+    return None
+
+
+class H5Catalog(object):
+    """
+    A catalog of H5 files, as written by H5Writer or TVB's h5.store, in a local SQLite database,
+    which holds every file's Type, Subtype, Version and Last_update attributes, the shapes and dtypes of its datasets,
+    all its scalar root attributes (e.g., subject, or TVB's prefixed attributes), and the key TimeSeries metadata
+    (sample period and unit, start time and number of time points), so that files can be found without opening them.
+    The catalog is updated incrementally: only files added or modified (by mtime or size) since the last update
+    are (re)indexed, and files that do not exist anymore are removed.
+    """
+    logger = initialize_logger(__name__)
+
+    # TVB writes its datatypes' attributes with this prefix:
+    TVB_PREFIX = "TVB_"
+
+    FILES_COLUMNS = ["path", "folder", "mtime", "size", "type", "subtype", "version", "last_update", "title",
+                     "sample_period", "sample_period_unit", "start_time", "n_times", "indexed_at"]
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, folder TEXT, mtime REAL, size INTEGER,
+            type TEXT, subtype TEXT, version TEXT, last_update TEXT, title TEXT,
+            sample_period REAL, sample_period_unit TEXT, start_time REAL, n_times INTEGER, indexed_at REAL);
+        CREATE TABLE IF NOT EXISTS datasets (
+            path TEXT, name TEXT, shape TEXT, ndim INTEGER, size INTEGER, dtype TEXT, PRIMARY KEY (path, name));
+        CREATE TABLE IF NOT EXISTS attributes (
+            path TEXT, key TEXT, value TEXT, number REAL, PRIMARY KEY (path, key));
+        CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+        CREATE INDEX IF NOT EXISTS files_type ON files (type, subtype);
+        CREATE INDEX IF NOT EXISTS files_sample_period ON files (sample_period);
+        CREATE INDEX IF NOT EXISTS datasets_name ON datasets (name);
+        CREATE INDEX IF NOT EXISTS attributes_key_value ON attributes (key, value);
+        CREATE INDEX IF NOT EXISTS attributes_key_number ON attributes (key, number);
+    """
+
+    def __init__(self, db_path, extensions=(".h5", ".hdf5")):
+        """
+        :param db_path: the path of the SQLite database file, which is created if it does not exist
+        :param extensions: the extensions of the files to be indexed when updating from folders
+        """
+        self.db_path = db_path
+        self.extensions = tuple(extensions)
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.executescript(self.SCHEMA)
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_attribute(self, attrs, *names):
+        for name in names:
+            for key in (name, self.TVB_PREFIX + name, name.lower(), self.TVB_PREFIX + name.lower()):
+                if key in attrs:
+                    return _to_python(attrs[key])
+        return None
+
+    def _read_file(self, path):
+        # Return the files' row, and the datasets' and attributes' rows of a file
+        attributes = []
+        datasets = []
+        # Files are opened directly, and not via the H5 file pool, so that scanning many files once
+        # does not evict the handles of the files in use:
+        with h5py.File(path, "r", libver='latest') as h5_file:
+            attrs = h5_file.attrs
+            for key in attrs.keys():
+                try:
+                    value = _to_python(attrs[key])
+                except Exception:
+                    value = None
+                if value is not None:
+                    number = value if isinstance(value, (int, float)) else None
+                    attributes.append((path, key, str(value), number))
+
+            def add_dataset(name, item):
+                if isinstance(item, h5py.Dataset):
+                    datasets.append((path, name, str(tuple(item.shape)), item.ndim, int(item.size), str(item.dtype)))
+
+            h5_file.visititems(add_dataset)
+            n_times = None
+            if isinstance(h5_file.get("data", None), h5py.Dataset) and h5_file["data"].ndim > 0:
+                n_times = int(h5_file["data"].shape[0])
+            row = {"type": self._get_attribute(attrs, H5Writer.H5_TYPE_ATTRIBUTE),
+                   "subtype": self._get_attribute(attrs, H5Writer.H5_SUBTYPE_ATTRIBUTE),
+                   "version": self._get_attribute(attrs, H5Writer.H5_VERSION_ATTRIBUTE),
+                   "last_update": self._get_attribute(attrs, H5Writer.H5_DATE_ATTRIBUTE),
+                   "title": self._get_attribute(attrs, "title"),
+                   "sample_period": self._get_attribute(attrs, "sample_period"),
+                   "sample_period_unit": self._get_attribute(attrs, "sample_period_unit"),
+                   "start_time": self._get_attribute(attrs, "start_time"),
+                   "n_times": n_times}
+        for key in ["type", "subtype", "version", "last_update", "title", "sample_period_unit"]:
+            if row[key] is not None:
+                row[key] = str(row[key])
+        for key in ["sample_period", "start_time"]:
+            if not isinstance(row[key], (int, float)):
+                row[key] = None
+        return row, datasets, attributes
+
+    def _delete(self, path):
+        for table in ["files", "datasets", "attributes"]:
+            self._connection.execute("DELETE FROM %s WHERE path = ?" % table, (path,))
+
+    def _index(self, path, stat):
+        try:
+            row, datasets, attributes = self._read_file(path)
+        except Exception as e:
+            warning("Failed to index H5 file %s: %s" % (path, str(e)), self.logger)
+            return False
+        row.update({"path": path, "folder": os.path.dirname(path), "mtime": stat.st_mtime, "size": stat.st_size,
+                    "indexed_at": time.time()})
+        self._delete(path)
+        self._connection.execute("INSERT INTO files (%s) VALUES (%s)" %
+                                 (", ".join(self.FILES_COLUMNS), ", ".join(["?"] * len(self.FILES_COLUMNS))),
+                                 [row[column] for column in self.FILES_COLUMNS])
+        self._connection.executemany("INSERT INTO datasets VALUES (?, ?, ?, ?, ?, ?)", datasets)
+        self._connection.executemany("INSERT INTO attributes VALUES (?, ?, ?, ?)", attributes)
+        return True
+
+    def _indexed_stats(self, folder=None):
+        if folder is None:
+            cursor = self._connection.execute("SELECT path, mtime, size FROM files")
+        else:
+            cursor = self._connection.execute("SELECT path, mtime, size FROM files WHERE folder = ? OR folder LIKE ?",
+                                              (folder, os.path.join(folder, "%")))
+        return dict([(path, (mtime, size)) for path, mtime, size in cursor.fetchall()])
+
+    def index_file(self, path, force=False):
+        """
+        Index a single file, unless it is already indexed and unmodified.
+        :return: True if the file has been (re)indexed
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._delete(path)
+                self._connection.commit()
+                return False
+            if not force and self._connection.execute("SELECT mtime, size FROM files WHERE path = ?",
+                                                      (path,)).fetchone() == (stat.st_mtime, stat.st_size):
+                return False
+            result = self._index(path, stat)
+            self._connection.commit()
+            return result
+
+    def _scan(self, folder, recursive=True):
+        for entry in os.scandir(folder):
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    for item in self._scan(entry.path, recursive):
+                        yield item
+            elif entry.name.lower().endswith(self.extensions):
+                yield entry.path, entry.stat()
+
+    def update(self, folder, recursive=True, force=False):
+        """
+        Incrementally update the catalog with the H5 files of a folder.
+        :param folder: the folder to be scanned
+        :param recursive: if True, scan the subfolders too
+        :param force: if True, reindex all files, even if unmodified
+        :return: the numbers of (re)indexed and removed files
+        """
+        folder = os.path.abspath(folder)
+        n_indexed = 0
+        with self._lock:
+            indexed = self._indexed_stats(folder)
+            if not recursive:
+                indexed = dict([(path, stats) for path, stats in indexed.items()
+                                if os.path.dirname(path) == folder])
+            for path, stat in self._scan(folder, recursive):
+                stats = indexed.pop(path, None)
+                if force or stats != (stat.st_mtime, stat.st_size):
+                    n_indexed += int(self._index(path, stat))
+            # Whatever is left was not found on disk anymore:
+            for path in indexed.keys():
+                self._delete(path)
+            self._connection.commit()
+        self.logger.info("H5 catalog %s: %d files (re)indexed and %d removed from folder %s"
+                         % (self.db_path, n_indexed, len(indexed), folder))
+        return n_indexed, len(indexed)
+
+    def query(self, type=None, subtype=None, sample_period=None, dataset=None, folder=None, tolerance=1e-9,
+              **attributes):
+        """
+        Find the paths of the indexed files that match all the given criteria, e.g.,
+        catalog.query(subtype="TimeSeriesRegion", sample_period=0.1, dataset="data", subject="s01").
+        :param type, subtype: the values of the Type and Subtype attributes (or of TVB's type attribute)
+        :param sample_period: the sample period of TimeSeries, matched within tolerance
+        :param dataset: the name (path within the file) of a dataset that the files should contain
+        :param folder: the folder that the files should be in, including its subfolders
+        :param attributes: the values of any other root attributes, e.g., subject="s01",
+                           matched numerically for numbers and booleans, or as strings otherwise
+        :return: the sorted list of matching file paths
+        """
+        conditions = []
+        parameters = []
+        for column, value in [("type", type), ("subtype", subtype)]:
+            if value is not None:
+                conditions.append("files.%s = ?" % column)
+                parameters.append(str(value))
+        if sample_period is not None:
+            conditions.append("ABS(files.sample_period - ?) <= ?")
+            parameters += [float(sample_period), tolerance]
+        if folder is not None:
+            folder = os.path.abspath(folder)
+            conditions.append("(files.folder = ? OR files.folder LIKE ?)")
+            parameters += [folder, os.path.join(folder, "%")]
+        if dataset is not None:
+            conditions.append("files.path IN (SELECT path FROM datasets WHERE name = ?)")
+            parameters.append(dataset.strip("/"))
+        for key, value in attributes.items():
+            keys = [key, self.TVB_PREFIX + key]
+            if isinstance(value, (bool, numpy.bool_)):
+                # Boolean attributes are indexed as numbers (see _to_python), or as strings if written as such:
+                conditions.append("files.path IN (SELECT path FROM attributes WHERE key IN (?, ?) "
+                                  "AND (ABS(number - ?) <= ? OR value = ?))")
+                parameters += keys + [float(value), tolerance, str(bool(value))]
+            elif isinstance(value, (int, float, numpy.number)):
+                conditions.append("files.path IN (SELECT path FROM attributes WHERE key IN (?, ?) "
+                                  "AND ABS(number - ?) <= ?)")
+                parameters += keys + [float(value), tolerance]
+            else:
+                conditions.append("files.path IN (SELECT path FROM attributes WHERE key IN (?, ?) AND value = ?)")
+                parameters += keys + [str(value)]
+        sql = "SELECT path FROM files"
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            return [row[0] for row in self._connection.execute(sql + " ORDER BY path", parameters).fetchall()]
+
+    def get(self, path):
+        """
+        :return: the catalog's record of a file as a dict, including its "datasets" and "attributes" dicts,
+                 or None if the file is not indexed
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._connection.execute("SELECT %s FROM files WHERE path = ?" % ", ".join(self.FILES_COLUMNS),
+                                           (path,)).fetchone()
+            if row is None:
+                return None
+            record = dict(zip(self.FILES_COLUMNS, row))
+            record["datasets"] = dict([(name, {"shape": shape, "ndim": ndim, "size": size, "dtype": dtype})
+                                       for name, shape, ndim, size, dtype in self._connection.execute(
+                                           "SELECT name, shape, ndim, size, dtype FROM datasets WHERE path = ?",
+                                           (path,)).fetchall()])
+            record["attributes"] = dict(self._connection.execute(
+                "SELECT key, value FROM attributes WHERE path = ?", (path,)).fetchall())
+        return record
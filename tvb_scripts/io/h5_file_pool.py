@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import os
+import atexit
+import threading
+from collections import OrderedDict
+
+import h5py
+
+from tvb_scripts.config import CONFIGURED
+from tvb_scripts.utils.log_error_utils import initialize_logger, raise_value_error
+
+
+class H5FileHandle(object):
+
+    def __init__(self, h5_file, writable):
+        self.h5_file = h5_file
+        self.writable = writable
+        self.references = 0
+        self.file_stat = self._file_stat()
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.h5_file.filename)
+            return stat.st_ino, stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    @property
+    def is_valid(self):
+        return bool(self.h5_file.id.valid)
+
+    @property
+    def is_stale(self):
+        # An unreferenced read-only handle is stale if its file has been modified, or replaced, since it was opened,
+        # and an unreferenced writable one, which modifies its file itself, if its file has been replaced
+        if self.references > 0:
+            return False
+        file_stat = self._file_stat()
+        if self.writable:
+            return file_stat is None or self.file_stat is None or file_stat[0] != self.file_stat[0]
+        return file_stat != self.file_stat
+
+
+class H5FilePool(object):
+    """
+    A pool of open h5py File handles, keyed by (file path, "r" or "a" mode),
+    so that successive reads from the same files avoid reopening them and parsing their metadata again.
+    Handles are borrowed via acquire and returned via release, which keeps track of their references.
+    By default, handles are closed as soon as they are unreferenced (writable ones after being flushed),
+    so that files are complete on disk and can be written by other processes or libraries,
+    which HDF5 does not allow while a file is open, and the pool only shares handles among concurrent users.
+    If keep_readable (keep_writable) is True, unreferenced read-only (writable) handles stay open,
+    until they are evicted in least recently used order, when more than max_size handles are open,
+    or until they are closed via close(path), which has to precede any write to their files from outside the pool.
+    """
+    logger = initialize_logger(__name__)
+
+    READ_MODE = "r"
+    WRITE_MODE = "a"
+
+    def __init__(self, max_size=CONFIGURED.h5.FILE_POOL_SIZE, keep_readable=CONFIGURED.h5.FILE_POOL_KEEP_READABLE,
+                 keep_writable=CONFIGURED.h5.FILE_POOL_KEEP_WRITABLE):
+        self.max_size = max_size
+        self.keep_readable = keep_readable
+        self.keep_writable = keep_writable
+        self._handles = OrderedDict()
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.opens = 0
+        self.closes = 0
+        self.evictions = 0
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "opens": self.opens, "closes": self.closes,
+                    "evictions": self.evictions, "open_files": len(self._handles),
+                    "referenced_files": len([handle for handle in self._handles.values()
+                                             if handle.references > 0])}
+
+    def _check_process(self):
+        # Handles inherited by a forked process must not be used, nor closed by it:
+        if self._pid != os.getpid():
+            self._handles = OrderedDict()
+            self._pid = os.getpid()
+
+    def _close_handle(self, key):
+        handle = self._handles.pop(key)
+        if handle.is_valid:
+            handle.h5_file.close()
+            self.closes += 1
+
+    def _get_handle(self, key):
+        # Return a still valid handle, forgetting about any handle that has been closed directly,
+        # and closing any handle of a file that has been modified by others in the meantime
+        handle = self._handles.get(key, None)
+        if handle is not None:
+            if not handle.is_valid:
+                del self._handles[key]
+                handle = None
+            elif handle.is_stale:
+                self._close_handle(key)
+                handle = None
+        return handle
+
+    def _close_unreferenced(self, key, path):
+        handle = self._get_handle(key)
+        if handle is not None:
+            if handle.references > 0:
+                raise_value_error("H5 file %s is in use in %s mode and cannot be reopened!" % (path, key[1]),
+                                  self.logger)
+            self._close_handle(key)
+
+    def _evict(self):
+        for key in list(self._handles.keys()):
+            if len(self._handles) <= self.max_size:
+                break
+            if self._handles[key].references == 0:
+                self._close_handle(key)
+                self.evictions += 1
+
+    def acquire(self, path, mode="r"):
+        """
+        Borrow an open h5py File of path from the pool, opening it if necessary.
+        :param path: the H5 file path
+        :param mode: the h5py mode: "r" is served also by writable handles,
+                     "r+" and "a" reuse writable handles, and "w", "w-", "x" always (re)create the file
+        :return: the h5py File, to be returned to the pool via release
+        """
+        path = os.path.abspath(path)
+        read_key = (path, self.READ_MODE)
+        write_key = (path, self.WRITE_MODE)
+        with self._lock:
+            self._check_process()
+            if mode == self.READ_MODE:
+                keys = [read_key, write_key]
+            elif mode in ("r+", "a"):
+                keys = [write_key]
+            else:
+                keys = []
+            for key in keys:
+                handle = self._get_handle(key)
+                if handle is not None:
+                    handle.references += 1
+                    self._handles.move_to_end(key)
+                    self.hits += 1
+                    return handle.h5_file
+            # HDF5 does not allow opening the same file with conflicting modes, nor truncating an open file:
+            if mode != self.READ_MODE:
+                self._close_unreferenced(read_key, path)
+                if len(keys) == 0:
+                    self._close_unreferenced(write_key, path)
+            self.misses += 1
+            h5_file = h5py.File(path, mode, libver='latest')
+            self.opens += 1
+            key = read_key if mode == self.READ_MODE else write_key
+            handle = H5FileHandle(h5_file, mode != self.READ_MODE)
+            handle.references = 1
+            self._handles[key] = handle
+            self._evict()
+            return h5_file
+
+    def release(self, h5_file):
+        """
+        Return a borrowed h5py File to the pool. Files not borrowed from the pool are just closed.
+        :param h5_file: the h5py File, or its path, in which case its read-only, or else its writable, handle is released
+        """
+        with self._lock:
+            self._check_process()
+            if isinstance(h5_file, str):
+                path = os.path.abspath(h5_file)
+                handle = self._get_handle((path, self.READ_MODE)) or self._get_handle((path, self.WRITE_MODE))
+                if handle is None:
+                    return
+                h5_file = handle.h5_file
+            for key, handle in self._handles.items():
+                if handle.h5_file is h5_file:
+                    if handle.is_valid:
+                        handle.references = max(0, handle.references - 1)
+                        if handle.references == 0:
+                            if handle.writable:
+                                if self.keep_writable:
+                                    h5_file.flush()
+                                else:
+                                    self._close_handle(key)
+                            elif not self.keep_readable:
+                                self._close_handle(key)
+                    else:
+                        del self._handles[key]
+                    self._evict()
+                    return
+        if h5_file.id.valid:
+            h5_file.close()
+
+    def close(self, path=None, force=False):
+        """
+        Close the unreferenced handles of path, or of all files if path is None.
+        :param force: if True, close also the referenced ones
+        """
+        with self._lock:
+            self._check_process()
+            if path is not None:
+                path = os.path.abspath(path)
+            for key in list(self._handles.keys()):
+                if (path is None or key[0] == path) and (force or self._handles[key].references == 0):
+                    self._close_handle(key)
+
+
+H5_FILE_POOL = H5FilePool()
+
+atexit.register(H5_FILE_POOL.close, force=True)
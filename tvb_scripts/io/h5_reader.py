@@ -2,14 +2,104 @@
 
 import os
 import h5py
+import numpy
 
 from tvb_scripts.utils.log_error_utils import initialize_logger
+from tvb_scripts.utils.data_structures_utils import is_integer
 from tvb_scripts.io.h5_writer import H5Writer
+from tvb_scripts.io.h5_file_pool import H5_FILE_POOL
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+class H5DatasetProxy(object):
+    """
+    A lazy, read-only proxy of an h5py Dataset, which keeps the dataset's file open.
+    Slicing it reads only the requested hyperslab from the file,
+    whereas the whole dataset is read only when explicitly requested, via read(), proxy[()] or numpy.array(proxy).
+    Unlike h5py, a single list or array of (unsorted, possibly repeated) indices is allowed per slicing.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    @property
+    def file(self):
+        return self.dataset.file
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def ndim(self):
+        return self.dataset.ndim
+
+    @property
+    def size(self):
+        return self.dataset.size
+
+    @property
+    def attrs(self):
+        return self.dataset.attrs
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __repr__(self):
+        return "%s(%s, shape=%s, dtype=%s)" % (self.__class__.__name__, self.dataset.name,
+                                               str(self.shape), str(self.dtype))
+
+    def read(self, out=None):
+        """
+        Materialize the whole dataset, optionally into a preallocated array.
+        """
+        if out is None:
+            return self.dataset[()]
+        self.dataset.read_direct(out)
+        return out
+
+    def __array__(self, dtype=None):
+        data = self.read()
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        fancy = [i_key for i_key, k in enumerate(key) if isinstance(k, (list, numpy.ndarray))]
+        if len(fancy) != 1 or any(k is Ellipsis for k in key):
+            return self.dataset[key]
+        # h5py supports only increasing indices, therefore read the unique sorted ones and reorder in memory:
+        i_key = fancy[0]
+        inds = numpy.array(key[i_key])
+        if inds.dtype == bool:
+            return self.dataset[key]
+        n = self.shape[i_key]
+        if numpy.any(inds >= n) or numpy.any(inds < -n):
+            raise IndexError("Index out of range for axis %d of size %d!" % (i_key, n))
+        inds = inds.astype("i8")
+        inds[inds < 0] += n
+        unique_inds, inverse = numpy.unique(inds, return_inverse=True)
+        data = self.dataset[key[:i_key] + (unique_inds,) + key[i_key + 1:]]
+        # The indices' axis in the output is shifted by the integer indices preceding it:
+        axis = i_key - len([k for k in key[:i_key] if is_integer(k)])
+        return numpy.take(data, inverse.reshape(inds.shape), axis=axis)
 
 
 class H5Reader(object):
 
     logger = initialize_logger(__name__)
+    file_pool = H5_FILE_POOL
 
     H5_TYPE_ATTRIBUTE = H5Writer().H5_TYPE_ATTRIBUTE
     H5_SUBTYPE_ATTRIBUTE = H5Writer().H5_SUBTYPE_ATTRIBUTE
@@ -21,43 +111,126 @@ class H5Reader(object):
                 raise ValueError("%s file %s does not exist" % (name, path))
 
             self.logger.info("Starting to read %s from: %s" % (name, path))
-            h5_file = h5py.File(path, 'r', libver='latest')
+            h5_file = self.file_pool.acquire(path, 'r')
         return h5_file
 
     def _close_file(self, h5_file, close_file=True):
         if close_file:
-            h5_file.close()
+            self.file_pool.release(h5_file)
+
+    def release(self, path):
+        """
+        Release the file left open by a lazy read, once its H5DatasetProxy objects are no longer needed,
+        so that the file can be closed, and written again. Every lazy read of a file has to be released once.
+        :param path: the path of the file (or the h5py File) of the lazy read
+        """
+        self.file_pool.release(path)
 
     def _log_success(self, name, path=None):
         if path is not None:
             self.logger.info("Successfully read %s from: %s" % (name, path))
 
-    def read_dictionary(self, path=None, h5_file=None, type=None, close_file=True):
+    def memmap_dataset(self, path, name="data", mode="r"):
+        """
+        Memory map a contiguous, uncompressed H5 dataset, e.g., the data of a TimeSeries,
+        as written by H5Writer, or by H5TimeSeriesStream.close(contiguous=True).
+        :param path: Path towards the H5 file
+        :param name: the name of the dataset
+        :param mode: the numpy.memmap mode
+        :return: numpy.memmap
+        """
+        h5_file = self.file_pool.acquire(path, 'r')
+        try:
+            dataset = h5_file[name]
+            offset = dataset.id.get_offset()
+            if dataset.chunks is not None or dataset.compression is not None or offset is None:
+                raise ValueError("Dataset %s of file %s is chunked, compressed or empty, and cannot be memory mapped!"
+                                 % (name, path))
+            shape, dtype = dataset.shape, dataset.dtype
+            # The offset is within the file that holds the dataset, which is another file,
+            # if the dataset is an external link, e.g., to a blob of an H5BlobStore:
+            dataset_path = dataset.file.filename
+        finally:
+            self.file_pool.release(h5_file)
+        return numpy.memmap(dataset_path, mode=mode, shape=shape, dtype=dtype, offset=offset)
+
+    def read_time_series(self, path=None, h5_file=None, time_series_class=None, data_name="data",
+                         memmap=False, close_file=True):
+        """
+        Read a TimeSeries written by H5Writer.open_time_series_stream
+        :param path: Path towards a TimeSeries H5 file
+        :param time_series_class: the TimeSeries class to instantiate, default: the one of the file's subtype
+        :param memmap: if True, memory map the data, if possible, instead of reading them
+        :return: TimeSeries
+        """
+        from tvb_scripts.datatypes import time_series
+        h5_file = self._open_file("TimeSeries", path, h5_file)
+        if time_series_class is None:
+            time_series_class = getattr(time_series, _to_str(h5_file.attrs.get(self.H5_SUBTYPE_ATTRIBUTE, "")),
+                                        time_series.TimeSeries)
+        data = None
+        if memmap:
+            try:
+                data = self.memmap_dataset(h5_file.filename, data_name)
+            except ValueError as e:
+                self.logger.warning(str(e) + " Reading it in memory instead!")
+        if data is None:
+            data = h5_file[data_name][()]
+        kwargs = {"time": h5_file["time"][()]}
+        for attr in ["sample_period_unit", "title"]:
+            if attr in h5_file.attrs:
+                kwargs[attr] = _to_str(h5_file.attrs[attr])
+        if "labels_ordering" in h5_file.attrs:
+            kwargs["labels_ordering"] = [_to_str(label) for label in h5_file.attrs["labels_ordering"]]
+        if "labels_dimensions" in h5_file:
+            kwargs["labels_dimensions"] = \
+                dict([(key, [_to_str(label) for label in dataset[()]])
+                      for key, dataset in h5_file["labels_dimensions"].items()])
+        self._close_file(h5_file, close_file)
+        self._log_success("TimeSeries", path)
+        return time_series_class(data, **kwargs)
+
+    def read_dictionary(self, path=None, h5_file=None, type=None, close_file=True, lazy=False):
         """
         :param path: Path towards a dictionary H5 file
+        :param lazy: if True, datasets are returned as H5DatasetProxy objects, and the file is left open,
+                     until released via release(path)
         :return: dict
         """
         h5_file = self._open_file("Dictionary", path, h5_file)
-        dictionary = H5GroupHandlers(self.H5_SUBTYPE_ATTRIBUTE).read_dictionary_from_group(h5_file, type)
-        self._close_file(h5_file, close_file)
+        dictionary = H5GroupHandlers(self.H5_SUBTYPE_ATTRIBUTE).read_dictionary_from_group(h5_file, type, lazy)
+        self._close_file(h5_file, close_file and not lazy)
         self._log_success("Dictionary", path)
         return dictionary
 
-    def read_list_of_dicts(self, path=None, h5_file=None, type=None, close_file=True):
+    def _generate_dicts(self, path, h5_file, type=None, close_file=True, lazy=False):
+        # The file is opened on the first iteration, so that a generator that is never iterated holds no file:
         h5_file = self._open_file("List of dictionaries", path, h5_file)
-        list_of_dicts = []
-        id = 0
         h5_group_handlers = H5GroupHandlers(self.H5_SUBTYPE_ATTRIBUTE)
-        while 1:
-            try:
-                dict_group = h5_file[str(id)]
-            except:
-                break
-            list_of_dicts.append(h5_group_handlers.read_dictionary_from_group(dict_group, type))
-            id += 1
-        self._close_file(h5_file, close_file)
+        try:
+            # The list's items are the groups named by their integer index:
+            for key in sorted([key for key in h5_file.keys() if key.isdigit()], key=int):
+                yield h5_group_handlers.read_dictionary_from_group(h5_file[key], type, lazy)
+        finally:
+            self._close_file(h5_file, close_file and not lazy)
         self._log_success("List of dictionaries", path)
-        return list_of_dicts
+
+    def read_list_of_dicts(self, path=None, h5_file=None, type=None, close_file=True, lazy=False, generator=False):
+        """
+        :param path: Path towards a list of dictionaries H5 file
+        :param lazy: if True, datasets are returned as H5DatasetProxy objects, and the file is left open,
+                     until released via release(path)
+        :param generator: if True, return a generator of the dictionaries, which opens the file when first iterated,
+                          reads the dictionaries one by one, and closes the file, if close_file is True,
+                          when exhausted, or closed
+        :return: list of dicts, or a generator of dicts
+        """
+        if h5_file is None and not os.path.isfile(path):
+            raise ValueError("List of dictionaries file %s does not exist" % path)
+        dicts = self._generate_dicts(path, h5_file, type, close_file, lazy)
+        if generator:
+            return dicts
+        return list(dicts)
 
 
 class H5GroupHandlers(object):
@@ -68,13 +241,39 @@ class H5GroupHandlers(object):
         if h5_subtype_attribute is not None:
             self.H5_SUBTYPE_ATTRIBUTE = h5_subtype_attribute
 
-    def read_dictionary_from_group(self, group, type=None):
-        dictionary = dict()
-        for dataset in group.keys():
-            dictionary.update({dataset: group[dataset][()]})
-        for attr in group.attrs.keys():
-            dictionary.update({attr: group.attrs[attr]})
-        if type is None:
-            type = group.attrs[H5Reader.H5_SUBTYPE_ATTRIBUTE]
-        else:
-            return dictionary
+    def _read_dataset(self, dataset, lazy=False):
+        if lazy:
+            return H5DatasetProxy(dataset)
+        return dataset[()]
+
+    def read_dictionary_from_group(self, group, type=None, lazy=False):
+        """
+        Read a group to a dictionary of its datasets and attributes, with its subgroups as nested dictionaries,
+        as written by H5Writer.write_dictionary, in a single traversal of the group.
+        Attributes take precedence over homonymous datasets or subgroups.
+        :param group: the h5py Group (or File)
+        :param type: kept for backwards compatibility, not used
+        :param lazy: if True, datasets are returned as H5DatasetProxy objects
+        :return: dict
+        """
+        dictionary = dict(group.attrs.items())
+        dictionaries = {"": dictionary}
+
+        def read_item(name, item):
+            parent_name, _, key = name.rpartition("/")
+            if isinstance(item, h5py.Group):
+                dictionaries[name] = dict(item.attrs.items())
+                dictionaries[parent_name].setdefault(key, dictionaries[name])
+            else:
+                dictionaries[parent_name].setdefault(key, self._read_dataset(item, lazy))
+
+        group.visititems(read_item)
+        # visititems does not follow external and soft links, e.g., the ones to the files of a sharded list:
+        for key in group.keys():
+            if key not in dictionaries and key not in dictionary:
+                item = group.get(key, None)
+                if isinstance(item, h5py.Group):
+                    dictionary[key] = self.read_dictionary_from_group(item, type, lazy)
+                elif item is not None:
+                    dictionary[key] = self._read_dataset(item, lazy)
+        return dictionary
@@ -1,19 +1,197 @@
 # -*- coding: utf-8 -*-
 
 import os
+import uuid
+import time as timer
 import h5py
 import inspect
 import numpy
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 
 from tvb_scripts.config import CONFIGURED
 from tvb_scripts.io.datatypes_h5 import REGISTRY
+from tvb_scripts.io.h5_file_pool import H5_FILE_POOL
 
 from tvb.core.neocom import h5
-from tvb_scripts.utils.log_error_utils import warning, initialize_logger
+from tvb_scripts.utils.log_error_utils import warning, initialize_logger, raise_value_error
 from tvb_scripts.utils.data_structures_utils import is_numeric
 from tvb_scripts.utils.file_utils import change_filename_or_overwrite
 
 
+def compute_time_major_chunks(shape, dtype, chunk_bytes=CONFIGURED.h5.CHUNK_BYTES):
+    """
+    Compute a chunk shape for time-major access of a dataset with time as its first dimension,
+    i.e., chunks span all the other dimensions, if possible, and as many time points as fit in chunk_bytes.
+    If a single time point does not fit, the last dimensions are split first.
+    :param shape: the shape of the dataset
+    :param dtype: the dtype of the dataset
+    :param chunk_bytes: the target size of a chunk in bytes
+    :return: the chunk shape tuple, or None for scalar or empty datasets
+    """
+    shape = tuple(int(s) for s in shape)
+    if len(shape) == 0 or numpy.prod(shape) == 0:
+        return None
+    max_elements = max(1, int(chunk_bytes // numpy.dtype(dtype).itemsize))
+    chunks = list(shape)
+    for idim in range(len(shape) - 1, 0, -1):
+        n_elements = int(numpy.prod(chunks[1:]))
+        if n_elements <= max_elements:
+            break
+        n_others = n_elements // chunks[idim]
+        chunks[idim] = max(1, max_elements // n_others)
+    chunks[0] = max(1, min(shape[0], max_elements // int(numpy.prod(chunks[1:]))))
+    return tuple(chunks)
+
+
+def map_in_order(fun, items, n_workers=1, use_processes=False):
+    """
+    Generate fun(item) for all items, in their order, computing them in a pool of n_workers threads or processes.
+    At most 2 * n_workers results are pending at any time, so that a slow consumer bounds the memory in use.
+    """
+    if n_workers is None or n_workers <= 1:
+        for item in items:
+            yield fun(item)
+        return
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=int(n_workers)) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fun, item))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+class H5TimeSeriesStream(object):
+    """
+    An appendable TimeSeries H5 file, for writing long simulations' outputs block by block.
+    Data and time are written in chunked datasets, resizable along time (the first dimension),
+    and the start_time, sample_period and number of time points attributes are kept consistent with every append.
+    Use H5Writer.open_time_series_stream to create one, preferably as a context manager.
+    """
+
+    def __init__(self, h5_file, data_name="data", flush_samples=None, flush_seconds=None, logger=None,
+                 file_pool=H5_FILE_POOL, catalog=None):
+        self.h5_file = h5_file
+        self.file_pool = file_pool
+        self.catalog = catalog
+        self.path = h5_file.filename
+        self.data_name = data_name
+        self.flush_samples = flush_samples
+        self.flush_seconds = flush_seconds
+        self.logger = logger or initialize_logger(__name__)
+        self.data = h5_file[data_name]
+        self.time = h5_file["time"]
+        self.start_time = float(h5_file.attrs["start_time"])
+        self.sample_period = float(h5_file.attrs["sample_period"])
+        self._unflushed_samples = 0
+        self._last_flush = timer.time()
+        self._closed = False
+
+    @property
+    def n_times(self):
+        return self.data.shape[0]
+
+    @property
+    def is_open(self):
+        # The file may be kept open by the pool after the stream has been closed
+        return not self._closed and bool(self.h5_file.id.valid)
+
+    def append(self, block, time=None):
+        """
+        Append a block of data of shape (time points, ) + shape_without_time.
+        :param block: the data block
+        :param time: the time points of the block. If None,
+                     they follow from start_time and sample_period, and the stream's current length.
+        :return: the stream's number of time points after the append
+        """
+        block = numpy.asarray(block)
+        if block.shape[1:] != self.data.shape[1:]:
+            if block.shape == self.data.shape[1:]:
+                block = block[numpy.newaxis]
+            else:
+                raise_value_error("Block of shape %s does not match the stream's shape %s!"
+                                  % (str(block.shape), str(self.data.shape)), self.logger)
+        n_block = block.shape[0]
+        if n_block == 0:
+            return self.n_times
+        if time is None:
+            time = self.start_time + self.sample_period * numpy.arange(self.n_times, self.n_times + n_block)
+        else:
+            time = numpy.asarray(time, dtype=self.time.dtype).flatten()
+            if time.size != n_block:
+                raise_value_error("%d time points given for a block of %d time points!"
+                                  % (time.size, n_block), self.logger)
+        start = self.n_times
+        stop = start + n_block
+        self.data.resize(stop, axis=0)
+        self.data[start:stop] = block
+        self.time.resize(stop, axis=0)
+        self.time[start:stop] = time
+        if start == 0:
+            self.start_time = float(time[0])
+            self.h5_file.attrs["start_time"] = self.start_time
+        self.h5_file.attrs["length_1d"] = stop
+        self._unflushed_samples += n_block
+        if (self.flush_samples is not None and self._unflushed_samples >= self.flush_samples) or \
+                (self.flush_seconds is not None and timer.time() - self._last_flush >= self.flush_seconds):
+            self.flush()
+        return stop
+
+    def flush(self):
+        self.h5_file.flush()
+        self._unflushed_samples = 0
+        self._last_flush = timer.time()
+
+    def close(self, contiguous=False):
+        """
+        Close the stream's file.
+        :param contiguous: if True, repack data and time into contiguous, uncompressed datasets,
+                           so that the file's data can be memory mapped (see H5Reader.memmap_dataset)
+        :return: the path of the file
+        """
+        if not self.is_open:
+            return self.path
+        n_times = self.n_times
+        self.h5_file.attrs["length_1d"] = n_times
+        self.file_pool.release(self.h5_file)
+        self._closed = True
+        if contiguous:
+            # The pool may keep the file open, which would otherwise keep serving the file replaced by the repacking:
+            self.file_pool.close(self.path)
+            self._repack_contiguous()
+        if self.catalog is not None:
+            self.catalog.index_file(self.path)
+        self.logger.info("TimeSeries stream of %d time points has been written to file: %s" % (n_times, self.path))
+        return self.path
+
+    def _repack_contiguous(self):
+        temp_path = self.path + ".repack"
+        with h5py.File(self.path, "r", libver='latest') as source, \
+                h5py.File(temp_path, "w", libver='latest') as target:
+            for key, value in source.attrs.items():
+                target.attrs[key] = value
+            for key in source.keys():
+                if key not in (self.data_name, "time"):
+                    source.copy(key, target)
+            for key in (self.data_name, "time"):
+                dataset = source[key]
+                target_dataset = target.create_dataset(key, shape=dataset.shape, dtype=dataset.dtype)
+                step = max(1, dataset.chunks[0] if dataset.chunks else dataset.shape[0])
+                for start in range(0, dataset.shape[0], step):
+                    target_dataset[start:start + step] = dataset[start:start + step]
+        os.replace(temp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class H5Writer(object):
 
     config = CONFIGURED
@@ -25,17 +203,146 @@ class H5Writer(object):
     force_overwrite = True
     write_mode = "a"
 
+    file_pool = H5_FILE_POOL
+    # An H5Catalog, if any, that indexes every file written and closed by this writer
+    catalog = None
+    # An H5BlobStore, if any, where large arrays are stored once, and linked to from the files written
+    blob_store = None
+
+    STORAGE_KEYS = ["chunks", "compression", "compression_opts", "shuffle", "float32"]
+
+    def __init__(self, config=None, catalog=None, blob_store=None, **storage):
+        """
+        :param config: the configuration, whose h5 member sets the default datasets' storage policy
+        :param catalog: an H5Catalog to index every file written
+        :param blob_store: an H5BlobStore to deduplicate large arrays across files
+        :param storage: writer-wide overrides of the storage policy, i.e., any of
+                        chunks ("auto", a chunk shape tuple, a dict of such per dataset name, or None),
+                        compression ("gzip", "lzf" or None), compression_opts, shuffle and float32
+        """
+        if config is not None:
+            self.config = config
+        if catalog is not None:
+            self.catalog = catalog
+        if blob_store is not None:
+            self.blob_store = blob_store
+        self.storage = self._check_storage(storage)
+
+    def __getstate__(self):
+        # Writers are pickled to prepare payloads in worker processes, which neither index, nor access, files:
+        state = self.__dict__.copy()
+        state.pop("catalog", None)
+        state.pop("file_pool", None)
+        return state
+
+    def _check_storage(self, storage):
+        for key in storage.keys():
+            if key not in self.STORAGE_KEYS:
+                raise_value_error("Unknown H5 storage option %s! Available options are: %s"
+                                  % (key, str(self.STORAGE_KEYS)), self.logger)
+        return storage
+
+    def storage_policy(self, **storage):
+        """
+        Return the datasets' storage policy as a dict:
+        the defaults of config.h5, updated by the writer's storage options, updated by the per-call ones.
+        """
+        policy = {"chunks": self.config.h5.CHUNKS,
+                  "compression": self.config.h5.COMPRESSION,
+                  "compression_opts": self.config.h5.COMPRESSION_OPTS,
+                  "shuffle": self.config.h5.SHUFFLE,
+                  "float32": self.config.h5.FLOAT32}
+        policy.update(self.storage)
+        policy.update(self._check_storage(storage))
+        return policy
+
+    def _dataset_storage(self, key, value, policy):
+        # Return the (possibly downcast) data and the create_dataset keyword arguments for this dataset
+        if policy["float32"] and value.dtype == numpy.float64 and key not in self.config.h5.FLOAT64_DATASETS:
+            value = value.astype(numpy.float32)
+        chunks = policy["chunks"]
+        if isinstance(chunks, dict):
+            chunks = chunks.get(key, self.config.h5.CHUNKS)
+        if chunks is None or value.ndim == 0 or value.size == 0 or value.dtype.kind not in "biufc" or \
+                (value.nbytes < self.config.h5.MIN_CHUNKED_BYTES and not isinstance(chunks, tuple)):
+            return value, {}
+        if isinstance(chunks, tuple) and len(chunks) != value.ndim:
+            warning("Chunk shape %s does not match the %d dimensions of dataset %s! Computing it automatically..."
+                    % (str(chunks), value.ndim, key), self.logger)
+            chunks = "auto"
+        if chunks == "auto":
+            chunks = compute_time_major_chunks(value.shape, value.dtype, self.config.h5.CHUNK_BYTES)
+        kwargs = {"chunks": tuple(min(int(c), int(s)) for c, s in zip(chunks, value.shape))}
+        if policy["compression"] is not None:
+            kwargs["compression"] = policy["compression"]
+            if policy["compression"] == "gzip":
+                kwargs["compression_opts"] = policy["compression_opts"]
+            kwargs["shuffle"] = bool(policy["shuffle"])
+        return value, kwargs
+
+    def _create_dataset(self, location, key, value, policy=None, digest=None):
+        if policy is None:
+            policy = self.storage_policy()
+        if isinstance(value, numpy.ndarray):
+            value, kwargs = self._dataset_storage(key, value, policy)
+            if self.blob_store is not None and self.blob_store.is_deduplicated(value):
+                location[key] = self.blob_store.external_link(value, location.file.filename, digest, **kwargs)
+                return location[key]
+            return location.create_dataset(key, data=value, **kwargs)
+        return location.create_dataset(key, data=value)
+
     def _open_file(self, name, path=None, h5_file=None):
         if h5_file is None:
             if self.write_mode == "w":
                 path = change_filename_or_overwrite(path, self.force_overwrite)
             self.logger.info("Starting to write %s to: %s" % (name, path))
-            h5_file = h5py.File(path, self.write_mode, libver='latest')
+            h5_file = self.file_pool.acquire(path, self.write_mode)
         return h5_file, path
 
     def _close_file(self, h5_file, close_file=True):
         if close_file:
-            h5_file.close()
+            filename = h5_file.filename
+            self.file_pool.release(h5_file)
+            self._index_file(filename)
+
+    def _copy_group_with_policy(self, source_group, target_group, policy, referencing_path):
+        for key, value in source_group.attrs.items():
+            target_group.attrs[key] = value
+        for key in source_group.keys():
+            link = source_group.get(key, getlink=True)
+            if not isinstance(link, h5py.HardLink):
+                target_group[key] = link
+                continue
+            item = source_group[key]
+            if isinstance(item, h5py.Group):
+                self._copy_group_with_policy(item, target_group.create_group(key), policy, referencing_path)
+            elif item.dtype.kind in "biufc" and item.ndim > 0:
+                value, kwargs = self._dataset_storage(key, item[()], policy)
+                attrs = dict(item.attrs.items())
+                if self.blob_store is not None and self.blob_store.is_deduplicated(value):
+                    target_group[key] = self.blob_store.external_link(value, referencing_path, attrs=attrs, **kwargs)
+                else:
+                    dataset = target_group.create_dataset(key, data=value, **kwargs)
+                    for attr_key, attr_value in attrs.items():
+                        dataset.attrs[attr_key] = attr_value
+            else:
+                source_group.copy(key, target_group)
+
+    def _rewrite_stored_file(self, path, policy):
+        # Rewrite a file written by TVB's h5.store, whose datasets are contiguous and uncompressed,
+        # applying the storage policy to, and deduplicating, its numeric datasets,
+        # unless the policy is the default one, and there is no blob store.
+        if self.blob_store is None and policy["chunks"] is None and not policy["float32"]:
+            return path
+        temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with h5py.File(path, "r", libver='latest') as source, h5py.File(temp_path, "w", libver='latest') as target:
+            self._copy_group_with_policy(source, target, policy, path)
+        os.replace(temp_path, path)
+        return path
+
+    def _index_file(self, path):
+        if self.catalog is not None:
+            self.catalog.index_file(path)
 
     def _log_success(self, name, path=None):
         if path is not None:
@@ -89,11 +396,13 @@ class H5Writer(object):
 
         return datasets_dict, metadata_dict, groups_keys
 
-    def _write_dicts_at_location(self, datasets_dict, metadata_dict, location):
+    def _write_dicts_at_location(self, datasets_dict, metadata_dict, location, policy=None):
+        if policy is None:
+            policy = self.storage_policy()
         for key, value in datasets_dict.items():
             try:
                 try:
-                    location.create_dataset(key, data=value)
+                    self._create_dataset(location, key, value, policy)
                 except:
                     location.create_dataset(key, data=numpy.str(value))
             except:
@@ -108,119 +417,297 @@ class H5Writer(object):
                         (str(location), value.__class__, key, str(value)), self.logger)
         return location
 
+    def _new_payload(self, h5_type_attribute, h5_subtype_attribute):
+        # A payload holds everything that has to be written to an H5 group, i.e.,
+        # attributes, datasets with their create_dataset keyword arguments, and the payloads of subgroups
+        return {"attrs": OrderedDict([(self.H5_TYPE_ATTRIBUTE, h5_type_attribute),
+                                      (self.H5_SUBTYPE_ATTRIBUTE, h5_subtype_attribute)]),
+                "datasets": OrderedDict(), "groups": OrderedDict(), "empty": True}
+
+    def _add_dataset_to_payload(self, payload, key, value, policy):
+        digest = None
+        if isinstance(value, numpy.ndarray):
+            value, kwargs = self._dataset_storage(key, value, policy)
+            # Hash arrays to be deduplicated while preparing the payload, i.e., possibly in parallel:
+            if self.blob_store is not None and self.blob_store.is_deduplicated(value):
+                digest = self.blob_store.hash_array(value)
+        else:
+            kwargs = {}
+        payload["datasets"][key] = (value, kwargs, digest)
+
+    def _object_payload(self, object, h5_type_attribute="", nr_regions=None, policy=None):
+        """
+        Decompose an object recursively into the payload to be written to an H5 group, without any file I/O,
+        so that payloads can be prepared in parallel, and written serially.
+        """
+        if policy is None:
+            policy = self.storage_policy()
+        payload = self._new_payload(h5_type_attribute, object.__class__.__name__)
+        datasets_dict, metadata_dict, subgroups = self._determine_datasets_and_attributes(object, nr_regions)
+        payload["empty"] = len(datasets_dict) == len(metadata_dict) == len(subgroups) == 0
+        for key, value in datasets_dict.items():
+            self._add_dataset_to_payload(payload, key, value, policy)
+        payload["attrs"].update(metadata_dict)
+        for subgroup in subgroups:
+            if isinstance(object, dict):
+                child_object = object.get(subgroup, None)
+            else:
+                child_object = getattr(object, subgroup, None)
+            if child_object is not None:
+                child_payload = self._object_payload(child_object, h5_type_attribute, nr_regions, policy)
+                # Skip empty subgroups:
+                if not child_payload["empty"]:
+                    payload["groups"][subgroup] = child_payload
+        return payload
+
+    def _dictionary_payload(self, dictionary, policy=None):
+        """
+        Decompose a dictionary recursively into the payload to be written to an H5 group, without any file I/O.
+        """
+        if policy is None:
+            policy = self.storage_policy()
+        payload = self._new_payload("Dictionary", dictionary.__class__.__name__)
+        for key, value in dictionary.items():
+            try:
+                if isinstance(value, numpy.ndarray) and value.size > 0:
+                    self._add_dataset_to_payload(payload, key, value, policy)
+                else:
+                    if isinstance(value, list) and len(value) > 0:
+                        self._add_dataset_to_payload(payload, key, numpy.array(value), policy)
+                    elif callable(value):
+                        payload["attrs"][key] = inspect.getsource(value)
+                    elif isinstance(value, dict):
+                        payload["groups"][key] = self._dictionary_payload(value, policy)
+                    elif value is None:
+                        continue
+                    else:
+                        payload["attrs"][key] = str(value)
+            except:
+                self.logger.warning("Did not manage to prepare " + key + " of dictionary for writing to h5 file !")
+        payload["empty"] = len(payload["datasets"]) == len(payload["groups"]) == 0 and len(payload["attrs"]) == 2
+        return payload
+
+    def _write_payload(self, group, payload):
+        for key, value in payload["attrs"].items():
+            try:
+                group.attrs.create(key, value)
+            except:
+                warning("Failed to write to %s attribute %s %s:\n%s !" %
+                        (str(group), value.__class__, key, str(value)), self.logger)
+        for key, (value, kwargs, digest) in payload["datasets"].items():
+            try:
+                if digest is not None:
+                    group[key] = self.blob_store.external_link(value, group.file.filename, digest, **kwargs)
+                else:
+                    try:
+                        group.create_dataset(key, data=value, **kwargs)
+                    except:
+                        group.create_dataset(key, data=numpy.str(value))
+            except:
+                warning("Failed to write to %s dataset %s %s:\n%s !" %
+                        (str(group), value.__class__, key, str(value)), self.logger)
+        for key, child_payload in payload["groups"].items():
+            self._write_payload(group.create_group(key), child_payload)
+        return group
+
     def _prepare_object_for_group(self, group, object, h5_type_attribute="", nr_regions=None,
-                                  regress_subgroups=True):
+                                  regress_subgroups=True, policy=None):
+        if regress_subgroups:
+            payload = self._object_payload(object, h5_type_attribute, nr_regions, policy)
+            self._write_payload(group, payload)
+            # If empty return None
+            if payload["empty"] and not isinstance(group, h5py._hl.files.File):
+                return None
+            return group
         group.attrs.create(self.H5_TYPE_ATTRIBUTE, h5_type_attribute)
         group.attrs.create(self.H5_SUBTYPE_ATTRIBUTE, object.__class__.__name__)
         datasets_dict, metadata_dict, subgroups = self._determine_datasets_and_attributes(object, nr_regions)
         # If empty return None
         if len(datasets_dict) == len(metadata_dict) == len(subgroups) == 0:
             if isinstance(group, h5py._hl.files.File):
-                if regress_subgroups:
-                    return group
-                else:
-                    return group, subgroups
+                return group, subgroups
             else:
                 return None
         else:
             if len(datasets_dict) > 0 or len(metadata_dict) > 0:
                 if isinstance(group, h5py._hl.files.File):
-                    group = self._write_dicts_at_location(datasets_dict, metadata_dict, group)
+                    group = self._write_dicts_at_location(datasets_dict, metadata_dict, group, policy)
                 else:
-                    self._write_dicts_at_location(datasets_dict, metadata_dict, group)
-            # Continue recursively going deeper in the object
-            if regress_subgroups:
-                for subgroup in subgroups:
-                    if isinstance(object, dict):
-                        child_object = object.get(subgroup, None)
-                    else:
-                        child_object = getattr(object, subgroup, None)
-                    if child_object is not None:
-                        group.create_group(subgroup)
-                        temp = self._prepare_object_for_group(group[subgroup], child_object,
-                                                              h5_type_attribute, nr_regions)
-                        # If empty delete it
-                        if temp is None or (len(temp.keys()) == 0 and len(temp.attrs.keys()) == 0):
-                            del group[subgroup]
-
-                return group
-            else:
-                return group, subgroups
+                    self._write_dicts_at_location(datasets_dict, metadata_dict, group, policy)
+            return group, subgroups
 
     def write_object(self, object, h5_type_attribute="", nr_regions=None,
-                     path=None, h5_file=None, close_file=True):
+                     path=None, h5_file=None, close_file=True, **storage):
         """
                 :param object: object to write recursively in H5
                 :param path: H5 path to be written
+                :param storage: per call overrides of the datasets' storage policy (see storage_policy())
         """
+        policy = self.storage_policy(**storage)
         h5_file, path = self._open_file(object.__class__.__name__, path, h5_file)
-        h5_file = self._prepare_object_for_group(h5_file, object, h5_type_attribute, nr_regions)
+        h5_file = self._prepare_object_for_group(h5_file, object, h5_type_attribute, nr_regions, policy=policy)
         self._close_file(h5_file, close_file)
         self._log_success(object.__class__.__name__, path)
         return h5_file, path
 
-    def write_list_of_objects(self, list_of_objects, path=None, h5_file=None, close_file=True):
-        h5_file, path = self._open_file("List of objects", path, h5_file)
-        for idict, object in enumerate(list_of_objects):
-            idict_str = str(idict)
-            h5_file.create_group(idict_str)
-            self.write_object(object, h5_file=h5_file[idict_str], close_file=False)
-        h5_file.attrs.create(self.H5_TYPE_ATTRIBUTE, numpy.string_("List of objects"))
+    def _write_list_of_payloads(self, name, payloads, path=None, h5_file=None, n_shards=1):
+        # Write the payloads of a list's items, in order, to groups "0", "1", ... of the file.
+        # If n_shards > 1, the items are distributed round robin to n_shards files named <path>_shard<i>.h5,
+        # and the file of path holds external links to them, so that it can be read as if it contained them.
+        h5_file, path = self._open_file(name, path, h5_file)
+        h5_file.attrs.create(self.H5_TYPE_ATTRIBUTE, numpy.string_(name))
         h5_file.attrs.create(self.H5_SUBTYPE_ATTRIBUTE, numpy.string_("list"))
+        shards = []
+        if n_shards > 1:
+            root, ext = os.path.splitext(path or h5_file.filename)
+            for i_shard in range(n_shards):
+                shard_file, shard_path = self._open_file("%s shard %d" % (name, i_shard),
+                                                         "%s_shard%d%s" % (root, i_shard, ext or ".h5"))
+                shard_file.attrs.create(self.H5_TYPE_ATTRIBUTE, numpy.string_(name))
+                shard_file.attrs.create(self.H5_SUBTYPE_ATTRIBUTE, numpy.string_("list"))
+                shards.append((shard_file, shard_path))
+        try:
+            for i_item, payload in enumerate(payloads):
+                key = str(i_item)
+                if len(shards) > 0:
+                    shard_file, shard_path = shards[i_item % n_shards]
+                    self._write_payload(shard_file.create_group(key), payload)
+                    h5_file[key] = h5py.ExternalLink(os.path.basename(shard_path), "/" + key)
+                else:
+                    self._write_payload(h5_file.create_group(key), payload)
+        finally:
+            for shard_file, shard_path in shards:
+                self._close_file(shard_file)
+                self._log_success(name, shard_path)
+        return h5_file, path
+
+    def write_list_of_objects(self, list_of_objects, path=None, h5_file=None, close_file=True,
+                              n_workers=1, use_processes=False, n_shards=1, **storage):
+        """
+        :param list_of_objects: objects to write recursively in H5, each one to the group of its index
+        :param path: H5 path to be written
+        :param n_workers: if > 1, the objects are decomposed (including the storage policy's type conversions)
+                          in a pool of n_workers, while their writes remain serialized in this thread
+        :param use_processes: if True, the pool consists of processes, which requires picklable objects
+        :param n_shards: if > 1, the objects are distributed to as many files, linked to from the file of path
+        :param storage: per call overrides of the datasets' storage policy (see storage_policy())
+        """
+        payloads = map_in_order(partial(self._object_payload, policy=self.storage_policy(**storage)),
+                                list_of_objects, n_workers, use_processes)
+        h5_file, path = self._write_list_of_payloads("List of objects", payloads, path, h5_file, n_shards)
         self._close_file(h5_file, close_file)
         self._log_success("List of objects", path)
         return h5_file, path
 
-    def _write_dictionary_to_group(self, dictionary, group):
-        group.attrs.create(self.H5_TYPE_ATTRIBUTE, "Dictionary")
-        group.attrs.create(self.H5_SUBTYPE_ATTRIBUTE, dictionary.__class__.__name__)
-        for key, value in dictionary.items():
-            try:
-                if isinstance(value, numpy.ndarray) and value.size > 0:
-                    group.create_dataset(key, data=value)
-                else:
-                    if isinstance(value, list) and len(value) > 0:
-                        group.create_dataset(key, data=numpy.array(value))
-                    elif callable(value):
-                        group.attrs.create(key, inspect.getsource(value))
-                    elif isinstance(value, dict):
-                        group.create_group(key)
-                        self._write_dictionary_to_group(value, group[key])
-                    elif value is None:
-                        continue
-                    else:
-                        group.attrs.create(key, str(value))
-            except:
-                self.logger.warning("Did not manage to write " + key + " to h5 file " + str(group) + " !")
+    def _write_dictionary_to_group(self, dictionary, group, policy=None):
+        return self._write_payload(group, self._dictionary_payload(dictionary, policy))
 
-    def write_dictionary(self, dictionary, path=None, h5_file=None, close_file=True):
+    def write_dictionary(self, dictionary, path=None, h5_file=None, close_file=True, **storage):
         """
         :param dictionary: dictionary/ies to write recursively in H5
         :param path: H5 path to be written
+        :param storage: per call overrides of the datasets' storage policy (see storage_policy())
         Use this function only if you have to write dictionaries of data (scalars and arrays or lists of scalars,
         or of more such dictionaries recursively
         """
         h5_file, path = self._open_file("Dictionary", path, h5_file)
-        self._write_dictionary_to_group(dictionary, h5_file)
+        self._write_dictionary_to_group(dictionary, h5_file, self.storage_policy(**storage))
         h5_file.attrs.create(self.H5_TYPE_ATTRIBUTE, numpy.string_("Dictionary"))
         h5_file.attrs.create(self.H5_SUBTYPE_ATTRIBUTE, numpy.string_(dictionary.__class__.__name__))
         self._close_file(h5_file, close_file)
         self._log_success("Dictionary", path)
         return h5_file, path
 
-    def write_list_of_dictionaries(self, list_of_dicts, path=None, h5_file=None, close_file=True):
-        h5_file, path = self._open_file("List of dictionaries", path, h5_file)
-        for idict, dictionary in enumerate(list_of_dicts):
-            idict_str = str(idict)
-            h5_file.create_group(idict_str)
-            self._write_dictionary_to_group(dictionary, h5_file[idict_str])
-        h5_file.attrs.create(self.H5_TYPE_ATTRIBUTE, numpy.string_("List of dictionaries"))
-        h5_file.attrs.create(self.H5_SUBTYPE_ATTRIBUTE, numpy.string_("list"))
+    def write_list_of_dictionaries(self, list_of_dicts, path=None, h5_file=None, close_file=True,
+                                   n_workers=1, use_processes=False, n_shards=1, **storage):
+        """
+        :param list_of_dicts: dictionaries to write recursively in H5, each one to the group of its index
+        :param path: H5 path to be written
+        :param n_workers: if > 1, the dictionaries are decomposed (including the serialization of callables)
+                          in a pool of n_workers, while their writes remain serialized in this thread
+        :param use_processes: if True, the pool consists of processes, which requires picklable dictionaries
+        :param n_shards: if > 1, the dictionaries are distributed to as many files, linked to from the file of path
+        :param storage: per call overrides of the datasets' storage policy (see storage_policy())
+        """
+        payloads = map_in_order(partial(self._dictionary_payload, policy=self.storage_policy(**storage)),
+                                list_of_dicts, n_workers, use_processes)
+        h5_file, path = self._write_list_of_payloads("List of dictionaries", payloads, path, h5_file, n_shards)
         self._close_file(h5_file, close_file)
         self._log_success("List of dictionaries", path)
         return h5_file, path
 
-    def write_tvb_to_h5(self, datatype, path=None, recursive=True, force_overwrite=True):
+    def open_time_series_stream(self, path, shape_without_time, dtype=numpy.float64, labels_ordering=None,
+                                labels_dimensions=None, start_time=0.0, sample_period=1.0, sample_period_unit="ms",
+                                title="", time_series_type="TimeSeries", data_name="data",
+                                flush_samples=CONFIGURED.h5.STREAM_FLUSH_SAMPLES,
+                                flush_seconds=CONFIGURED.h5.STREAM_FLUSH_SECONDS, swmr=False, **storage):
+        """
+        Create a TimeSeries H5 file with empty data and time datasets, resizable along time,
+        to be filled block by block via the append method of the returned H5TimeSeriesStream.
+        :param path: H5 path to be written
+        :param shape_without_time: the shape of the data without the time dimension, e.g., (variables, space, modes)
+        :param dtype: the dtype of the data
+        :param labels_ordering: the names of the dimensions, starting with time
+        :param labels_dimensions: dict of the labels of the dimensions other than time
+        :param start_time, sample_period, sample_period_unit: the time axis' specification
+        :param time_series_type: the TimeSeries class name, written as the file's subtype
+        :param flush_samples: flush to disk after so many appended time points (None to disable)
+        :param flush_seconds: flush to disk after so many seconds since the last flush (None to disable)
+        :param swmr: if True, enable single writer multiple readers mode, so that the file can be read while written
+        :param storage: per call overrides of the datasets' storage policy (see storage_policy())
+        :return: the H5TimeSeriesStream
+        """
+        policy = self.storage_policy(**storage)
+        shape_without_time = tuple(int(s) for s in numpy.atleast_1d(shape_without_time))
+        dtype = numpy.dtype(dtype)
+        if policy["float32"] and dtype == numpy.float64:
+            dtype = numpy.dtype(numpy.float32)
+        # Resizable datasets have to be chunked:
+        chunks = policy["chunks"]
+        if isinstance(chunks, dict):
+            chunks = chunks.get(data_name, "auto")
+        if not isinstance(chunks, tuple) or len(chunks) != len(shape_without_time) + 1:
+            n_time_chunk = max(1, int(self.config.h5.CHUNK_BYTES // dtype.itemsize))
+            chunks = compute_time_major_chunks((n_time_chunk,) + shape_without_time, dtype,
+                                               self.config.h5.CHUNK_BYTES)
+        kwargs = {}
+        if policy["compression"] is not None:
+            kwargs["compression"] = policy["compression"]
+            if policy["compression"] == "gzip":
+                kwargs["compression_opts"] = policy["compression_opts"]
+            kwargs["shuffle"] = bool(policy["shuffle"])
+        path = change_filename_or_overwrite(path, self.force_overwrite)
+        self.logger.info("Starting to stream %s to: %s" % (time_series_type, path))
+        h5_file = self.file_pool.acquire(path, "w")
+        h5_file.create_dataset(data_name, shape=(0,) + shape_without_time, maxshape=(None,) + shape_without_time,
+                               dtype=dtype, chunks=chunks, **kwargs)
+        h5_file.create_dataset("time", shape=(0,), maxshape=(None,), dtype=numpy.float64,
+                               chunks=(max(1024, chunks[0]),))
+        h5_file.attrs.create(self.H5_TYPE_ATTRIBUTE, numpy.string_("TimeSeries"))
+        h5_file.attrs.create(self.H5_SUBTYPE_ATTRIBUTE, numpy.string_(time_series_type))
+        h5_file.attrs["start_time"] = float(start_time)
+        h5_file.attrs["sample_period"] = float(sample_period)
+        h5_file.attrs["sample_period_unit"] = numpy.string_(sample_period_unit)
+        h5_file.attrs["title"] = numpy.string_(title)
+        h5_file.attrs["length_1d"] = 0
+        if labels_ordering is not None:
+            h5_file.attrs["labels_ordering"] = numpy.array(labels_ordering, dtype="S")
+        if labels_dimensions:
+            group = h5_file.create_group("labels_dimensions")
+            for key, labels in labels_dimensions.items():
+                group.create_dataset(key, data=numpy.array(labels, dtype="S"))
+        if swmr:
+            h5_file.swmr_mode = True
+        return H5TimeSeriesStream(h5_file, data_name, flush_samples, flush_seconds, self.logger, self.file_pool,
+                                  self.catalog)
+
+    def write_tvb_to_h5(self, datatype, path=None, recursive=True, force_overwrite=True, **storage):
+        """
+        Write a TVB datatype via TVB's h5.store, and then apply the storage policy, and deduplication, if any,
+        to the datasets of the stored file.
+        :param storage: per call overrides of the datasets' storage policy (see storage_policy())
+        """
+        policy = self.storage_policy(**storage)
         if path is None:
             path = self.config.out.FOLDER_RES
         if path.endswith("h5"):
@@ -231,6 +718,8 @@ class H5Writer(object):
             else:
                 os.mkdir(dirpath)
             h5.store(datatype, path, recursive)
+            self._rewrite_stored_file(path, policy)
+            self._index_file(path)
         else:
             if not os.path.isdir(path):
                 os.mkdir(path)
@@ -244,4 +733,6 @@ class H5Writer(object):
                 path = os.path.join(path, datatype.title + ".h5")
             path = change_filename_or_overwrite(path, self.force_overwrite)
             h5.store(datatype, path, recursive)
+            self._rewrite_stored_file(path, policy)
+            self._index_file(path)
         return path
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import os
+import h5py
+import numpy as np
+
+from tvb_scripts.config import CalculusConfig
+from tvb_scripts.utils.log_error_utils import initialize_logger, raise_value_error
+from tvb_scripts.utils.file_utils import change_filename_or_overwrite
+from tvb_scripts.utils.time_series_utils import SignalsStatistics
+
+
+class TimeSeriesH5Service(object):
+    """
+    Out-of-core counterpart of TimeSeriesService for TimeSeries with data stored in H5 files,
+    as written by H5Writer or by TVB's h5.store.
+    The source data are streamed in slabs along time (axis 0) or along another dimension (e.g., space, axis 2),
+    and every result slab is written straight to the target dataset.
+    Therefore, peak memory is bounded by the slab size and not by the size of the TimeSeries.
+    """
+    logger = initialize_logger(__name__)
+
+    data_name = "data"
+    max_slab_bytes = CalculusConfig.MAX_SLAB_BYTES
+
+    def __init__(self, axis=0, slab_size=None, data_name="data", logger=None):
+        """
+        :param axis: the dimension along which data are sliced into slabs (0 for time, 2 for space, etc)
+        :param slab_size: the number of indices of axis per slab.
+                          If None, it is computed to fit the memory budget of CalculusConfig.MAX_SLAB_BYTES
+        :param data_name: the name of the H5 dataset of the TimeSeries' data
+        """
+        self.axis = axis
+        self.slab_size = slab_size
+        self.data_name = data_name
+        if logger is not None:
+            self.logger = logger
+
+    def _open_source(self, source):
+        # Return the source dataset, and the file, if it is opened here, in order to close it after use
+        if isinstance(source, h5py.Dataset):
+            return source, None
+        if isinstance(source, h5py.Group):
+            return source[self.data_name], None
+        if not os.path.isfile(source):
+            raise_value_error("Source file %s does not exist!" % str(source), self.logger)
+        h5_file = h5py.File(source, 'r', libver='latest')
+        return h5_file[self.data_name], h5_file
+
+    def _copy_metadata(self, source_dataset, target_group):
+        # Copy root attributes and all datasets (e.g., time) other than data, so that the target is a valid TimeSeries
+        source_group = source_dataset.parent
+        for key, value in source_group.attrs.items():
+            target_group.attrs[key] = value
+        for key in source_group.keys():
+            if key != self.data_name and key not in target_group:
+                source_group.copy(key, target_group)
+
+    def _open_target(self, target, source_dataset, shape, dtype, copy_metadata=True):
+        if isinstance(target, h5py.Group):
+            h5_file = None
+            target_group = target
+        else:
+            if os.path.abspath(target) == os.path.abspath(source_dataset.file.filename):
+                raise_value_error("Target file %s cannot be the same as the source one!" % target, self.logger)
+            target = change_filename_or_overwrite(target, True)
+            self.logger.info("Starting to write out-of-core results to: %s" % target)
+            h5_file = h5py.File(target, 'w', libver='latest')
+            target_group = h5_file
+        if copy_metadata:
+            self._copy_metadata(source_dataset, target_group)
+        if self.data_name in target_group:
+            del target_group[self.data_name]
+        target_dataset = target_group.create_dataset(self.data_name, shape=shape, dtype=dtype)
+        return target_dataset, h5_file
+
+    def compute_slab_size(self, shape, dtype, axis=None):
+        if axis is None:
+            axis = self.axis
+        if self.slab_size is not None:
+            return int(max(1, self.slab_size))
+        bytes_per_index = np.dtype(dtype).itemsize * np.prod(shape) / max(shape[axis], 1)
+        return int(max(1, self.max_slab_bytes // max(bytes_per_index, 1)))
+
+    def slabs(self, shape, dtype, axis=None):
+        """
+        Generate the slices' tuples of the successive slabs of an array of the given shape and dtype.
+        """
+        if axis is None:
+            axis = self.axis
+        slab_size = self.compute_slab_size(shape, dtype, axis)
+        for start in range(0, shape[axis], slab_size):
+            slices = [slice(None)] * len(shape)
+            slices[axis] = slice(start, min(start + slab_size, shape[axis]))
+            yield tuple(slices)
+
+    def apply(self, source, target, fun, axis=None, shape=None, dtype=None, copy_metadata=True, pass_slices=False):
+        """
+        Apply fun to the data of the source TimeSeries slab by slab, and write the results to the target.
+        :param source: an H5 file path, an h5py File/Group containing the data dataset, or the data h5py Dataset
+        :param target: an H5 file path, or an h5py File/Group, where the result data dataset will be written
+        :param fun: a function mapping a data slab to the respective output slab.
+                    It is allowed to change the size only of the dimensions other than axis,
+                    in which case the output shape has to be provided.
+        :param axis: the dimension along which the data are sliced
+        :param shape: the shape of the output dataset, if different than the source one
+        :param dtype: the dtype of the output dataset, default: float64 for integer sources, the source's dtype otherwise
+        :param copy_metadata: if True, copy all attributes and datasets other than data to the target
+        :param pass_slices: if True, fun is called as fun(slab, slices), where slices is the slab's tuple of slices
+        :return: the path of the target file
+        """
+        if axis is None:
+            axis = self.axis
+        source_dataset, source_file = self._open_source(source)
+        try:
+            if shape is None:
+                shape = source_dataset.shape
+            if dtype is None:
+                dtype = source_dataset.dtype
+                if dtype.kind in "biu":
+                    dtype = np.float64
+            target_dataset, target_file = \
+                self._open_target(target, source_dataset, shape, dtype, copy_metadata)
+            try:
+                # The slab size is determined by the largest one of the input and output slabs
+                if np.prod(shape) * np.dtype(dtype).itemsize > source_dataset.size * source_dataset.dtype.itemsize:
+                    slabs_shape, slabs_dtype = shape, dtype
+                else:
+                    slabs_shape, slabs_dtype = source_dataset.shape, source_dataset.dtype
+                for slices in self.slabs(slabs_shape, slabs_dtype, axis):
+                    if pass_slices:
+                        target_dataset[slices] = fun(source_dataset[slices], slices)
+                    else:
+                        target_dataset[slices] = fun(source_dataset[slices])
+                target_path = target_dataset.file.filename
+            finally:
+                if target_file is not None:
+                    target_file.close()
+        finally:
+            if source_file is not None:
+                source_file.close()
+        self.logger.info("Out-of-core results have been written to file: %s" % target_path)
+        return target_path
+
+    def log(self, source, target, **kwargs):
+        return self.apply(source, target, np.log, **kwargs)
+
+    def exp(self, source, target, **kwargs):
+        return self.apply(source, target, np.exp, **kwargs)
+
+    def abs(self, source, target, **kwargs):
+        return self.apply(source, target, np.abs, **kwargs)
+
+    def square(self, source, target, **kwargs):
+        return self.apply(source, target, np.square, **kwargs)
+
+    def compute_statistics(self, source, statistics=None):
+        """
+        Gather mean, std, min, max and (approximate) percentiles of the source data along time,
+        in a single pass over time slabs, e.g., to be used for normalize(source, target, stats.mean, stats.std).
+        """
+        if statistics is None:
+            statistics = SignalsStatistics()
+        source_dataset, source_file = self._open_source(source)
+        try:
+            for slices in self.slabs(source_dataset.shape, np.float64, axis=0):
+                statistics.update(source_dataset[slices])
+        finally:
+            if source_file is not None:
+                source_file.close()
+        return statistics
+
+    def normalize(self, source, target, offset=0.0, scale=1.0, **kwargs):
+        """
+        Compute (data - offset) / scale with precomputed statistics (e.g., offset=mean, scale=std for zscore).
+        offset and scale should be scalars, or arrays broadcastable to the shape of the data without the time axis,
+        e.g., of shape (variables, space, modes).
+        """
+        offset = np.array(offset, dtype="f8")
+        scale = 1.0 / np.array(scale, dtype="f8")
+        source_dataset, source_file = self._open_source(source)
+        slab_shape = source_dataset.shape[1:]
+        if source_file is not None:
+            source_file.close()
+
+        def normalize_slab(slab, slices):
+            # Select the statistics of the slab, unless the slab is along time:
+            stats_slices = slices[1:]
+            return (slab - np.broadcast_to(offset, slab_shape)[stats_slices]) * \
+                np.broadcast_to(scale, slab_shape)[stats_slices]
+
+        return self.apply(source, target, normalize_slab, pass_slices=True, **kwargs)
+
+    def project(self, source, target, projection_data, sum_mode="lin", **kwargs):
+        """
+        Project the source data of shape (time, variables, sources, modes)
+        to sensor space via projection_data of shape (sensors, sources),
+        streaming along time, as in TimeSeriesService.compute_seeg.
+        """
+        if kwargs.pop("axis", 0) != 0:
+            raise_value_error("Projection requires slabs along time (axis=0)!", self.logger)
+        projection_data = np.array(projection_data)
+
+        def project_slab(slab):
+            if sum_mode == "exp":
+                slab = np.exp(slab)
+            slab = np.moveaxis(np.tensordot(slab, projection_data, axes=([2], [1])), -1, 2)
+            if sum_mode == "exp":
+                slab = np.log(slab)
+            return slab
+
+        source_dataset, source_file = self._open_source(source)
+        try:
+            shape = list(source_dataset.shape)
+            if shape[2] != projection_data.shape[1]:
+                raise_value_error("Projection matrix of shape %s does not match the %d sources of the data!"
+                                  % (str(projection_data.shape), shape[2]), self.logger)
+            shape[2] = projection_data.shape[0]
+            return self.apply(source_dataset, target, project_slab, axis=0, shape=tuple(shape), **kwargs)
+        finally:
+            if source_file is not None:
+                source_file.close()
@@ -4,22 +4,36 @@ from six import string_types
 from collections import OrderedDict
 
 import numpy as np
-from scipy.signal import convolve, detrend, hilbert
+from scipy.signal import convolve, detrend
 
-from tvb_scripts.utils.log_error_utils import raise_value_error, initialize_logger
+from tvb_scripts.utils.log_error_utils import raise_value_error, initialize_logger, warning
 from tvb_scripts.utils.data_structures_utils import ensure_list
+from tvb_scripts.utils.computations_utils import compute_spikes_counts, spikes_rate_convolution
 # from tvb_scripts.utils.computations_utils import select_greater_values_array_inds, \
 #     select_by_hierarchical_group_metric_clustering
 from tvb_scripts.utils.time_series_utils import abs_envelope, spectrogram_envelope, filter_data, \
-    decimate_signals, normalize_signals
-from tvb_scripts.datatypes.time_series import TimeSeriesSEEG, LABELS_ORDERING
+    decimate_signals, normalize_signals, prepare_output_array, hilbert_analysis, HILBERT_OUTPUTS, apply_linear_operator
+from tvb_scripts.datatypes.time_series import TimeSeries, TimeSeriesRegion, TimeSeriesSEEG, LABELS_ORDERING, \
+    TimeSeriesDimensions
 
 
 class TimeSeriesService(object):
-    logger = get_logger(__name__)
-
-    def __init__(self, logger=get_logger(__name__)):
-        self.logger = logger
+    logger = initialize_logger(__name__)
+
+    def __init__(self, logger=None):
+        if logger is not None:
+            self.logger = logger
+
+    def _return_time_series(self, time_series, data, inplace=False, **kwargs):
+        # Methods called with inplace=True write their results to time_series.data and return time_series itself.
+        # Otherwise, they return a duplicate of time_series with the new data.
+        if inplace:
+            for attr, value in kwargs.items():
+                setattr(time_series, attr, value)
+            time_series.data = data
+            time_series.configure()
+            return time_series
+        return time_series.duplicate(data=data, **kwargs)
 
     def decimate(self, time_series, decim_ratio, **kwargs):
         if decim_ratio > 1:
@@ -44,43 +58,77 @@ class TimeSeriesService(object):
             kernel = kernel * np.ones((n_kernel_points, 1, 1, 1))
         return time_series.duplicate(data=convolve(time_series.data, kernel, mode='same'), **kwargs)
 
+    def hilbert(self, time_series, outputs=HILBERT_OUTPUTS, fast_length=True,
+                single_precision=False, channels_block=None, n_threads=1, time_block=None, time_overlap=None,
+                **kwargs):
+        """
+        Compute any of the envelope, phase and instantaneous frequency (in Hz) of the TimeSeries' signals
+        from a single pass of the Hilbert transform.
+        See time_series_utils.hilbert_analysis for the computation's parameters.
+        :return: a dictionary of TimeSeries for each one of the outputs
+        """
+        results = hilbert_analysis(time_series.data, time_series.sample_rate, outputs, fast_length,
+                                   single_precision, channels_block, n_threads, time_block, time_overlap)
+        for output, data in results.items():
+            results[output] = time_series.duplicate(data=data, **kwargs)
+        return results
+
     def hilbert_envelope(self, time_series, **kwargs):
-        return time_series.duplicate(data=np.abs(hilbert(time_series.data, axis=0)), **kwargs)
+        return self.hilbert(time_series, "envelope", **kwargs)["envelope"]
+
+    def hilbert_phase(self, time_series, **kwargs):
+        return self.hilbert(time_series, "phase", **kwargs)["phase"]
 
-    def spectrogram_envelope(self, time_series, lpf=None, hpf=None, nperseg=None, **kwargs):
-        data, time = spectrogram_envelope(time_series.squeezed, time_series.sample_rate, lpf, hpf, nperseg)
+    def hilbert_frequency(self, time_series, **kwargs):
+        return self.hilbert(time_series, "frequency", **kwargs)["frequency"]
+
+    def spectrogram_envelope(self, time_series, lpf=None, hpf=None, nperseg=None, time_block=None, **kwargs):
+        data, time = spectrogram_envelope(time_series.data, time_series.sample_rate, lpf, hpf, nperseg, time_block)
         if len(time_series.sample_period_unit) > 0 and time_series.sample_period_unit[0] == "m":
             time *= 1000
-        return time_series.duplicate(data=data, start_time=time_series.start_time + time[0],
+        time += time_series.start_time
+        return time_series.duplicate(data=data, time=time, start_time=time[0],
                                      sample_period=np.diff(time).mean(), **kwargs)
 
-    def abs_envelope(self, time_series, **kwargs):
-        return time_series.duplicate(data=abs_envelope(time_series.data), **kwargs)
+    def abs_envelope(self, time_series, inplace=False, **kwargs):
+        return self._return_time_series(time_series, abs_envelope(time_series.data, inplace=inplace),
+                                        inplace, **kwargs)
+
+    def detrend(self, time_series, type='linear', inplace=False, **kwargs):
+        data = prepare_output_array(time_series.data, inplace=inplace)
+        return self._return_time_series(time_series, detrend(data, axis=0, type=type, overwrite_data=True),
+                                        inplace, **kwargs)
 
-    def detrend(self, time_series, type='linear', **kwargs):
-        return time_series.duplicate(data=detrend(time_series.data, axis=0, type=type), **kwargs)
+    def normalize(self, time_series, normalization=None, axis=None, percent=None, inplace=False, **kwargs):
+        return self._return_time_series(time_series,
+                                        normalize_signals(time_series.data, normalization, axis, percent,
+                                                          inplace=inplace),
+                                        inplace, **kwargs)
 
-    def normalize(self, time_series, normalization=None, axis=None, percent=None, **kwargs):
-        return time_series.duplicate(data=normalize_signals(time_series.data, normalization, axis, percent), **kwargs)
+    def filter(self, time_series, lowcut=None, highcut=None, mode='bandpass', order=3, inplace=False, **kwargs):
+        return self._return_time_series(time_series,
+                                        filter_data(time_series.data, time_series.sample_rate,
+                                                    lowcut, highcut, mode, order, inplace=inplace),
+                                        inplace, **kwargs)
 
-    def filter(self, time_series, lowcut=None, highcut=None, mode='bandpass', order=3, **kwargs):
-        return time_series.duplicate(data=filter_data(time_series.data, time_series.sample_rate,
-                                                     lowcut, highcut, mode, order), **kwargs)
+    def _pointwise(self, time_series, fun, inplace=False, **kwargs):
+        data = prepare_output_array(time_series.data, inplace=inplace)
+        return self._return_time_series(time_series, fun(data, out=data), inplace, **kwargs)
 
-    def log(self, time_series, **kwargs):
-        return time_series.duplicate(data=np.log(time_series.data), **kwargs)
+    def log(self, time_series, inplace=False, **kwargs):
+        return self._pointwise(time_series, np.log, inplace, **kwargs)
 
-    def exp(self, time_series, **kwargs):
-        return time_series.duplicate(data=np.exp(time_series.data), **kwargs)
+    def exp(self, time_series, inplace=False, **kwargs):
+        return self._pointwise(time_series, np.exp, inplace, **kwargs)
 
-    def abs(self, time_series, **kwargs):
-        return time_series.duplicate(data=np.abs(time_series.data), **kwargs)
+    def abs(self, time_series, inplace=False, **kwargs):
+        return self._pointwise(time_series, np.abs, inplace, **kwargs)
 
     def power(self, time_series):
         return np.sum(self.square(self.normalize(time_series, "mean", axis=0)).squeezed, axis=0)
 
-    def square(self, time_series, **kwargs):
-        return time_series.duplicate(data=time_series.data ** 2, **kwargs)
+    def square(self, time_series, inplace=False, **kwargs):
+        return self._pointwise(time_series, np.square, inplace, **kwargs)
 
     def correlation(self, time_series):
         return np.corrcoef(time_series.squeezed.T)
@@ -159,7 +207,7 @@ class TimeSeriesService(object):
                             else:
                                 del labels_dimensions[dim_label]
                                 warning("Dimension labels for dimensions %s cannot be concatenated! "
-                                        "Deleting them!" % dim_label)
+                                        "Deleting them!" % dim_label, self.logger)
                         try:
                             out_data = np.concatenate([out_time_series.data, time_series.data], axis=dim)
                         except:
@@ -237,6 +285,46 @@ class TimeSeriesService(object):
     #             rois[ir] = all_labels[roi]
     #     return time_series.get_subspace_by_label(rois), rois
 
+    def compute_spikes_rates(self, spikes_times, neurons_inds, time, spikes_kernel, n_neurons=None, labels=None,
+                             **kwargs):
+        """
+        Compute the rates of all neurons at once, by binning their spikes' events to the time points
+        and convolving the resulting (time x neurons) counts with spikes_kernel.
+        :param spikes_times: the times of the spikes
+        :param neurons_inds: the integer indices of the neurons that spiked, for each spike
+        :param time: the time vector of the rates, in ascending order
+        :param spikes_kernel: the convolution kernel, including any normalization, e.g., by the time step
+        :param labels: the labels of the neurons
+        :return: a TimeSeries of shape (time, 1, neurons, 1)
+        """
+        rates = spikes_rate_convolution(compute_spikes_counts(spikes_times, time, neurons_inds, n_neurons),
+                                        spikes_kernel)
+        if labels is not None:
+            labels_dimensions = kwargs.get("labels_dimensions", {})
+            labels_dimensions[kwargs.get("labels_ordering", LABELS_ORDERING)[2]] = list(labels)
+            kwargs["labels_dimensions"] = labels_dimensions
+        return TimeSeries(rates[:, np.newaxis, :, np.newaxis], time=np.array(time), **kwargs)
+
+    def surface_to_region(self, time_series, region_mapping, area_weighted=False, time_block=None, **kwargs):
+        """
+        Average the vertices' signals of a surface TimeSeries to their regions,
+        via the cached sparse averaging operator of the region mapping (see RegionMapping),
+        with one sparse product per block of time_block time points, if given.
+        :return: a TimeSeriesRegion
+        """
+        operator = region_mapping.get_region_averaging_operator(area_weighted)
+        data = apply_linear_operator(operator, time_series.data, 2, time_block)
+        labels_ordering = list(time_series.labels_ordering)
+        labels_ordering[2] = TimeSeriesDimensions.REGIONS.value
+        labels_dimensions = dict(time_series.labels_dimensions)
+        labels_dimensions.pop(time_series.labels_ordering[2], None)
+        labels_dimensions[labels_ordering[2]] = list(region_mapping.connectivity.region_labels)
+        kwargs.update({"labels_ordering": labels_ordering, "labels_dimensions": labels_dimensions,
+                       "connectivity": region_mapping.connectivity, "region_mapping": region_mapping,
+                       "start_time": time_series.start_time, "sample_period": time_series.sample_period,
+                       "sample_period_unit": time_series.sample_period_unit})
+        return TimeSeriesRegion(data, **kwargs)
+
     def compute_seeg(self, source_time_series, sensors, projection=None, sum_mode="lin", **kwargs):
         if np.all(sum_mode == "exp"):
             seeg_fun = lambda source, projection_data: self.compute_seeg_exp(source.squeezed, projection_data)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy
+import pytest
+from tvb_scripts.utils.computations_utils import compute_gain_matrix, compute_spikes_counts, \
+    spikes_events_to_time_index, spikes_rate_convolution
+from tvb_scripts.tests.base import BaseTest
+
+
+class TestComputationsUtils(BaseTest):
+
+    def test_compute_gain_matrix(self):
+        sensors = numpy.random.normal(0.0, 10.0, (20, 3))
+        sources = numpy.random.normal(0.0, 10.0, (300, 3))
+        gain = 1.0 / numpy.sum((sensors[:, numpy.newaxis] - sources[numpy.newaxis]) ** 2, axis=-1)
+        assert numpy.allclose(compute_gain_matrix(sensors, sources, block_size=7, n_threads=2),
+                              gain / gain.max())
+        assert numpy.allclose(compute_gain_matrix(sensors, sources, normalize=95, ceil=True),
+                              numpy.minimum(gain / numpy.percentile(gain, 95), 1.0))
+        path = os.path.join(self.config.out.FOLDER_TEMP, "gain.dat")
+        gain32 = compute_gain_matrix(sensors, sources, normalize=False, dtype=numpy.float32, out=path)
+        assert gain32.dtype == numpy.float32
+        assert numpy.allclose(gain32, gain, rtol=1e-5)
+
+    def test_spikes_counts_and_rates(self):
+        time = numpy.arange(0.0, 10.0, 0.1)
+        spikes_times = numpy.random.uniform(-1.0, 11.0, 1000)
+        neurons_inds = numpy.random.randint(0, 5, 1000)
+        counts = numpy.zeros((time.size, 5))
+        for spike_time, neuron_ind in zip(spikes_times, neurons_inds):
+            ind = spikes_events_to_time_index(spike_time, time)
+            if ind is not None:
+                counts[ind, neuron_ind] += 1
+        assert numpy.all(compute_spikes_counts(spikes_times, time, neurons_inds, 5) == counts)
+        assert numpy.all(compute_spikes_counts(spikes_times, time) == counts.sum(axis=1))
+        with pytest.raises(ValueError):
+            compute_spikes_counts(spikes_times, time, neurons_inds, 4)
+        kernel = numpy.ones((7,)) / 7
+        rates = spikes_rate_convolution(counts, kernel)
+        assert numpy.all(rates >= 0.0)
+        for neuron_ind in range(5):
+            assert numpy.allclose(rates[:, neuron_ind], numpy.convolve(counts[:, neuron_ind], kernel, mode="same"))
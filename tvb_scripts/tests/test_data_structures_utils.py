@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import numpy
+import pytest
+from tvb_scripts.utils.data_structures_utils import data_xarray_from_continuous_events, ContinuousEventsAccumulator, \
+    sort_events_by_x_and_y, LabelsIndex, find_labels_inds, labels_to_inds, extract_dict_stringkeys
+from tvb_scripts.tests.base import BaseTest
+
+
+class TestDataStructuresUtils(BaseTest):
+
+    def _prepare_continuous_events(self, n_times=20, n_senders=4):
+        times = numpy.repeat(numpy.arange(1.0, n_times + 1.0), n_senders)
+        senders = numpy.tile(numpy.arange(1, n_senders + 1), n_times)
+        events = {"V_m": numpy.random.normal(size=times.shape), "g": numpy.random.normal(size=times.shape),
+                  "times": times, "senders": senders}
+        return events, times, senders
+
+    def test_data_xarray_from_continuous_events(self):
+        events, times, senders = self._prepare_continuous_events()
+        data = data_xarray_from_continuous_events(events, times, senders, exclude_senders=[2])
+        assert data.shape == (2, 3, 20)
+        assert list(data.coords["Variable"].values) == ["V_m", "g"]
+        assert list(data.coords["Neuron"].values) == [1, 3, 4]
+        assert numpy.all(data.values[1, 1] == events["g"][senders == 3])
+        # Missing events are filled with NaNs:
+        data = data_xarray_from_continuous_events({"V_m": events["V_m"][1:]}, times[1:], senders[1:])
+        assert numpy.isnan(data.values[0, 0, 0])
+        assert numpy.all(data.values[0, 1:, 0] == events["V_m"][1:4])
+
+    def test_continuous_events_accumulator(self):
+        events, times, senders = self._prepare_continuous_events()
+        accumulator = ContinuousEventsAccumulator(["V_m", "g"], filter_senders=[1, 2], capacity=3)
+        for start in range(0, times.size, 7):
+            accumulator.append(dict([(key, value[start:start + 7]) for key, value in events.items()]))
+        assert accumulator.size == 40
+        assert accumulator.capacity >= 40
+        assert numpy.all(accumulator.to_data_xarray().values ==
+                         data_xarray_from_continuous_events(events, times, senders, ["V_m", "g"],
+                                                            filter_senders=[1, 2]).values)
+
+    def test_sort_events_by_x_and_y(self):
+        senders = numpy.random.randint(1, 6, 200)
+        times = numpy.random.uniform(0.0, 100.0, 200).round()
+        events = {"senders": senders, "times": times}
+        sorted_events = sort_events_by_x_and_y(events, filter_x=[1, 2, 3, 7], exclude_x=[2], exclude_y=[50.0])
+        assert list(sorted_events.keys()) == [1, 3, 7]
+        for sender in [1, 3]:
+            assert numpy.all(sorted_events[sender] ==
+                             numpy.sort(times[numpy.logical_and(senders == sender, times != 50.0)]))
+        assert sorted_events[7].size == 0
+        senders_labels, offsets, sorted_times = sort_events_by_x_and_y(events, filter_y=times[:50], output="csr")
+        for i_sender, sender in enumerate(senders_labels):
+            assert numpy.all(sorted_times[offsets[i_sender]:offsets[i_sender + 1]] ==
+                             numpy.sort(times[numpy.logical_and(senders == sender, numpy.isin(times, times[:50]))]))
+
+    def test_labels_index(self):
+        labels = ["Left-Hippocampus", "Right-Hippocampus", "Left-Amygdala", "left-hippocampus", "Amyg"]
+        labels_index = LabelsIndex(labels)
+        assert labels_index.equal("LEFT-HIPPOCAMPUS") == [0, 3]
+        assert labels_index.equal("Left-Hippocampus", case_sensitive=True) == [0]
+        assert labels_index.find("Hippo") == [0, 1]
+        assert labels_index.find("ft") == [0, 2, 3]
+        assert labels_index.find("Left-Amygdala-Anterior", two_way_search=True) == [2, 4]
+        assert labels_index.match_all(["Amyg", "Right"]) == [[2, 4], [1]]
+        assert find_labels_inds(labels, ["Amyg", "Hippo"]) == [2, 4, 0, 1]
+        assert find_labels_inds(labels, ["Amyg", "Hippo"], break_after=3) == [2, 4, 0]
+        # One-off scans of labels match as their LabelsIndex does:
+        for keys, modefun, two_way_search in [(["LEFT-HIPPOCAMPUS", "Amyg"], "equal", False),
+                                              (["ft", "", "Hippo"], "find", False),
+                                              (["Left-Amygdala-Anterior"], "find", True)]:
+            assert find_labels_inds(labels, keys, modefun, two_way_search) == \
+                find_labels_inds(labels_index, keys, modefun, two_way_search)
+        assert labels_to_inds(labels_index, ["Amyg", "Left-Amygdala"]) == [4, 2]
+        assert labels_to_inds(labels, "Right-Hippocampus") == 1
+        assert extract_dict_stringkeys(dict(zip(labels, range(5))), "Amyg", remove=True) == \
+            {"Left-Hippocampus": 0, "Right-Hippocampus": 1, "left-hippocampus": 3}
+        with pytest.raises(ValueError):
+            labels_to_inds(labels, "Thalamus")
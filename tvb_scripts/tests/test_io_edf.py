@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy
+import pytest
+from tvb_scripts.io.edf import EDFNumpyEngine, edf_units_scales, read_edf, read_edf_to_Timeseries
+from tvb_scripts.datatypes.sensors import SensorsSEEG
+from tvb_scripts.tests.base import BaseTest
+
+
+class MixedRatesEDFEngine(EDFNumpyEngine):
+
+    def __init__(self, path):
+        super(MixedRatesEDFEngine, self).__init__(path)
+        self.sample_frequencies = self.sample_frequencies.copy()
+        self.sample_frequencies[0] *= 2
+
+
+class TestEDF(BaseTest):
+    labels = ["ch1", "ch2", "ch3", "ch4"]
+    samples_per_record = 10
+    n_records = 5
+    record_duration = 0.1
+
+    def _write_dummy_edf_file(self):
+        # A minimal EDF file of 16-bit signals, with physical values in uV equal to the digital ones divided by 10,
+        # returned in Volts:
+        n_signals = len(self.labels)
+        n_samples = self.samples_per_record * self.n_records
+        digital = numpy.arange(n_samples * n_signals, dtype="i2").reshape((n_signals, n_samples))
+        path = os.path.join(self.config.out.FOLDER_TEMP, "test.edf")
+
+        def fields(value, width):
+            return "".join([str(value).ljust(width)] * n_signals)
+
+        header = "0".ljust(8) + "".ljust(80) + "".ljust(80) + "01.01.20" + "00.00.00" + \
+                 str(256 * (n_signals + 1)).ljust(8) + "".ljust(44) + str(self.n_records).ljust(8) + \
+                 str(self.record_duration).ljust(8) + str(n_signals).ljust(4)
+        header += "".join([label.ljust(16) for label in self.labels]) + fields("", 80) + fields("uV", 8) + \
+                  fields(-3276.8, 8) + fields(3276.7, 8) + fields(-32768, 8) + fields(32767, 8) + \
+                  fields("", 80) + fields(self.samples_per_record, 8) + fields("", 32)
+        records = digital.reshape((n_signals, self.n_records, self.samples_per_record)).transpose((1, 0, 2))
+        with open(path, "wb") as edf_file:
+            edf_file.write(header.encode("latin-1"))
+            edf_file.write(records.astype("<i2").tobytes())
+        return 1e-6 * digital.T / 10.0, path
+
+    def test_read_header(self):
+        _, path = self._write_dummy_edf_file()
+        with EDFNumpyEngine(path) as engine:
+            assert engine.channel_names == self.labels
+            assert numpy.allclose(engine.sample_frequencies, self.samples_per_record / self.record_duration)
+            assert numpy.all(engine.n_samples == self.samples_per_record * self.n_records)
+        assert numpy.allclose(edf_units_scales(["uV", u"\u00b5V", "mV", "V", "degC", ""]),
+                              [1e-6, 1e-6, 1e-3, 1.0, 1.0, 1.0])
+
+    def test_read_selected_channels_in_window(self):
+        signals, path = self._write_dummy_edf_file()
+        sensors = SensorsSEEG(labels=numpy.array(["ch3", "ch1", "ch4", "other"]))
+        data, times, rois, rois_inds, rois_lbls = \
+            read_edf(path, sensors, rois_selection=["ch1", "ch3", "other"], time_units="ms",
+                     start_time=15.0, end_time=275.0)
+        assert numpy.all(rois == [2, 0])
+        assert numpy.all(rois_inds == [0, 1])
+        assert list(rois_lbls) == ["ch3", "ch1"]
+        assert numpy.allclose(data, signals[2:28][:, rois], rtol=0.0, atol=1e-9)
+        assert numpy.allclose(times, 10.0 * numpy.arange(2, 28))
+
+    def test_read_edf_to_memmap_time_series(self):
+        signals, path = self._write_dummy_edf_file()
+        sensors = SensorsSEEG(labels=numpy.array(self.labels))
+        memmap_path = os.path.join(self.config.out.FOLDER_TEMP, "test_edf.npy")
+        ts = read_edf_to_Timeseries(path, sensors, time_unit="ms", memmap_path=memmap_path, exclude_channels=[1])
+        assert isinstance(ts.data, numpy.memmap)
+        assert ts.space_labels.tolist() == ["ch1", "ch3", "ch4"]
+        assert numpy.allclose(ts.data[:, 0, :, 0], signals[:, [0, 2, 3]], rtol=0.0, atol=1e-9)
+        assert numpy.allclose(ts.sample_period, 10.0)
+        del ts
+
+    def test_read_mixed_rates_falls_through_engines(self):
+        signals, path = self._write_dummy_edf_file()
+        sensors = SensorsSEEG(labels=numpy.array(self.labels))
+        data = read_edf(path, sensors, engines=(MixedRatesEDFEngine, EDFNumpyEngine))[0]
+        assert numpy.allclose(data, signals, rtol=0.0, atol=1e-9)
+        # Channels of the same sample frequency are read by the first engine:
+        data = read_edf(path, sensors, exclude_channels=[0], engines=(MixedRatesEDFEngine,))[0]
+        assert numpy.allclose(data, signals[:, 1:], rtol=0.0, atol=1e-9)
+        with pytest.raises(ValueError):
+            read_edf(path, sensors, engines=(MixedRatesEDFEngine,))
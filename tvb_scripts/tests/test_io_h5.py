@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import h5py
+import numpy
+import pytest
+from tvb_scripts.io.h5_writer import H5Writer, compute_time_major_chunks
+from tvb_scripts.io.h5_reader import H5Reader, H5DatasetProxy
+from tvb_scripts.io.h5_file_pool import H5FilePool
+from tvb_scripts.io.h5_catalog import H5Catalog
+from tvb_scripts.io.h5_blob_store import H5BlobStore
+from tvb_scripts.datatypes.connectivity import Connectivity
+from tvb_scripts.tests.base import BaseTest
+
+
+class TestIOH5(BaseTest):
+    writer = H5Writer()
+
+    def test_compute_time_major_chunks(self):
+        assert compute_time_major_chunks((100000, 2, 76, 1), "f8", 2 ** 20) == (862, 2, 76, 1)
+        assert compute_time_major_chunks((10, 1000000), "f8", 2 ** 20) == (1, 131072)
+        assert compute_time_major_chunks((), "f8") is None
+
+    def test_write_dictionary_storage_policy(self):
+        path = os.path.join(self.config.out.FOLDER_TEMP, "TestStorage.h5")
+        dictionary = {"data": numpy.random.uniform(0, 1, (5000, 1, 20, 1)), "time": numpy.arange(5000.0),
+                      "small": numpy.arange(3.0)}
+        self.writer.write_dictionary(dictionary, path)
+        with h5py.File(path, "r") as h5_file:
+            assert h5_file["data"].chunks is None
+            assert h5_file["data"].compression is None
+        os.remove(path)
+        self.writer.write_dictionary(dictionary, path, chunks="auto", float32=True, compression="lzf")
+        with h5py.File(path, "r") as h5_file:
+            assert h5_file["data"].chunks is not None
+            assert h5_file["data"].compression == "lzf"
+            assert h5_file["data"].dtype == numpy.float32
+            assert numpy.allclose(h5_file["data"][()], dictionary["data"], atol=1e-6)
+            assert h5_file["time"].dtype == numpy.float64
+            assert h5_file["small"].chunks is None
+        os.remove(path)
+        H5Writer(chunks={"data": (10, 1, 20, 1)}, compression="gzip").write_dictionary(dictionary, path)
+        with h5py.File(path, "r") as h5_file:
+            assert h5_file["data"].chunks == (10, 1, 20, 1)
+            assert h5_file["data"].compression == "gzip"
+            assert numpy.all(h5_file["data"][()] == dictionary["data"])
+
+    def test_rewrite_stored_file_with_storage_policy(self):
+        # A file as written by TVB's h5.store, with contiguous, uncompressed datasets:
+        path = os.path.join(self.config.out.FOLDER_TEMP, "TestStored.h5")
+        data = numpy.random.uniform(0, 1, (5000, 1, 20, 1))
+        with h5py.File(path, "w") as h5_file:
+            h5_file.attrs["title"] = "stored"
+            h5_file.create_dataset("data", data=data).attrs["minimum"] = data.min()
+            h5_file.create_dataset("time", data=numpy.arange(5000.0))
+            h5_file.create_group("nested").create_dataset("labels", data=numpy.array([b"a", b"b"]))
+        self.writer._rewrite_stored_file(path, self.writer.storage_policy())
+        with h5py.File(path, "r") as h5_file:
+            assert h5_file["data"].chunks is None
+        writer = H5Writer(chunks="auto", compression="gzip", float32=True)
+        writer._rewrite_stored_file(path, writer.storage_policy())
+        with h5py.File(path, "r") as h5_file:
+            assert h5_file.attrs["title"] == "stored"
+            assert h5_file["data"].chunks is not None
+            assert h5_file["data"].compression == "gzip"
+            assert h5_file["data"].dtype == numpy.float32
+            assert numpy.allclose(h5_file["data"][()], data, atol=1e-6)
+            assert h5_file["data"].attrs["minimum"] == data.min()
+            assert h5_file["time"].dtype == numpy.float64
+            assert list(h5_file["nested/labels"][()]) == [b"a", b"b"]
+
+    def test_time_series_stream(self):
+        path = os.path.join(self.config.out.FOLDER_TEMP, "TestStream.h5")
+        data = numpy.random.uniform(0, 1, (250, 2, 3, 1))
+        with self.writer.open_time_series_stream(path, (2, 3, 1), start_time=5.0, sample_period=0.5,
+                                                 labels_dimensions={"Region": ["a", "b", "c"]},
+                                                 flush_samples=100) as stream:
+            for i_start in range(0, 250, 40):
+                stream.append(data[i_start:i_start + 40])
+            assert stream.n_times == 250
+        ts = H5Reader().read_time_series(path)
+        assert numpy.allclose(ts.data, data)
+        assert ts.start_time == 5.0
+        assert ts.sample_period == 0.5
+        assert ts.labels_dimensions["Region"] == ["a", "b", "c"]
+        stream = self.writer.open_time_series_stream(path, (2, 3, 1), compression=None)
+        stream.append(data)
+        stream.close(contiguous=True)
+        ts = H5Reader().read_time_series(path, memmap=True)
+        assert isinstance(ts.data, numpy.memmap)
+        assert numpy.allclose(ts.data, data)
+        del ts
+        # Writable handles kept open by a pool do not survive the repacking of the file:
+        pool = H5FilePool(keep_writable=True)
+        writer = H5Writer()
+        writer.file_pool = pool
+        stream = writer.open_time_series_stream(path, (2, 3, 1), compression=None)
+        stream.append(data)
+        stream.close(contiguous=True)
+        reader = H5Reader()
+        reader.file_pool = pool
+        ts = reader.read_time_series(path, memmap=True)
+        assert isinstance(ts.data, numpy.memmap)
+        assert numpy.allclose(ts.data, data)
+        del ts
+        pool.close()
+
+    def test_read_dictionary_lazy(self):
+        path = os.path.join(self.config.out.FOLDER_TEMP, "TestLazy.h5")
+        data = numpy.random.uniform(0, 1, (50, 4, 6))
+        self.writer.write_dictionary({"data": data}, path)
+        proxy = H5Reader().read_dictionary(path, type="dict", lazy=True)["data"]
+        assert isinstance(proxy, H5DatasetProxy)
+        assert proxy.shape == data.shape
+        assert numpy.allclose(proxy[3:7, 1], data[3:7, 1])
+        assert numpy.allclose(proxy[:, [3, 0, 0, -1]], data[:, [3, 0, 0, -1]])
+        assert numpy.allclose(proxy[numpy.array([3, 0])], data[[3, 0]])
+        with pytest.raises(IndexError):
+            proxy[:, [7]]
+        with pytest.raises(IndexError):
+            proxy[:, numpy.array([0, -5])]
+        assert numpy.allclose(numpy.array(proxy), data)
+        # Once released, the file can be written again:
+        H5Reader().release(path)
+        self.writer.write_dictionary({"data": data}, path)
+        with h5py.File(path, "w") as h5_file:
+            h5_file["data"] = data + 1.0
+
+    def test_from_h5_file(self):
+        path = os.path.join(self.config.out.FOLDER_TEMP, "TestConnectivity.h5")
+        with h5py.File(path, "w") as h5_file:
+            h5_file["weights"] = numpy.ones((3, 3))
+            h5_file["tract_lengths"] = 2 * numpy.ones((3, 3))
+            h5_file["not_an_attribute"] = 1
+        connectivity = Connectivity.from_h5_file(path)
+        assert numpy.all(connectivity.weights == 1.0)
+        assert numpy.all(connectivity.tract_lengths == 2.0)
+        assert not hasattr(connectivity, "not_an_attribute")
+        connectivity = Connectivity.from_h5_file(path, fields=["weights"])
+        assert getattr(connectivity, "tract_lengths", None) is None
+
+    def test_file_pool(self):
+        paths = []
+        for i_file in range(3):
+            paths.append(os.path.join(self.config.out.FOLDER_TEMP, "TestPool%d.h5" % i_file))
+            with h5py.File(paths[-1], "w") as h5_file:
+                h5_file["data"] = i_file
+        # By default, unreferenced handles are closed, so that files can be written from outside the pool:
+        pool = H5FilePool()
+        h5_file = pool.acquire(paths[0])
+        pool.release(h5_file)
+        assert pool.stats["open_files"] == 0
+        with h5py.File(paths[0], "a") as h5_file:
+            h5_file["data"][()] = 0
+        pool = H5FilePool(max_size=2, keep_readable=True)
+        for path in paths + paths[-2:]:
+            h5_file = pool.acquire(path)
+            assert h5_file["data"][()] == paths.index(path)
+            pool.release(h5_file)
+        assert pool.stats["hits"] == 2
+        assert pool.stats["opens"] == 3
+        assert pool.stats["evictions"] == 1
+        assert pool.stats["open_files"] == 2
+        h5_file = pool.acquire(paths[-1])
+        with pytest.raises(ValueError):
+            pool.acquire(paths[-1], "a")
+        pool.release(h5_file)
+        h5_file = pool.acquire(paths[-1], "a")
+        h5_file["data"][()] = 10
+        pool.release(h5_file)
+        h5_file = pool.acquire(paths[-1])
+        assert h5_file["data"][()] == 10
+        pool.release(h5_file)
+        pool.close()
+        assert pool.stats["open_files"] == 0
+
+    def test_write_list_of_dictionaries_in_parallel_and_shards(self):
+        path = os.path.join(self.config.out.FOLDER_TEMP, "TestList.h5")
+        dicts = [{"data": numpy.arange(i_dict + 1.0), "index": i_dict, "nested": {"labels": [1, 2], "name": "n"}}
+                 for i_dict in range(10)]
+        self.writer.write_list_of_dictionaries(dicts, path, n_workers=2, n_shards=3)
+        for i_shard in range(3):
+            assert os.path.isfile(os.path.join(self.config.out.FOLDER_TEMP, "TestList_shard%d.h5" % i_shard))
+        with h5py.File(path, "r") as h5_file:
+            assert len(h5_file.keys()) == 10
+            for i_dict, dictionary in enumerate(dicts):
+                group = h5_file[str(i_dict)]
+                assert numpy.all(group["data"][()] == dictionary["data"])
+                assert group.attrs["index"] == str(i_dict)
+                assert numpy.all(group["nested/labels"][()] == [1, 2])
+
+    def test_read_list_of_dicts(self):
+        path = os.path.join(self.config.out.FOLDER_TEMP, "TestReadList.h5")
+        dicts = [{"data": numpy.arange(i_dict + 1.0), "nested": {"deeper": {"ones": numpy.ones(2)}, "name": "n"}}
+                 for i_dict in range(12)]
+        self.writer.write_list_of_dictionaries(dicts, path, n_shards=2)
+        list_of_dicts = H5Reader().read_list_of_dicts(path)
+        assert len(list_of_dicts) == 12
+        for dictionary, read_dictionary in zip(dicts, list_of_dicts):
+            assert numpy.all(read_dictionary["data"] == dictionary["data"])
+            assert numpy.all(read_dictionary["nested"]["deeper"]["ones"] == 1.0)
+        referenced_files = H5Reader.file_pool.stats["referenced_files"]
+        generated = H5Reader().read_list_of_dicts(path, generator=True)
+        assert not isinstance(generated, list)
+        # The file is opened only on iteration:
+        assert H5Reader.file_pool.stats["referenced_files"] == referenced_files
+        assert [len(dictionary["data"]) for dictionary in generated] == list(range(1, 13))
+        dictionary = H5Reader().read_dictionary(path.replace("TestReadList", "TestReadList_shard0"))
+        assert sorted(dictionary["0"].keys()) == ["Subtype", "Type", "data", "nested"]
+
+    def test_catalog(self):
+        folder = self.config.out.FOLDER_TEMP
+        for i_file in range(6):
+            with h5py.File(os.path.join(folder, "TestCatalog%d.h5" % i_file), "w") as h5_file:
+                h5_file.attrs["Type"] = numpy.string_("TimeSeries")
+                h5_file.attrs["Subtype"] = numpy.string_("TimeSeriesRegion" if i_file % 2 else "TimeSeriesSEEG")
+                h5_file.attrs["subject"] = numpy.string_("s%d" % (i_file % 3))
+                h5_file.attrs["sample_period"] = 0.5
+                h5_file.attrs["flag"] = i_file == 2
+                h5_file["data"] = numpy.zeros((10 + i_file, 2))
+        with H5Catalog(os.path.join(folder, "catalog.sqlite")) as catalog:
+            n_indexed = catalog.update(folder)[0]
+            assert n_indexed >= 6
+            assert catalog.update(folder) == (0, 0)
+            paths = catalog.query(subtype="TimeSeriesRegion", subject="s1", sample_period=0.5)
+            assert [os.path.basename(path) for path in paths] == ["TestCatalog1.h5"]
+            assert catalog.get(paths[0])["n_times"] == 11
+            assert catalog.get(paths[0])["datasets"]["data"]["shape"] == "(11, 2)"
+            assert [os.path.basename(path) for path in catalog.query(flag=True)] == ["TestCatalog2.h5"]
+            os.remove(paths[0])
+            assert catalog.update(folder) == (0, 1)
+            assert catalog.query(subtype="TimeSeriesRegion", subject="s1") == []
+            # Writers with a catalog can prepare payloads in worker processes:
+            path = os.path.join(folder, "TestCatalogList.h5")
+            H5Writer(catalog=catalog).write_list_of_dictionaries([{"data": numpy.arange(3.0)}] * 3, path,
+                                                                 n_workers=2, use_processes=True)
+            assert catalog.get(path) is not None
+
+    def test_blob_store_deduplication(self):
+        folder = self.config.out.FOLDER_TEMP
+        blob_store = H5BlobStore(os.path.join(folder, "blobs"), min_bytes=1000)
+        writer = H5Writer(blob_store=blob_store)
+        gain = numpy.random.uniform(0, 1, (100, 100))
+        for i_subject in range(3):
+            writer.write_dictionary({"gain": gain, "small": numpy.arange(3.0)},
+                                    os.path.join(folder, "TestDedup%d.h5" % i_subject))
+        assert blob_store.stats["misses"] == 1
+        assert blob_store.stats["hits"] == 2
+        for i_subject in range(3):
+            with h5py.File(os.path.join(folder, "TestDedup%d.h5" % i_subject), "r") as h5_file:
+                assert isinstance(h5_file.get("gain", getlink=True), h5py.ExternalLink)
+                assert numpy.all(h5_file["gain"][()] == gain)
+                assert numpy.all(h5_file["small"][()] == numpy.arange(3.0))
+        # Deduplicated datasets are memory mapped from their blobs:
+        data = H5Reader().memmap_dataset(os.path.join(folder, "TestDedup0.h5"), "gain")
+        assert numpy.all(data == gain)
+        del data
+        shutil.rmtree(blob_store.folder)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import numpy
+from tvb_scripts.datatypes.surface import CorticalSurface
+from tvb_scripts.datatypes.region_mapping import CorticalRegionMapping
+from tvb_scripts.datatypes.time_series import TimeSeriesSurface
+from tvb_scripts.service.time_series_service import TimeSeriesService
+from tvb_scripts.tests.base import BaseTest
+
+
+class TestRegionMapping(BaseTest):
+
+    def _prepare_region_mapping(self):
+        connectivity = self._prepare_connectivity()
+        surface = CorticalSurface(vertices=numpy.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [-1.0, 0.0, 0.0],
+                                                        [0.0, -1.0, 0.0], [0.0, 0.0, 1.0], [0.0, 0.0, -1.0]]),
+                                  triangles=numpy.array([[0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4],
+                                                         [1, 0, 5], [2, 1, 5], [3, 2, 5], [0, 3, 5]]),
+                                  vertex_normals=numpy.array([]), triangle_normals=numpy.array([]),
+                                  zero_based_triangles=True)
+        surface.configure()
+        return CorticalRegionMapping(array_data=numpy.array([0, 0, 1, 1, 1, 3]),
+                                     connectivity=connectivity, surface=surface)
+
+    def test_mapping_operators(self):
+        region_mapping = self._prepare_region_mapping()
+        averaging = region_mapping.get_region_averaging_operator()
+        assert averaging.shape == (4, 6)
+        assert numpy.allclose(averaging.toarray()[1], [0.0, 0.0, 1.0 / 3, 1.0 / 3, 1.0 / 3, 0.0])
+        # Regions without vertices get zero weights:
+        assert numpy.all(averaging.toarray()[2] == 0.0)
+        assert region_mapping.get_region_averaging_operator() is averaging
+        assert numpy.allclose(region_mapping.get_region_averaging_operator(area_weighted=True).toarray(),
+                              averaging.toarray())
+        broadcasting = region_mapping.get_vertex_broadcasting_operator()
+        assert numpy.all(broadcasting.dot(numpy.arange(4.0)) == region_mapping.array_data)
+        region_mapping.array_data = numpy.array([0, 1, 1, 1, 1, 3])
+        assert region_mapping.get_region_averaging_operator().toarray()[0, 0] == 1.0
+
+    def test_surface_to_region(self):
+        region_mapping = self._prepare_region_mapping()
+        data = numpy.random.normal(size=(7, 2, 6, 1))
+        time_series = TimeSeriesSurface(data, surface=region_mapping.surface, sample_period=1.0)
+        region_time_series = TimeSeriesService().surface_to_region(time_series, region_mapping, time_block=3)
+        assert region_time_series.shape == (7, 2, 4, 1)
+        assert list(region_time_series.region_labels) == ["a", "b", "c", "d"]
+        assert numpy.allclose(region_time_series.data[:, :, 1], data[:, :, 2:5].mean(axis=2))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import numpy
+from tvb_scripts.datatypes.sensors import SensorsSEEG
+from tvb_scripts.datatypes.time_series import TimeSeriesSEEG, TimeSeriesDimensions
+from tvb_scripts.tests.base import BaseTest
+
+
+class TestSensors(BaseTest):
+    labels = numpy.array(["A1", "A2", "A3", "B'1", "B'2", "B'4", "C", "AB4"])
+
+    def _prepare_seeg_sensors(self):
+        sensors = SensorsSEEG(labels=self.labels, locations=numpy.zeros((len(self.labels), 3)))
+        sensors.configure()
+        return sensors
+
+    def test_bipolar_montage(self):
+        sensors = self._prepare_seeg_sensors()
+        bipolar_labels, bipolar_inds, operator = sensors.get_bipolar_montage()
+        assert bipolar_labels == ["A1-A2", "A2-A3", "B'1-B'2"]
+        assert bipolar_inds == [[0, 1, 3], [1, 2, 4]]
+        assert operator.shape == (3, 8)
+        assert numpy.all(operator.toarray()[2] == [0, 0, 0, 1, -1, 0, 0, 0])
+        assert sensors.get_bipolar_montage()[2] is operator
+        assert sensors.get_bipolar_sensors([3, 4, 5]) == (["B'1-B'2"], [[3], [4]])
+        # Setting labels invalidates the cached montage:
+        sensors.labels = self.labels[:2]
+        assert sensors.get_bipolar_montage()[2].shape == (1, 2)
+
+    def test_time_series_bipolar(self):
+        sensors = self._prepare_seeg_sensors()
+        data = numpy.random.normal(size=(10, 2, len(self.labels), 1))
+        time_series = TimeSeriesSEEG(data, sensors=sensors, sample_period=1.0,
+                                     labels_dimensions={TimeSeriesDimensions.SENSORS.value: list(self.labels)})
+        for time_block in [None, 3]:
+            bipolar = time_series.get_bipolar(time_block=time_block)
+            assert list(bipolar.space_labels) == ["A1-A2", "A2-A3", "B'1-B'2"]
+            assert numpy.allclose(bipolar.data, data[:, :, [0, 1, 3]] - data[:, :, [1, 2, 4]])
+
+    def test_electrodes_index(self):
+        sensors = SensorsSEEG(labels=numpy.array(["B'1", "A1", "A2", "B'2", "A3", "C"]),
+                              locations=numpy.zeros((6, 3)))
+        sensors.configure()
+        assert list(sensors.elec_labels) == ["A", "B'", "C"]
+        assert [list(inds) for inds in sensors.elec_inds] == [[1, 2, 4], [0, 3], [5]]
+        assert list(sensors.sensors_elec_inds) == [1, 0, 0, 1, 0, 2]
+        elec_labels, elecs_sensors_inds = sensors.group_sensors_to_electrodes()
+        assert [list(inds) for inds in elecs_sensors_inds] == [[1, 2, 4], [0, 3], [5]]
+        assert sensors.get_elecs_inds_by_elecs_labels(["C", "A"]) == [2, 0]
+        assert list(sensors.get_sensors_inds_by_elec_labels(["B'", "C"])) == [0, 3, 5]
+        assert sensors.get_sensors_inds_by_sensors_labels(["A2-A3", "C"]) == [2, 5]
+        # Setting labels invalidates the cached electrodes' index:
+        sensors.labels = numpy.array(["X1", "X2"])
+        sensors.configure()
+        assert list(sensors.elec_labels) == ["X"]
+        assert list(sensors.get_sensors_inds_by_elec_labels("X")) == [0, 1]
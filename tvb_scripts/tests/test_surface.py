@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import numpy
+from tvb_scripts.datatypes.surface import CorticalSurface, MeshBuilder
+from tvb_scripts.tests.base import BaseTest
+
+
+class TestSurface(BaseTest):
+
+    def _prepare_octahedron(self):
+        vertices = numpy.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [-1.0, 0.0, 0.0],
+                                [0.0, -1.0, 0.0], [0.0, 0.0, 1.0], [0.0, 0.0, -1.0]])
+        triangles = numpy.array([[0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4],
+                                 [1, 0, 5], [2, 1, 5], [3, 2, 5], [0, 3, 5]])
+        surface = CorticalSurface(vertices=vertices, triangles=triangles, zero_based_triangles=True,
+                                  vertex_normals=numpy.array([]), triangle_normals=numpy.array([]))
+        surface.configure()
+        return surface
+
+    def test_mesh_metrics(self):
+        surface = self._prepare_octahedron()
+        assert numpy.allclose(surface.get_triangle_areas(), numpy.sqrt(3) / 2)
+        assert numpy.allclose(surface.get_vertex_areas(), 2 * numpy.sqrt(3) / 3)
+        assert numpy.allclose(surface.compute_surface_area(), 4 * numpy.sqrt(3))
+        assert numpy.allclose(surface.get_vertex_normals(), surface.vertices)
+        triangle_centers = surface.vertices[surface.triangles].mean(axis=1)
+        assert numpy.allclose(surface.get_triangle_normals(),
+                              triangle_centers / numpy.linalg.norm(triangle_centers, axis=1)[:, numpy.newaxis])
+        # Setting vertices invalidates the cached metrics:
+        surface.vertices = 2 * surface.vertices
+        assert numpy.allclose(surface.get_vertex_areas(), 8 * numpy.sqrt(3) / 3)
+
+    def test_mesh_builder(self):
+        surface = self._prepare_octahedron()
+        vertices = surface.vertices.copy()
+        triangles = surface.triangles.copy()
+        surface.add_vertices_and_triangles(vertices + 5.0, triangles)
+        assert surface.vertices.shape == (12, 3)
+        assert numpy.all(surface.triangles[8:] == triangles + 6)
+        assert numpy.allclose(surface.vertex_normals[6:], vertices)
+        builder = MeshBuilder(surface, capacity=2)
+        for shift in range(10):
+            builder.append(vertices + 10.0 * shift, triangles, vertex_normals=vertices)
+        builder.build()
+        assert surface.number_of_vertices == 72
+        assert surface.number_of_triangles == 96
+        assert numpy.all(surface.triangles[-8:] == triangles + 66)
+        assert numpy.allclose(surface.triangle_normals[-8:], surface.triangle_normals[:8])
+
+    def test_decimate(self):
+        surface = self._prepare_octahedron()
+        # Refine the octahedron by merging many shifted copies of it, and decimate it back to one vertex per copy:
+        builder = MeshBuilder(surface)
+        for shift in range(1, 5):
+            builder.append(surface.vertices * 0.01 + 10.0 * shift + 0.25, surface.triangles)
+        builder.build()
+        coarse_surface, fine_to_coarse, coarse_to_fine = surface.decimate(cell_size=0.5)
+        assert fine_to_coarse.shape == (coarse_surface.vertices.shape[0], surface.vertices.shape[0])
+        assert coarse_to_fine.shape == fine_to_coarse.shape[::-1]
+        assert numpy.allclose(fine_to_coarse.sum(axis=1), 1.0)
+        # The small copies collapse to single vertices at their centers, without triangles:
+        assert coarse_surface.vertices.shape[0] == surface.vertices.shape[0] - 4 * 5
+        assert numpy.allclose(coarse_surface.vertices[-4:], 10.0 * numpy.arange(1, 5)[:, numpy.newaxis] + 0.25)
+        assert coarse_surface.triangles.shape[0] == 8
+        values = numpy.random.normal(size=(coarse_surface.vertices.shape[0],))
+        assert numpy.allclose(fine_to_coarse.dot(coarse_to_fine.dot(values)), values)
+        assert surface.decimate(cell_size=0.5)[0] is coarse_surface
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import h5py
+import numpy
+from tvb_scripts.service.time_series_h5_service import TimeSeriesH5Service
+from tvb_scripts.tests.base import BaseTest
+
+
+class TestTimeSeriesH5Service(BaseTest):
+
+    def _write_dummy_time_series_file(self):
+        data = self._prepare_dummy_time_series(4)[0] + 1.0
+        path = os.path.join(self.config.out.FOLDER_TEMP, "TimeSeriesSource.h5")
+        with h5py.File(path, "w") as h5_file:
+            h5_file.create_dataset("data", data=data)
+            h5_file.create_dataset("time", data=numpy.arange(data.shape[0]))
+        return data, path
+
+    def test_pointwise_operations_in_slabs(self):
+        data, source = self._write_dummy_time_series_file()
+        target = os.path.join(self.config.out.FOLDER_TEMP, "TimeSeriesTarget.h5")
+        for axis in [0, 2]:
+            service = TimeSeriesH5Service(axis=axis, slab_size=1)
+            service.log(source, target)
+            with h5py.File(target, "r") as h5_file:
+                assert numpy.allclose(h5_file["data"][()], numpy.log(data))
+                assert numpy.all(h5_file["time"][()] == numpy.arange(data.shape[0]))
+            mean = data.mean(axis=0)
+            std = data.std(axis=0)
+            service.normalize(source, target, mean, std)
+            with h5py.File(target, "r") as h5_file:
+                assert numpy.allclose(h5_file["data"][()], (data - mean) / std)
+
+    def test_project(self):
+        data, source = self._write_dummy_time_series_file()
+        target = os.path.join(self.config.out.FOLDER_TEMP, "TimeSeriesTarget.h5")
+        projection = numpy.random.uniform(0, 1, (2, data.shape[2]))
+        TimeSeriesH5Service(slab_size=2).project(source, target, projection)
+        with h5py.File(target, "r") as h5_file:
+            assert h5_file["data"].shape == (data.shape[0], data.shape[1], 2, data.shape[3])
+            assert numpy.allclose(h5_file["data"][()], numpy.einsum("tvsm,ns->tvnm", data, projection))
+
+    def test_compute_statistics(self):
+        data, source = self._write_dummy_time_series_file()
+        stats = TimeSeriesH5Service(slab_size=1).compute_statistics(source)
+        assert numpy.allclose(stats.mean, data.mean(axis=0))
+        assert numpy.allclose(stats.std, data.std(axis=0))
+        assert numpy.allclose(stats.min, data.min(axis=0))
+        assert numpy.allclose(stats.max, data.max(axis=0))
+        assert numpy.allclose(stats.percentile(50), numpy.percentile(data, 50, axis=0))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import numpy
+import pytest
+from scipy.signal import hilbert
+from scipy.stats import zscore
+from tvb_scripts.utils.time_series_utils import abs_envelope, interval_scaling, normalize_signals, \
+    SignalsStatistics, hilbert_analysis
+from tvb_scripts.tests.base import BaseTest
+
+
+class TestTimeSeriesUtils(BaseTest):
+
+    def test_signals_statistics(self):
+        data = numpy.random.normal(1.0, 2.0, (1000, 3))
+        stats = SignalsStatistics(reservoir_size=1000)
+        for start in range(0, 1000, 77):
+            stats.update(data[start:start + 77])
+        assert stats.n == 1000
+        assert numpy.allclose(stats.mean, data.mean(axis=0))
+        assert numpy.allclose(stats.std, data.std(axis=0))
+        assert numpy.allclose(stats.min, data.min(axis=0))
+        assert numpy.allclose(stats.max, data.max(axis=0))
+        assert numpy.allclose(stats.percentile(5), numpy.percentile(data, 5, axis=0))
+
+    def test_normalize_signals(self):
+        data = self._prepare_dummy_time_series(4)[0].astype("f") + numpy.random.uniform(0.0, 1.0, (3, 3, 4, 4))
+        for axis in [None, 0, 2]:
+            assert numpy.allclose(normalize_signals(data, "zscore", axis), zscore(data, axis=axis))
+            min_data = data - numpy.min(data, axis=axis, keepdims=True)
+            assert numpy.allclose(normalize_signals(data, "minmax", axis),
+                                  min_data / numpy.max(min_data, axis=axis, keepdims=True))
+            baseline_data = data - numpy.percentile(data, 1, axis=axis, keepdims=True)
+            assert numpy.allclose(normalize_signals(data, "baseline-std", axis),
+                                  baseline_data / numpy.std(baseline_data, axis=axis, keepdims=True))
+        with pytest.raises(ValueError):
+            normalize_signals(data, "unknown")
+        # Percentiles of in-memory signals are exact, also beyond the reservoir size of SignalsStatistics:
+        data = numpy.random.uniform(0.0, 1.0, (20000, 3))
+        assert numpy.allclose(normalize_signals(data, "baseline", 0), data - numpy.percentile(data, 1, axis=0))
+
+    def test_output_arrays(self):
+        data = numpy.random.uniform(0.0, 1.0, (100, 4))
+        original_data = data.copy()
+        envelope = abs_envelope(data)
+        assert numpy.all(data == original_data)
+        out = numpy.empty_like(data)
+        assert abs_envelope(data, out=out) is out
+        assert numpy.allclose(out, envelope)
+        assert abs_envelope(data, inplace=True) is data
+        assert numpy.allclose(data, envelope)
+        scaled = interval_scaling(original_data, out=out)
+        assert scaled is out
+        assert numpy.allclose(scaled.min(axis=0), 0.0) and numpy.allclose(scaled.max(axis=0), 1.0)
+        with pytest.raises(ValueError):
+            abs_envelope(numpy.arange(5), inplace=True)
+
+    def test_hilbert_analysis(self):
+        data = numpy.random.normal(0.0, 1.0, (1009, 2, 3))
+        analytic = hilbert(data, axis=0)
+        results = hilbert_analysis(data, 100.0, ["envelope", "phase"], fast_length=False, n_threads=2)
+        assert numpy.allclose(results["envelope"], numpy.abs(analytic))
+        assert numpy.allclose(results["phase"], numpy.angle(analytic))
+        sine = numpy.sin(2 * numpy.pi * 5.0 * numpy.arange(2000) / 100.0)[:, None]
+        for time_block in [None, 500]:
+            results = hilbert_analysis(sine, 100.0, ["envelope", "frequency"], time_block=time_block,
+                                       single_precision=True)
+            assert results["envelope"].dtype == numpy.float32
+            assert numpy.allclose(results["envelope"][100:-100], 1.0, atol=5e-2)
+            assert numpy.allclose(results["frequency"][100:-100], 5.0, atol=1e-1)
+        with pytest.raises(ValueError):
+            hilbert_analysis(data, outputs="power")
@@ -1,12 +1,13 @@
 # coding=utf-8
 # Some math tools
-from itertools import product
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.cluster import AgglomerativeClustering
 
 import numpy as np
+from scipy.signal import fftconvolve
 
 from tvb_scripts.config import FiguresConfig, CalculusConfig
-from tvb_scripts.utils.log_error_utils import initialize_logger, warning
+from tvb_scripts.utils.log_error_utils import initialize_logger, warning, raise_value_error
 from tvb_scripts.utils.data_structures_utils import is_integer
 
 
@@ -47,20 +48,92 @@ def compute_in_degree(weights):
     return np.expand_dims(np.sum(weights, axis=1), 1).T
 
 
-def compute_gain_matrix(locations1, locations2, normalize=100.0, ceil=False):
+def compute_gain_matrix(locations1, locations2, normalize=100.0, ceil=False, dtype=np.float64, out=None,
+                        block_size=None, n_threads=1, sample_size=CalculusConfig.STATISTICS_RESERVOIR_SIZE, seed=None):
+    """
+    Compute the inverse squared distance gain matrix between locations1 (e.g., sensors) and locations2 (e.g., sources).
+    The squared distances are computed as |x1|^2 + |x2|^2 - 2 * x1.x2, i.e., via a matrix product,
+    for blocks of locations2, which may be processed in parallel threads.
+    :param normalize: the percentile of the gain values to divide the matrix with.
+                      The maximum (i.e., 100) is computed exactly,
+                      whereas any other percentile is estimated from a random sample of sample_size gain values.
+    :param ceil: if not False, the gain matrix is clipped to ceil (1.0 if ceil is True)
+    :param dtype: the dtype of the output gain matrix, e.g., float32 to halve memory
+    :param out: an array of shape (locations1, locations2) to write the output to,
+                or a file path, where the output will be written as a numpy memmap
+    :param block_size: the number of locations2 per block. Default: fit the memory budget of CalculusConfig.MAX_SLAB_BYTES
+    :param n_threads: the number of threads processing blocks in parallel
+    :return: the gain matrix of shape (locations1, locations2)
+    """
+    locations1 = np.asarray(locations1, dtype=np.float64)
+    locations2 = np.asarray(locations2, dtype=np.float64)
     n1 = locations1.shape[0]
     n2 = locations2.shape[0]
-    projection = np.zeros((n1, n2))
-    dist = np.zeros((n1, n2))
-    for i1, i2 in product(range(n1), range(n2)):
-        dist[i1, i2] = np.abs(np.sum((locations1[i1, :] - locations2[i2, :]) ** 2))
-        projection[i1, i2] = 1 / dist[i1, i2]
+    if out is None:
+        projection = np.empty((n1, n2), dtype=dtype)
+    elif isinstance(out, np.ndarray):
+        if out.shape != (n1, n2):
+            raise_value_error("The output array's shape %s does not match the gain matrix's shape %s!"
+                              % (str(out.shape), str((n1, n2))))
+        projection = out
+    else:
+        projection = np.memmap(out, dtype=dtype, mode="w+", shape=(n1, n2))
+    if block_size is None:
+        # Approximately: a float64 distances' block, and its output:
+        block_size = CalculusConfig.MAX_SLAB_BYTES // max(1, n1 * (8 + projection.dtype.itemsize))
+    block_size = int(max(1, block_size))
+    blocks = [(start, min(start + block_size, n2)) for start in range(0, n2, block_size)]
+    sq_norms1 = np.sum(locations1 ** 2, axis=1)[:, np.newaxis]
+    sample_percentile = bool(normalize) and normalize < 100.0 and n1 * n2 > sample_size
+    random_state = np.random.RandomState(seed)
+    # Draw the samples' indices upfront, so that they do not depend on the order of the blocks' computation:
+    if sample_percentile:
+        samples_inds = np.sort(random_state.randint(0, n1 * n2, sample_size))
+        samples_inds = np.unravel_index(samples_inds, (n1, n2))
+    blocks_max = np.zeros((len(blocks), ))
+    blocks_samples = [None] * len(blocks)
+
+    def compute_block(i_block):
+        start, end = blocks[i_block]
+        block_locations = locations2[start:end]
+        dist = np.dot(locations1, block_locations.T)
+        dist *= -2
+        dist += sq_norms1
+        dist += np.sum(block_locations ** 2, axis=1)[np.newaxis]
+        # Correct for round off errors of the expansion:
+        np.maximum(dist, 0.0, out=dist)
+        with np.errstate(divide="ignore"):
+            np.divide(1.0, dist, out=dist)
+        projection[:, start:end] = dist
+        if normalize:
+            blocks_max[i_block] = np.max(dist)
+            if sample_percentile:
+                in_block = np.logical_and(samples_inds[1] >= start, samples_inds[1] < end)
+                blocks_samples[i_block] = dist[samples_inds[0][in_block], samples_inds[1][in_block] - start]
+
+    if n_threads > 1 and len(blocks) > 1:
+        # numpy's matrix products and ufuncs release the GIL, and each block writes to its own columns:
+        with ThreadPoolExecutor(max_workers=int(n_threads)) as executor:
+            list(executor.map(compute_block, range(len(blocks))))
+    else:
+        for i_block in range(len(blocks)):
+            compute_block(i_block)
     if normalize:
-        projection /= np.percentile(projection, normalize)
-    if ceil:
-        if ceil is True:
-            ceil = 1.0
-        projection[projection > ceil] = ceil
+        if normalize >= 100.0:
+            norm = np.max(blocks_max)
+        elif sample_percentile:
+            norm = np.percentile(np.concatenate(blocks_samples), normalize)
+        else:
+            norm = np.percentile(projection, normalize)
+    if ceil is True:
+        ceil = 1.0
+    for start, end in blocks:
+        if normalize:
+            projection[:, start:end] /= norm
+        if ceil:
+            np.minimum(projection[:, start:end], ceil, out=projection[:, start:end])
+    if isinstance(projection, np.memmap):
+        projection.flush()
     return projection
 
 
@@ -190,19 +263,64 @@ def spikes_events_to_time_index(spike_time, time):
     return np.argmin(np.abs(time - spike_time))
 
 
-def compute_spikes_counts(spikes_times, time):
-    spikes_counts = np.zeros(time.shape)
-    for spike_time in spikes_times:
-        ind = spikes_events_to_time_index(spike_time, time)
-        if ind is not None:
-            spikes_counts[ind] += 1
-    return spikes_counts
-
-
-def spikes_rate_convolution(spike, spikes_kernel):
+def spikes_events_to_time_indices(spikes_times, time):
+    """
+    Vectorized spikes_events_to_time_index for all spikes at once, for a time vector sorted in ascending order:
+    the index of the nearest time point (the earlier one in case of ties) is found via binary search.
+    :return: the time indices of the spikes, with -1 for the spikes outside the time interval
+    """
+    spikes_times = np.asarray(spikes_times).ravel()
+    time = np.asarray(time)
+    if len(time) < 2:
+        inds = np.zeros(spikes_times.shape, dtype=np.int64)
+    else:
+        inds = np.searchsorted(time, spikes_times).clip(1, len(time) - 1)
+        # Choose the earlier time point if it is at least as near as the later one:
+        inds -= (spikes_times - time[inds - 1]) <= (time[inds] - spikes_times)
+    inds[np.logical_or(spikes_times < time[0], spikes_times > time[-1])] = -1
+    return inds
+
+
+def compute_spikes_counts(spikes_times, time, neurons_inds=None, n_neurons=None):
+    """
+    Count the spikes' events per time point, via a single bincount.
+    :param spikes_times: the times of the spikes
+    :param time: the time vector, in ascending order
+    :param neurons_inds: the integer indices of the neurons that spiked, for each spike
+    :param n_neurons: the total number of neurons, default: max(neurons_inds) + 1
+    :return: the spikes counts of shape (time, ) if neurons_inds is None, otherwise of shape (time, neurons)
+    """
+    n_times = len(time)
+    inds = spikes_events_to_time_indices(spikes_times, time)
+    in_time = inds >= 0
+    if neurons_inds is None:
+        return np.bincount(inds[in_time], minlength=n_times).astype(np.float64)
+    neurons_inds = np.asarray(neurons_inds, dtype="i").ravel()
+    if n_neurons is None:
+        n_neurons = int(neurons_inds.max()) + 1 if neurons_inds.size else 0
+    elif neurons_inds.size and (neurons_inds.max() >= n_neurons or neurons_inds.min() < 0):
+        raise_value_error("Neurons' indices out of the range [0, %d)!" % n_neurons)
+    # Count (time, neuron) pairs, flattened in C order:
+    return np.bincount(inds[in_time] * n_neurons + neurons_inds[in_time],
+                       minlength=n_times * n_neurons).reshape((n_times, n_neurons)).astype(np.float64)
+
+
+def spikes_rate_convolution(spike, spikes_kernel, axis=0):
+    """
+    Convolve the spikes' counts with spikes_kernel along axis.
+    spike can be the counts of a single neuron, or a (time x neurons) matrix,
+    which is convolved at once with a single FFT convolution.
+    The rates are clipped at 0, since the FFT convolution leaves small negative round-off errors,
+    where a direct convolution would give exact zeros.
+    """
+    spike = np.asarray(spike)
     if (spike != 0).any():
+        spikes_kernel = np.asarray(spikes_kernel).ravel()
         if len(spikes_kernel) > 1:
-            return np.convolve(spike, spikes_kernel, mode="same")
+            kernel_shape = [1] * spike.ndim
+            kernel_shape[axis] = len(spikes_kernel)
+            rates = fftconvolve(spike, spikes_kernel.reshape(kernel_shape), mode="same", axes=axis)
+            return np.maximum(rates, 0.0, out=rates)
         else:
             return spike * spikes_kernel
     else:
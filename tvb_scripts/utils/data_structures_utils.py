@@ -367,42 +367,162 @@ def linear_index_to_coordinate_tuples(linear_index, shape):
         return []
 
 
-def find_labels_inds(labels, keys, modefun="find", two_way_search=False, break_after=np.iinfo(np.int64).max):
-    if isequal_string(modefun, "equal"):
-        modefun = lambda x, y: isequal_string(x, y)
-    else:
-        if two_way_search:
-            modefun = lambda x, y: (x.find(y) >= 0) or (y.find(x) >= 0)
+def _lower_label(label):
+    if isinstance(label, string_types):
+        return label.lower()
+    return label
+
+
+class LabelsIndex(object):
+    """
+    Index of a sequence of labels for repeated searches of keys in them:
+    - hash maps of the labels, and of their lower case versions, to all their indices, for "equal" matches,
+    - a map of all substrings of up to ngram characters of the labels to the indices of the labels containing them,
+      for "find" matches, which only need to be verified for the labels containing all ngrams of a key
+      (ngram=0 skips this index, e.g., when only exact matches are needed).
+    The indices returned for each key are sorted, and include all duplicates of a label.
+    """
+
+    def __init__(self, labels, ngram=3):
+        self.labels = ensure_list(labels)
+        self.ngram = int(max(0, ngram))
+        self._strings = [str(label) for label in self.labels]
+        self._exact = OrderedDict()
+        self._lower = OrderedDict()
+        self._ngrams = {}
+        for ind, (label, string) in enumerate(zip(self.labels, self._strings)):
+            self._exact.setdefault(label, []).append(ind)
+            self._lower.setdefault(_lower_label(label), []).append(ind)
+            for n in range(1, self.ngram + 1):
+                for start in range(len(string) - n + 1):
+                    inds = self._ngrams.setdefault(string[start:start + n], [])
+                    if len(inds) == 0 or inds[-1] != ind:
+                        inds.append(ind)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def index(self, label):
+        """
+        Return the index of the first occurrence of label, as list.index does, raising a ValueError if it is missing.
+        """
+        try:
+            return self._exact[label][0]
+        except (KeyError, TypeError):
+            raise ValueError("%s is not in labels!" % str(label))
+
+    def equal(self, key, case_sensitive=False):
+        if case_sensitive:
+            return list(self._exact.get(key, []))
+        return list(self._lower.get(_lower_label(key), []))
+
+    def _contained_in_key(self, key):
+        # The indices of the labels, which are substrings of key:
+        inds = set()
+        for start in range(len(key)):
+            for end in range(start + 1, len(key) + 1):
+                inds.update(self._exact.get(key[start:end], []))
+        return inds
+
+    def find(self, key, two_way_search=False):
+        """
+        Return the indices of the labels containing key (i.e., label.find(key) >= 0),
+        or, if two_way_search is True, also of the labels contained in key.
+        """
+        key = str(key)
+        if len(key) == 0:
+            inds = set(range(len(self.labels)))
+        elif self.ngram == 0:
+            inds = set([ind for ind, string in enumerate(self._strings) if string.find(key) >= 0])
+        elif len(key) <= self.ngram:
+            inds = set(self._ngrams.get(key, []))
         else:
-            modefun = lambda x, y: x.find(y) >= 0
-    inds = []
-    keys = ensure_list(keys)
+            # Candidates have to contain all ngrams of the key:
+            candidates = None
+            for start in range(len(key) - self.ngram + 1):
+                ngram_inds = self._ngrams.get(key[start:start + self.ngram], [])
+                if candidates is None:
+                    candidates = set(ngram_inds)
+                else:
+                    candidates.intersection_update(ngram_inds)
+                if len(candidates) == 0:
+                    break
+            inds = set([ind for ind in candidates if self._strings[ind].find(key) >= 0])
+        if two_way_search:
+            inds.update(self._contained_in_key(key))
+        return sorted(inds)
+
+    def match(self, key, modefun="find", two_way_search=False):
+        if isequal_string(modefun, "equal"):
+            return self.equal(key)
+        return self.find(key, two_way_search)
+
+    def match_all(self, keys, modefun="find", two_way_search=False):
+        """
+        Batched search of keys, returning a list of the indices' lists of the matching labels, for each key.
+        """
+        return [self.match(key, modefun, two_way_search) for key in ensure_list(keys)]
+
+    def search(self, keys, modefun="find", two_way_search=False, break_after=CalculusConfig.MAX_INT_VALUE):
+        """
+        Return the indices of the labels matching any of the keys, key after key, as find_labels_inds does,
+        stopping after break_after matches.
+        """
+        inds = []
+        for key in ensure_list(keys):
+            inds += self.match(key, modefun, two_way_search)
+            if len(inds) >= break_after:
+                return inds[:break_after]
+        return inds
+
+    def labels_to_inds(self, target_labels):
+        if isinstance(target_labels, string_types):
+            return self.index(target_labels)
+        return [self.index(lbl) for lbl in target_labels]
+
+
+def _scan_labels(labels, key, modefun="find", two_way_search=False):
+    # A single scan of labels, with the same matches as LabelsIndex.match, but without building an index
+    if isequal_string(modefun, "equal"):
+        key = _lower_label(key)
+        return [ind for ind, label in enumerate(labels) if _lower_label(label) == key]
+    key = str(key)
+    return [ind for ind, label in enumerate(labels)
+            if str(label).find(key) >= 0 or
+            (two_way_search and isinstance(label, string_types) and len(label) > 0 and key.find(label) >= 0)]
+
+
+def find_labels_inds(labels, keys, modefun="find", two_way_search=False, break_after=np.iinfo(np.int64).max):
+    """
+    Return the indices of the labels matching any of the keys, key after key, stopping after break_after matches.
+    labels may be a LabelsIndex, for repeated searches in the same labels,
+    or else they are scanned once per key, which is faster for one-off searches than indexing them.
+    """
+    if isinstance(labels, LabelsIndex):
+        return labels.search(keys, modefun, two_way_search, break_after)
     labels = ensure_list(labels)
-    counts = 0
-    for key in keys:
-        for label in labels:
-            if modefun(label, key):
-               inds.append(labels.index(label))
-               counts += 1
-            if counts >= break_after:
-                return inds
+    inds = []
+    for key in ensure_list(keys):
+        inds += _scan_labels(labels, key, modefun, two_way_search)
+        if len(inds) >= break_after:
+            return inds[:break_after]
     return inds
 
 
 def extract_dict_stringkeys(d, keys, modefun="find", two_way_search=False,
                             break_after=CalculusConfig.MAX_INT_VALUE, remove=False):
-    # TODO: test that it works after modifying with find_labels_inds
     if remove:
         out_dict = deepcopy(d)
     else:
         out_dict = {}
-    inds_found = find_labels_inds(d.keys(), keys, modefun, two_way_search, break_after)
-    for ikey, (key, value) in enumerate(d.items()):
-        if ikey in inds_found:
-            if remove:
-                del out_dict[key]
-            else:
-                out_dict.update({key: value})
+    dict_keys = list(d.keys())
+    inds_found = find_labels_inds(dict_keys, keys, modefun, two_way_search, break_after)
+    for ind in sorted(set(inds_found)):
+        key = dict_keys[ind]
+        if remove:
+            del out_dict[key]
+        else:
+            out_dict.update({key: d[key]})
     return out_dict
 
 
@@ -416,20 +536,13 @@ def get_val_key_for_first_keymatch_in_dict(name, pkeys, **kwargs):
 
 
 def labels_to_inds(labels, target_labels):
-    if isinstance(target_labels, string_types):
-        return_single_element = True
-        target_labels = ensure_list(target_labels)
-    else:
-        target_labels = list(target_labels)
-        return_single_element = False
-    inds = []
-    for lbl in target_labels:
-        inds.append(labels.index(lbl))
-    if return_single_element:
-        # if there was only one label string input
-        return inds[0]
-    else:
-        return inds
+    """
+    Return the index (or the list of indices) of the first occurrence of target_labels in labels,
+    which may also be a LabelsIndex, in order to avoid indexing labels at every call.
+    """
+    if not isinstance(labels, LabelsIndex):
+        labels = LabelsIndex(labels, ngram=0)
+    return labels.labels_to_inds(target_labels)
 
 
 def generate_region_labels(n_regions, labels=[], str=". ", numbering=True, numbers=[]):
@@ -444,20 +557,63 @@ def generate_region_labels(n_regions, labels=[], str=". ", numbering=True, numbe
         return np.array(["%d" % l for l in numbers])
 
 
-def monopolar_to_bipolar(labels, indices=None, data=None):
+SENSOR_LABEL_PATTERN = re.compile(r"(\D*)(\d+)")
+
+
+def parse_sensors_labels(labels):
+    """
+    Parse sensors' labels into their electrodes' names (i.e., the text before the first number)
+    and their contacts' numbers, e.g., "B'12" -> ("B'", 12).
+    Labels without a number are assumed to be electrodes' names with a contact number of -1.
+    :return: an array of electrodes' names and an integer array of contacts' numbers
+    """
+    electrodes = []
+    numbers = []
+    for label in ensure_list(labels):
+        match = SENSOR_LABEL_PATTERN.match(label)
+        if match:
+            electrodes.append(match.group(1))
+            numbers.append(int(match.group(2)))
+        else:
+            electrodes.append(label)
+            numbers.append(-1)
+    return np.array(electrodes), np.array(numbers, dtype=np.int64)
+
+
+def bipolar_montage(labels, indices=None, parsed_labels=None):
+    """
+    Build the bipolar montage of the pairs of successive sensors (in the order of indices)
+    that are successive contacts of the same electrode, e.g., A1-A2, A2-A3, etc.
+    :param labels: the sensors' labels
+    :param indices: the indices of the sensors to consider, default: all
+    :param parsed_labels: the output of parse_sensors_labels(labels), if already computed
+    :return: the bipolar labels, the two lists of the pairs' indices,
+             and the sparse (bipolar sensors x sensors) difference operator
+    """
+    from scipy.sparse import csr_matrix
+    n_labels = len(labels)
     if indices is None:
-        indices = range(len(labels))
-    bipolar_lbls = []
-    bipolar_inds = [[], []]
-    for ind in range(len(indices) - 1):
-        iS1 = indices[ind]
-        iS2 = indices[ind + 1]
-        if (labels[iS1][0] == labels[iS2][0]) and \
-                int(re.findall(r'\d+', labels[iS1])[0]) == \
-                int(re.findall(r'\d+', labels[iS2])[0]) - 1:
-            bipolar_lbls.append(labels[iS1] + "-" + labels[iS2])
-            bipolar_inds[0].append(iS1)
-            bipolar_inds[1].append(iS2)
+        indices = np.arange(n_labels)
+    else:
+        indices = np.array(ensure_list(indices), dtype=np.int64)
+    if parsed_labels is None:
+        parsed_labels = parse_sensors_labels(labels)
+    electrodes = parsed_labels[0][indices]
+    numbers = parsed_labels[1][indices]
+    pairs = np.logical_and(electrodes[:-1] == electrodes[1:],
+                           np.logical_and(numbers[:-1] >= 0, numbers[1:] == numbers[:-1] + 1))
+    inds1 = indices[:-1][pairs]
+    inds2 = indices[1:][pairs]
+    bipolar_lbls = [labels[iS1] + "-" + labels[iS2] for iS1, iS2 in zip(inds1, inds2)]
+    n_bipolar = len(bipolar_lbls)
+    operator = csr_matrix((np.concatenate([np.ones((n_bipolar,)), -np.ones((n_bipolar,))]),
+                           (np.tile(np.arange(n_bipolar), 2), np.concatenate([inds1, inds2]))),
+                          shape=(n_bipolar, n_labels))
+    return bipolar_lbls, [inds1.tolist(), inds2.tolist()], operator
+
+
+def monopolar_to_bipolar(labels, indices=None, data=None):
+    bipolar_lbls, bipolar_inds, operator = bipolar_montage(labels, indices)
     if isinstance(data, np.ndarray):
         data = data[bipolar_inds[0]] - data[bipolar_inds[1]]
         return bipolar_lbls, bipolar_inds, data
@@ -727,74 +883,64 @@ def copy_object_attributes(obj1, obj2, attr1, attr2=None, deep_copy=False, check
 
 
 def sort_events_by_x_and_y(events, x="senders", y="times",
-                           filter_x=None, filter_y=None, exclude_x=[], exclude_y=[]):
-    xs = np.array(flatten_list(events[x]))
+                           filter_x=None, filter_y=None, exclude_x=[], exclude_y=[], output="dict"):
+    """
+    Group the y values of the events (e.g., spikes' times) by their x values (e.g., senders),
+    sorted by x and y via a single lexsort of all events, instead of masking all events for every x value.
+    :param filter_x, filter_y: if not None, keep only the events with x, respectively y values, in these collections
+    :param exclude_x, exclude_y: skip the events with x, respectively y values, in these collections
+    :param output: "dict" for an OrderedDict of the sorted y values' arrays per x value,
+                   or "csr" for a compact (x values, offsets, y values) tuple,
+                   where the sorted y values of x_values[i] are y_values[offsets[i]:offsets[i+1]]
+    """
+    xs = _events_to_array(events[x])
+    ys = _events_to_array(events[y])
     if filter_x is None:
-        xlabels = np.unique(xs).tolist()
+        xlabels = np.unique(xs)
     else:
-        xlabels = np.unique(flatten_list(filter_x)).tolist()
-    for xlbl in exclude_x:
-        try:
-            xlabels.remove(xlbl)
-        except:
-            pass
-    ys = flatten_list(events[y])
+        xlabels = np.unique(_events_to_array(filter_x))
+    if len(exclude_x) > 0:
+        xlabels = xlabels[np.logical_not(np.isin(xlabels, _events_to_array(exclude_x)))]
+    mask = np.isin(xs, xlabels)
     if filter_y is not None:
-        ys = [yy for yy in ys if yy in flatten_list(filter_y)]
-    for yy in exclude_y:
-        try:
-            ys.remove(yy)
-        except:
-            pass
-    ys = np.array(ys)
+        mask = np.logical_and(mask, np.isin(ys, _events_to_array(filter_y)))
+    if len(exclude_y) > 0:
+        mask = np.logical_and(mask, np.logical_not(np.isin(ys, _events_to_array(exclude_y))))
+    xs = xs[mask]
+    ys = ys[mask]
+    order = np.lexsort((ys, xs))
+    xs = xs[order]
+    ys = ys[order]
+    offsets = np.concatenate([np.searchsorted(xs, xlabels, side="left"), [xs.shape[0]]])
+    if isequal_string(output, "csr"):
+        return xlabels, offsets, ys
+    elif not isequal_string(output, "dict"):
+        raise_value_error("Output %s is not one of 'dict' or 'csr'!" % str(output))
     sorted_events = OrderedDict()
-    for xlbl in xlabels:
-        sorted_events[xlbl] = np.sort(ys[xs == xlbl])
+    for xlbl, ys_x in zip(xlabels.tolist(), np.split(ys, offsets[1:-1])):
+        sorted_events[xlbl] = ys_x
     return sorted_events
 
 
-def data_xarray_from_continuous_events(events, times, senders, variables=[],
-                                       filter_senders=None, exclude_senders=[], name=None,
-                                       dims_names=["Variable", "Neuron", "Time"]):
-    unique_times = np.unique(times).tolist()
+def _events_to_array(events_values):
+    # Events' values may come as arrays or as (nested) lists:
+    if isinstance(events_values, np.ndarray):
+        return events_values.ravel()
+    return np.array(flatten_list(ensure_list(events_values)))
+
+
+def _select_senders(senders, filter_senders=None, exclude_senders=[]):
+    # Return the sorted unique senders to be kept:
     if filter_senders is None:
-        filter_senders = np.unique(senders).tolist()
+        unique_senders = np.unique(senders)
     else:
-        filter_senders = np.unique(flatten_list(filter_senders)).tolist()
-    for sender in exclude_senders:
-        filter_senders.remove(sender)
-    if len(variables) is None:
-        variables = list(events.keys())
-    coords = OrderedDict()
-    coords[dims_names[0]] = variables
-    coords[dims_names[1]] = filter_senders
-    coords[dims_names[2]] = unique_times
-    n_senders = len(filter_senders)
-    n_times = len(unique_times)
-    data = np.empty((len(variables), n_senders, n_times))
-    last_time = times[0]
-    i_time = unique_times.index(last_time)
-    i_sender = -1
-    for id, (time, sender) in enumerate(zip(times, senders)):
-        # Try best guess of next sender:
-        i_sender += 1
-        if i_sender >= n_senders:
-            i_sender = 0
-        if filter_senders[i_sender] != sender:
-            try:
-                i_sender = filter_senders.index(sender)
-            except:
-                break  # This sender is not one of the chosen filter_senders
-        if time != last_time:
-            last_time = time
-            # Try best guess of next time index:
-            i_time += 1
-            if i_time >= n_times:
-                i_time = n_times - 1
-            if time != unique_times[i_time]:
-                i_time = unique_times.index(time)
-        for i_var, var in enumerate(variables):
-            data[i_var, i_sender, i_time] = events[var][id]
+        unique_senders = np.unique(_events_to_array(filter_senders))
+    if len(exclude_senders) > 0:
+        unique_senders = unique_senders[np.logical_not(np.isin(unique_senders, _events_to_array(exclude_senders)))]
+    return unique_senders
+
+
+def _continuous_events_data_xarray(data, coords, name=None):
     try:
         from xarray import DataArray
         return DataArray(data, dims=list(coords.keys()), coords=coords, name=name)
@@ -802,6 +948,99 @@ def data_xarray_from_continuous_events(events, times, senders, variables=[],
         return {"data": data, "dims": list(coords.keys()), "coords": coords, "name": name}
 
 
+def data_xarray_from_continuous_events(events, times, senders, variables=[],
+                                       filter_senders=None, exclude_senders=[], name=None,
+                                       dims_names=["Variable", "Neuron", "Time"]):
+    """
+    Convert continuous events (e.g., of a multimeter) to an array of shape (variables, senders, unique times),
+    with a single scatter assignment of all variables' values to the (sender, time) indices of the events,
+    which are computed via np.unique.
+    Entries without events are set to NaN.
+    :return: an xarray DataArray, or, if xarray is not available, a dictionary of data, dims, coords and name
+    """
+    times = _events_to_array(times)
+    senders = _events_to_array(senders)
+    if len(variables) == 0:
+        variables = [var for var in events.keys() if var not in ["times", "senders"]]
+    else:
+        variables = ensure_list(variables)
+    unique_times, i_times = np.unique(times, return_inverse=True)
+    unique_senders = _select_senders(senders, filter_senders, exclude_senders)
+    # Skip the events of senders that have not been chosen:
+    mask = np.isin(senders, unique_senders)
+    coords = OrderedDict()
+    coords[dims_names[0]] = variables
+    coords[dims_names[1]] = unique_senders.tolist()
+    coords[dims_names[2]] = unique_times.tolist()
+    data = np.full((len(variables), len(unique_senders), len(unique_times)), np.nan)
+    if len(variables) > 0:
+        data[:, np.searchsorted(unique_senders, senders[mask]), i_times[mask]] = \
+            np.array([_events_to_array(events[var])[mask] for var in variables])
+    return _continuous_events_data_xarray(data, coords, name)
+
+
+class ContinuousEventsAccumulator(object):
+    """
+    Streaming counterpart of data_xarray_from_continuous_events,
+    which accumulates batches of continuous events as they are produced by a simulation,
+    in buffers that double their capacity when full, and converts them to a DataArray at the end.
+    """
+
+    def __init__(self, variables, filter_senders=None, exclude_senders=[], capacity=1024):
+        self.variables = ensure_list(variables)
+        self.filter_senders = filter_senders
+        self.exclude_senders = exclude_senders
+        self.size = 0
+        capacity = int(max(1, capacity))
+        self._times = np.empty((capacity,))
+        self._senders = np.empty((capacity,), dtype=np.int64)
+        self._values = np.empty((len(self.variables), capacity))
+
+    @property
+    def capacity(self):
+        return self._times.shape[0]
+
+    def _grow(self, min_capacity):
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        for attr in ["_times", "_senders", "_values"]:
+            buffer = getattr(self, attr)
+            new_buffer = np.empty(buffer.shape[:-1] + (capacity,), dtype=buffer.dtype)
+            new_buffer[..., :self.size] = buffer[..., :self.size]
+            setattr(self, attr, new_buffer)
+
+    def append(self, events, times=None, senders=None):
+        """
+        Append a batch of events, where times and senders default to events["times"] and events["senders"].
+        """
+        times = _events_to_array(events["times"] if times is None else times)
+        senders = _events_to_array(events["senders"] if senders is None else senders)
+        mask = None
+        if self.filter_senders is not None or len(self.exclude_senders) > 0:
+            mask = np.isin(senders, _select_senders(senders, self.filter_senders, self.exclude_senders))
+            times = times[mask]
+            senders = senders[mask]
+        n_events = times.shape[0]
+        if self.size + n_events > self.capacity:
+            self._grow(self.size + n_events)
+        new_size = self.size + n_events
+        self._times[self.size:new_size] = times
+        self._senders[self.size:new_size] = senders
+        for i_var, var in enumerate(self.variables):
+            values = _events_to_array(events[var])
+            if mask is not None:
+                values = values[mask]
+            self._values[i_var, self.size:new_size] = values
+        self.size = new_size
+        return self
+
+    def to_data_xarray(self, name=None, dims_names=["Variable", "Neuron", "Time"]):
+        events = OrderedDict([(var, self._values[i_var, :self.size]) for i_var, var in enumerate(self.variables)])
+        return data_xarray_from_continuous_events(events, self._times[:self.size], self._senders[:self.size],
+                                                  self.variables, name=name, dims_names=dims_names)
+
+
 def property_to_fun(property):
     if hasattr(property, "__call__"):
         return property
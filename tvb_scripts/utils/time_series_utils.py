@@ -1,47 +1,219 @@
 # coding=utf-8
 from six import string_types
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import cycle
-from matplotlib.mlab import demean
 import numpy as np
-from scipy.stats import zscore
 from scipy.signal import butter, filtfilt, welch, periodogram, spectrogram, decimate
+from scipy.fft import rfft, ifft, next_fast_len
 from scipy.interpolate import interp1d, griddata
+from tvb_scripts.config import CalculusConfig
 from tvb_scripts.utils.log_error_utils import raise_value_error
 from tvb_scripts.utils.data_structures_utils import ensure_list, isequal_string
 
 
+# Output arrays:
+
+# All kernels that preserve the shape of their input accept the arguments out and inplace:
+# - by default (out=None, inplace=False), the input is left intact and the results are written to a new array,
+# - if out is given, the results are written to out, which has to be of the same shape as the input,
+# - if inplace=True, the results overwrite the input.
+# Thus, callers that own their data buffer can run whole preprocessing chains without temporary arrays.
+
+def prepare_output_array(x, out=None, inplace=False):
+    """
+    Return the array where the results of a kernel operating on x should be written, filled with x's values:
+    x itself if inplace is True, out if it is given, or else a new array (of float type, if x is not).
+    """
+    if inplace:
+        if out is not None and out is not x:
+            raise_value_error("Cannot compute in place and to a different output array at the same time!")
+        if not isinstance(x, np.ndarray) or x.dtype.kind not in "fc":
+            raise_value_error("Cannot compute in place for a non floating point input of type %s!" % str(type(x)))
+        return x
+    x = np.asarray(x)
+    if out is None:
+        return np.array(x, dtype=x.dtype if x.dtype.kind in "fc" else np.float64)
+    if out.shape != x.shape:
+        raise_value_error("The output array's shape %s does not match the input's shape %s!"
+                          % (str(out.shape), str(x.shape)))
+    if out is not x:
+        out[...] = x
+    return out
+
+
 # Pointwise analyzers:
 
 # x is assumed to be data (real numbers) arranged along the first dimension of an ndarray
 
-def interval_scaling(x, min_targ=0.0, max_targ=1.0, min_orig=None, max_orig=None):
+def interval_scaling(x, min_targ=0.0, max_targ=1.0, min_orig=None, max_orig=None, out=None, inplace=False):
     if min_orig is None:
         min_orig = np.min(x, axis=0)
     if max_orig is None:
         max_orig = np.max(x, axis=0)
     scale_factor = (max_targ - min_targ) / (max_orig - min_orig)
-    return min_targ + (x - min_orig) * scale_factor
+    x = prepare_output_array(x, out, inplace)
+    x -= min_orig
+    x *= scale_factor
+    x += min_targ
+    return x
 
 
-def abs_envelope(x):
-    x_mean = x.mean(axis=0) * np.ones(x.shape[1:])
+def abs_envelope(x, out=None, inplace=False):
+    x_mean = np.mean(x, axis=0)
+    x = prepare_output_array(x, out, inplace)
     # Mean center each signal
     x -= x_mean
     # Compute the absolute value and add back the mean
-    return np.abs(x) + x_mean
+    np.abs(x, out=x)
+    x += x_mean
+    return x
+
+
+def spectrogram_envelope(x, fs, lpf=None, hpf=None, nperseg=None, time_block=None):
+    """
+    Compute the power of the spectrogram within the frequency band (hpf, lpf) for all signals of x at once.
+    x can be of any dimensionality, with time along its first dimension.
+    The spectrogram is computed along the first axis of all signals together, and the band mask is applied once.
+    If time_block (in samples) is given, x is streamed in blocks of at most time_block samples,
+    which are aligned to the spectrogram's segments,
+    so that the result is identical to the one of a single call, but peak memory is bounded.
+    :return: the envelope, of shape (number of segments, ) + x.shape[1:], and the times of the segments' centers
+    """
+    n_times = x.shape[0]
+    if nperseg is None:
+        nperseg = 256
+    nperseg = int(min(nperseg, n_times))
+    # scipy.signal.spectrogram's default overlap:
+    noverlap = nperseg // 8
+    step = nperseg - noverlap
+    n_segments = (n_times - noverlap) // step
+    if time_block is None:
+        segments_per_block = n_segments
+    else:
+        segments_per_block = int(max(1, (time_block - noverlap) // step))
+    envelope = np.empty((n_segments,) + x.shape[1:])
+    fmask = None
+    for start_segment in range(0, n_segments, segments_per_block):
+        n_block_segments = min(segments_per_block, n_segments - start_segment)
+        start = start_segment * step
+        stop = start + (n_block_segments - 1) * step + nperseg
+        F, T, C = spectrogram(x[start:stop], fs, nperseg=nperseg, noverlap=noverlap, axis=0)
+        if fmask is None:
+            fmask = np.ones(F.shape, 'bool')
+            if hpf:
+                fmask *= F > hpf
+            if lpf:
+                fmask *= F < lpf
+        # C is of shape (frequencies, ) + x.shape[1:] + (segments, ):
+        envelope[start_segment:start_segment + n_block_segments] = np.moveaxis(C[fmask].sum(axis=0), -1, 0)
+    return envelope, (np.arange(n_segments) * step + nperseg / 2.0) / fs
+
+
+HILBERT_OUTPUTS = ["envelope", "phase", "frequency"]
+
 
+def analytic_signal(x, n_fft=None, fast_length=True):
+    """
+    Compute the analytic signal of the real signals of x along its first axis, as scipy.signal.hilbert does,
+    but via a real FFT of a length padded to the next fast one (i.e., a product of small primes),
+    which avoids the very slow FFTs of long prime lengths.
+    The computation precision follows the dtype of x (i.e., complex64 for float32 inputs).
+    """
+    n_times = x.shape[0]
+    if n_fft is None:
+        n_fft = n_times
+    if fast_length:
+        n_fft = next_fast_len(n_fft, real=True)
+    X = rfft(x, n=n_fft, axis=0)
+    # Double the positive frequencies and keep the zero and Nyquist ones:
+    X[1:(n_fft + 1) // 2] *= 2
+    Z = np.zeros((n_fft,) + x.shape[1:], dtype=X.dtype)
+    Z[:X.shape[0]] = X
+    return ifft(Z, axis=0, overwrite_x=True)[:n_times]
+
+
+def _hilbert_outputs_from_analytic(z, fs, outputs, results, slices, keep):
+    # Write the requested outputs of the analytic signal z to the results' arrays,
+    # keeping only the keep slice of z along time:
+    if "envelope" in outputs:
+        results["envelope"][slices] = np.abs(z[keep])
+    if "phase" in outputs:
+        results["phase"][slices] = np.angle(z[keep])
+    if "frequency" in outputs:
+        # The instantaneous frequency from the phase difference of successive samples, without unwrapping,
+        # repeating the last value for the last sample:
+        dphi = np.angle(z[1:] * np.conj(z[:-1]))
+        dphi = np.concatenate([dphi, dphi[-1:]], axis=0)
+        results["frequency"][slices] = dphi[keep] * (fs / (2 * np.pi))
+
+
+def hilbert_analysis(x, fs=1.0, outputs=("envelope",), fast_length=True, single_precision=False,
+                     channels_block=None, n_threads=1, time_block=None, time_overlap=None):
+    """
+    Compute the envelope, phase and/or instantaneous frequency of the signals of x from their analytic signal,
+    which is computed once for all outputs.
+    x can be of any dimensionality, with time along its first dimension.
+    The signals are processed in blocks of channels (i.e., of all dimensions but time),
+    so that only one block's complex analytic signal is in memory at a time.
+    :param fs: the sampling frequency, used to return the instantaneous frequency in Hz
+    :param outputs: any of "envelope", "phase", "frequency"
+    :param fast_length: if True, pad the FFT to the next fast length
+    :param single_precision: if True, compute in float32/complex64
+    :param channels_block: the number of channels per block.
+                           Default: fit the memory budget of CalculusConfig.MAX_SLAB_BYTES, and split in n_threads
+    :param n_threads: the number of threads processing blocks in parallel
+    :param time_block: if given, the signals are streamed along time in blocks of time_block samples,
+                       extended by time_overlap samples at both sides, which are discarded afterwards.
+                       The results approximate the ones of the whole signals, except for the recordings' edges.
+    :param time_overlap: the number of overlapping samples, default: time_block // 4
+    :return: a dictionary of arrays of the same shape as x, for each one of the outputs
+    """
+    outputs = ensure_list(outputs)
+    for output in outputs:
+        if output not in HILBERT_OUTPUTS:
+            raise_value_error("Hilbert output %s is not one of %s!" % (str(output), str(HILBERT_OUTPUTS)))
+    x = np.asarray(x)
+    shape = x.shape
+    n_times = shape[0]
+    dtype = np.float32 if single_precision else np.float64
+    x = x.reshape((n_times, -1))
+    n_channels = x.shape[1]
+    results = OrderedDict([(output, np.empty(x.shape, dtype=dtype)) for output in outputs])
+    if time_block is None or time_block >= n_times:
+        time_block = n_times
+        time_overlap = 0
+    elif time_overlap is None:
+        time_overlap = time_block // 4
+    n_threads = int(max(1, n_threads))
+    if channels_block is None:
+        # Approximately: the real input and the complex spectrum and analytic signal of the block:
+        bytes_per_channel = 5 * np.dtype(dtype).itemsize * next_fast_len(time_block + 2 * time_overlap, real=True)
+        channels_block = max(1, min(int(CalculusConfig.MAX_SLAB_BYTES // bytes_per_channel),
+                                    int(np.ceil(n_channels / n_threads))))
+    channels_block = int(max(1, channels_block))
+
+    def compute_block(block):
+        (ch_start, ch_end), (t_start, t_end) = block
+        start = max(0, t_start - time_overlap)
+        end = min(n_times, t_end + time_overlap)
+        z = analytic_signal(x[start:end, ch_start:ch_end].astype(dtype), fast_length=fast_length)
+        _hilbert_outputs_from_analytic(z, fs, outputs, results,
+                                       (slice(t_start, t_end), slice(ch_start, ch_end)),
+                                       slice(t_start - start, t_end - start))
 
-def spectrogram_envelope(x, fs, lpf=None, hpf=None, nperseg=None):
-    envelope = []
-    for xx in x.T:
-        F, T, C = spectrogram(xx, fs, nperseg=nperseg)
-        fmask = np.ones(F.shape, 'bool')
-        if hpf:
-            fmask *= F > hpf
-        if lpf:
-            fmask *= F < lpf
-        envelope.append(C[fmask].sum(axis=0))
-    return np.array(envelope).T, T
+    blocks = [((ch_start, min(ch_start + channels_block, n_channels)), (t_start, min(t_start + time_block, n_times)))
+              for ch_start in range(0, n_channels, channels_block) for t_start in range(0, n_times, time_block)]
+    if n_threads > 1 and len(blocks) > 1:
+        # numpy's and scipy's FFT computations release the GIL, and each block writes to its own part of the results:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(compute_block, blocks))
+    else:
+        for block in blocks:
+            compute_block(block)
+    for output in outputs:
+        results[output] = results[output].reshape(shape)
+    return results
 
 
 # Time domain:
@@ -65,62 +237,204 @@ def cut_signals_tails(signals, time, cut_tails):
 NORMALIZATION_METHODS = ["zscore", "mean", "min", "max", "baseline", "baseline-amplitude", "baseline-std", "minmax"]
 
 
-def normalize_signals(signals, normalization=None, axis=None, percent=None):
-    # Following pylab demean:
+class SignalsStatistics(object):
+    """
+    Accumulator of statistics of signals per channel, i.e., along the first dimension of the data,
+    computed in a single pass over successive chunks of the data:
+    - mean and variance, via Welford's online algorithm, in its parallel (chunk-wise) form,
+    - minimum and maximum,
+    - approximate percentiles, via a uniform random sample (reservoir) of the data, if percentiles is True.
+    The percentiles are exact as long as the number of samples does not exceed the reservoir size.
+    The reservoir grows with the samples up to its size, and the random sampling is seeded,
+    so that the percentiles are reproducible.
+    """
 
-    def matrix_subtract_along_axis(x, y, axis=0):
-        "Return x minus y, where y corresponds to some statistic of x along the specified axis"
-        if axis == 0 or axis is None or x.ndim <= 1:
-            return x - y
-        ind = [slice(None)] * x.ndim
-        ind[axis] = np.newaxis
-        return x - y[ind]
+    def __init__(self, reservoir_size=CalculusConfig.STATISTICS_RESERVOIR_SIZE, seed=0, percentiles=True):
+        self.reservoir_size = int(reservoir_size)
+        self.percentiles = percentiles
+        self._random = np.random.RandomState(seed)
+        self.n = 0
+        self.mean = None
+        self.min = None
+        self.max = None
+        self._m2 = None
+        self._reservoir = None
 
-    def matrix_divide_along_axis(x, y, axis=0):
-        "Return x divided by y, where y corresponds to some statistic of x along the specified axis"
-        if axis == 0 or axis is None or x.ndim <= 1:
-            return x / y
-        ind = [slice(None)] * x.ndim
-        ind[axis] = np.newaxis
-        return x / y[ind]
+    def update(self, x):
+        n_chunk = x.shape[0]
+        if n_chunk == 0:
+            return self
+        x = np.asarray(x, dtype="f8")
+        chunk_mean = x.mean(axis=0)
+        chunk_m2 = np.sum((x - chunk_mean) ** 2, axis=0)
+        if self.n == 0:
+            self.mean = chunk_mean
+            self._m2 = chunk_m2
+            self.min = x.min(axis=0)
+            self.max = x.max(axis=0)
+        else:
+            n = self.n + n_chunk
+            delta = chunk_mean - self.mean
+            self.mean = self.mean + delta * (float(n_chunk) / n)
+            self._m2 = self._m2 + chunk_m2 + delta ** 2 * (float(self.n) * n_chunk / n)
+            np.minimum(self.min, x.min(axis=0), out=self.min)
+            np.maximum(self.max, x.max(axis=0), out=self.max)
+        if self.percentiles:
+            self._update_reservoir(x)
+        self.n += n_chunk
+        return self
 
+    def _update_reservoir(self, x):
+        # Fill the reservoir first...
+        n_fill = max(0, min(self.reservoir_size - self.n, x.shape[0]))
+        if n_fill > 0:
+            if self._reservoir is None:
+                self._reservoir = x[:n_fill].copy()
+            else:
+                self._reservoir = np.concatenate([self._reservoir, x[:n_fill]])
+        # ...and then replace its samples with decreasing probability (Algorithm R):
+        if n_fill < x.shape[0]:
+            samples_inds = np.arange(self.n + n_fill, self.n + x.shape[0])
+            reservoir_inds = (self._random.random_sample(samples_inds.shape) * (samples_inds + 1)).astype("i8")
+            replace = reservoir_inds < self.reservoir_size
+            self._reservoir[reservoir_inds[replace]] = x[n_fill:][replace]
+
+    def compute(self, x, chunk_size=None):
+        """
+        Update the statistics with all samples of x, in chunks of chunk_size along its first dimension.
+        """
+        if chunk_size is None:
+            chunk_size = max(1, CalculusConfig.MAX_SLAB_BYTES // max(8 * np.prod(x.shape[1:]), 1))
+        for start in range(0, x.shape[0], int(chunk_size)):
+            self.update(x[start:start + int(chunk_size)])
+        return self
+
+    @property
+    def var(self):
+        return self._m2 / self.n
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def percentile(self, q):
+        if not self.percentiles:
+            raise_value_error("Percentiles have not been gathered by these SignalsStatistics!")
+        return np.percentile(self._reservoir[:min(self.n, self.reservoir_size)], q, axis=0)
+
+
+def _normalization_steps(norm, prcnd):
+    # Decompose a normalization method to a list of elementary steps (operation, statistic, percent)
+    if isequal_string(norm, "zscore"):
+        return [("subtract", "mean", None), ("divide", "std", None)]
+    elif isequal_string(norm, "minmax"):
+        return [("subtract", "min", None), ("divide", "max", None)]
+    elif norm.find("baseline") == 0 and norm.find("-") > 0:
+        baseline_prcnd = None
+        other_prcnd = None
+        if prcnd is not None:
+            if np.size(prcnd) == 2:
+                other_prcnd = prcnd
+            else:
+                baseline_prcnd = prcnd
+        return _normalization_steps("baseline", baseline_prcnd) + \
+               _normalization_steps(norm.split("-")[1], other_prcnd)
+    elif isequal_string(norm, "mean"):
+        return [("subtract", "mean", None)]
+    elif isequal_string(norm, "baseline"):
+        if prcnd is None:
+            prcnd = 1
+        return [("subtract", "percentile", prcnd)]
+    elif isequal_string(norm, "min"):
+        return [("subtract", "min", None)]
+    elif isequal_string(norm, "max"):
+        return [("divide", "max", None)]
+    elif isequal_string(norm, "std"):
+        return [("divide", "std", None)]
+    elif norm.find("amplitude") >= 0:
+        if prcnd is None:
+            prcnd = [1, 99]
+        return [("divide", norm.split("amplitude")[0].lower() + "amplitude", prcnd)]
+    else:
+        raise_value_error("Ignoring signals' normalization " + norm +
+                          ",\nwhich is not one of the currently available " + str(NORMALIZATION_METHODS) + "!")
+
+
+def _compose_normalization_steps(stats, steps, stats_percentile=None):
+    # Compose the steps to a single transformation (x - offset) / scale, where offset and scale are computed from
+    # the statistics of the original signals, transformed by all previous steps.
+    # stats_percentile, if given, replaces stats.percentile, e.g., by exact percentiles of in-memory signals.
+    if stats_percentile is None:
+        stats_percentile = stats.percentile
+    offset = 0.0
+    scale = 1.0
+
+    def percentile(q):
+        # Percentiles are reversed by a negative scale
+        return np.where(np.array(scale) > 0, stats_percentile(q), stats_percentile(100.0 - np.array(q)))
+
+    for operation, statistic, prcnd in steps:
+        if statistic == "mean":
+            value = (stats.mean - offset) / scale
+        elif statistic == "std":
+            value = stats.std / np.abs(scale)
+        elif statistic == "min":
+            value = np.where(np.array(scale) > 0, (stats.min - offset) / scale, (stats.max - offset) / scale)
+        elif statistic == "max":
+            value = np.where(np.array(scale) > 0, (stats.max - offset) / scale, (stats.min - offset) / scale)
+        elif statistic == "percentile":
+            value = (percentile(prcnd) - offset) / scale
+        else:
+            # amplitude:
+            value = (percentile(prcnd[1]) - percentile(prcnd[0])) / np.abs(scale)
+            if statistic == "maxamplitude":
+                value = value.max()
+            elif statistic == "meanamplitude":
+                value = value.mean()
+        if operation == "subtract":
+            offset = offset + scale * value
+        else:
+            scale = scale * value
+    return offset, scale
+
+
+def normalize_signals(signals, normalization=None, axis=None, percent=None, out=None, inplace=False):
+    """
+    Normalize signals by one or more methods in NORMALIZATION_METHODS, applied successively.
+    The statistics of the signals along each axis
+    are gathered in a single chunked pass (see SignalsStatistics),
+    and all successive normalizations along the same axis are applied in a single in-place sweep.
+    Percentiles, if needed, are computed exactly, since the signals are in memory.
+    axis=None computes the statistics across all data.
+    """
+    signals = prepare_output_array(signals, out, inplace)
+
+    # Group successive steps along the same axis:
+    groups = []
     for norm, ax, prcnd in zip(ensure_list(normalization), cycle(ensure_list(axis)), cycle(ensure_list(percent))):
         if isinstance(norm, string_types):
-            if isequal_string(norm, "zscore"):
-                signals = zscore(signals, axis=ax)  # / 3.0
-            elif isequal_string(norm, "baseline-std"):
-                signals = normalize_signals(["baseline", "std"], axis=axis)
-            elif norm.find("baseline") == 0 and norm.find("amplitude") >= 0:
-                signals = normalize_signals(signals, ["baseline", norm.split("-")[1]], axis=axis, percent=percent)
-            elif isequal_string(norm, "minmax"):
-                signals = normalize_signals(signals, ["min", "max"], axis=axis)
-            elif isequal_string(norm, "mean"):
-                signals = demean(signals, axis=ax)
-            elif isequal_string(norm, "baseline"):
-                if prcnd is None:
-                    prcnd = 1
-                signals = matrix_subtract_along_axis(signals, np.percentile(signals, prcnd, axis=ax), axis=ax)
-            elif isequal_string(norm, "min"):
-                signals = matrix_subtract_along_axis(signals, np.min(signals, axis=ax), axis=ax)
-            elif isequal_string(norm, "max"):
-                signals = matrix_divide_along_axis(signals, np.max(signals, axis=ax), axis=ax)
-            elif isequal_string(norm, "std"):
-                signals = matrix_divide_along_axis(signals, signals.std(axis=ax), axis=ax)
-            elif norm.find("amplitude") >= 0:
-                if prcnd is None:
-                    prcnd = [1, 99]
-                amplitude = np.percentile(signals, prcnd[1], axis=ax) - np.percentile(signals, prcnd[0], axis=ax)
-                this_ax = ax
-                if isequal_string(norm.split("amplitude")[0], "max"):
-                    amplitude = amplitude.max()
-                    this_ax = None
-                elif isequal_string(norm.split("amplitude")[0], "mean"):
-                    amplitude = amplitude.mean()
-                    this_ax = None
-                signals = matrix_divide_along_axis(signals, amplitude, axis=this_ax)
+            steps = _normalization_steps(norm, prcnd)
+            if len(groups) > 0 and groups[-1][0] == ax:
+                groups[-1][1].extend(steps)
             else:
-                raise_value_error("Ignoring signals' normalization " + normalization +
-                                  ",\nwhich is not one of the currently available " + str(NORMALIZATION_METHODS) + "!")
+                groups.append((ax, steps))
+
+    for ax, steps in groups:
+        if ax is None:
+            samples = signals.reshape((-1, 1))
+        else:
+            samples = np.moveaxis(signals, ax, 0)
+        stats = SignalsStatistics(percentiles=False).compute(samples)
+        offset, scale = _compose_normalization_steps(stats, steps,
+                                                     lambda q: np.percentile(samples, q, axis=0))
+        if ax is not None:
+            offset = np.expand_dims(offset, ax) if np.ndim(offset) > 0 else offset
+            scale = np.expand_dims(scale, ax) if np.ndim(scale) > 0 else scale
+        else:
+            offset = np.squeeze(offset)
+            scale = np.squeeze(scale)
+        signals -= offset
+        signals /= scale
     return signals
 
 
@@ -140,13 +454,21 @@ def _butterworth_bandpass(fs, mode, lowcut, highcut, order=3):
     return b, a
 
 
-def filter_data(data, fs, lowcut=None, highcut=None, mode='bandpass', order=3, axis=0):
+def filter_data(data, fs, lowcut=None, highcut=None, mode='bandpass', order=3, axis=0, out=None, inplace=False):
     # get filter coefficients
     b, a = _butterworth_bandpass(fs, mode, lowcut, highcut, order)
     # filter data
     y = filtfilt(b, a, data, axis=axis)
     # y = lfilter(b, a, data, axis=axis)
-    return y
+    if out is None and not inplace:
+        return y
+    # filtfilt always computes into a new array, which is then copied to the output one:
+    output = prepare_output_array(data, out, inplace) if inplace else out
+    if output.shape != y.shape:
+        raise_value_error("The output array's shape %s does not match the input's shape %s!"
+                          % (str(output.shape), str(y.shape)))
+    output[...] = y
+    return output
 
 
 def spectral_analysis(x, fs, freq=None, method="periodogram", output="spectrum", nfft=None, window='hanning',
@@ -214,3 +536,32 @@ def time_spectral_analysis(x, fs, freq=None, mode="psd", nfft=None, window='hann
         return stf, t, freq, psd
     else:
         return stf, t, freq
+
+
+# Linear operators:
+
+def apply_linear_operator(operator, data, axis=2, time_block=None, out=None):
+    """
+    Apply a (dense or sparse) operator of shape (n_out, n_in) to data along axis (e.g., space, axis 2),
+    with one matrix product per block of time_block time points (axis 0), in order to bound peak memory.
+    :return: the output data, of the same shape as data, except for dimension axis, which is of size n_out
+    """
+    if axis == 0 or axis == -data.ndim:
+        raise_value_error("Linear operators can only be applied along a dimension other than time (axis 0)!")
+    if operator.shape[1] != data.shape[axis]:
+        raise_value_error("The operator's shape %s does not match the data's dimension %d of size %d!"
+                          % (str(operator.shape), axis, data.shape[axis]))
+    shape = list(data.shape)
+    shape[axis] = operator.shape[0]
+    if out is None:
+        out = np.empty(shape, dtype=np.result_type(data.dtype, operator.dtype))
+    n_times = data.shape[0]
+    if time_block is None:
+        time_block = n_times
+    time_block = int(max(1, time_block))
+    for start in range(0, n_times, time_block):
+        block = np.moveaxis(data[start:start + time_block], axis, 0)
+        block_shape = block.shape
+        result = np.asarray(operator.dot(block.reshape((block_shape[0], -1))))
+        out[start:start + time_block] = np.moveaxis(result.reshape((operator.shape[0],) + block_shape[1:]), 0, axis)
+    return out